@@ -1,11 +1,27 @@
+from contextlib import asynccontextmanager
+from itertools import cycle
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncConnection, create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base
-from typing import Generator
+from typing import Generator, AsyncGenerator, AsyncIterator
 
 from .config import settings
 
 
-engine = create_engine(settings.database_url, future=True)
+def _pool_options() -> dict:
+    return {
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout_seconds,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+        "pool_recycle": settings.db_pool_recycle_seconds,
+    }
+
+
+# Primary: ingestion, index maintenance and scripts write here.
+engine = create_engine(settings.database_url, future=True, **_pool_options())
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 Base = declarative_base()
 
@@ -16,3 +32,70 @@ def get_db() -> Generator:
         yield db
     finally:
         db.close()
+
+
+def _async_url(url: str) -> str:
+    # Same database, asyncpg driver: postgresql[+psycopg2]:// -> postgresql+asyncpg://
+    return make_url(url).set(drivername="postgresql+asyncpg").render_as_string(hide_password=False)
+
+
+def _request_connect_args() -> dict:
+    # statement_timeout as a startup parameter: every query on these
+    # connections is bounded server-side, without a SET round trip per search.
+    if not settings.search_statement_timeout_ms:
+        return {}
+    return {"server_settings": {"statement_timeout": str(int(settings.search_statement_timeout_ms))}}
+
+
+def _request_engine(url: str):
+    return create_async_engine(_async_url(url), connect_args=_request_connect_args(), **_pool_options())
+
+
+# Async engine for the request path. Vectors travel in pgvector's text form via
+# pgvector.sqlalchemy.Vector, which asyncpg passes through for extension types.
+async_engine = _request_engine(settings.async_database_url or settings.database_url)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+# Search reads go round-robin to the replicas, or to the primary without any.
+# Replicas lag a little, so a just-ingested case (and the corpus_version bump
+# the result cache keys on) can take a moment to show up in search.
+read_engines = [
+    _request_engine(url.strip()) for url in (settings.database_read_urls or "").split(",") if url.strip()
+] or [async_engine]
+_next_read_engine = cycle(read_engines)
+
+
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+@asynccontextmanager
+async def read_connection() -> AsyncIterator[AsyncConnection]:
+    """Plain read-only connection for search, without an ORM session.
+
+    Falls back to the primary when the chosen replica cannot be reached. The
+    transaction is rolled back on exit, ending any SET LOCAL state.
+    """
+    engine = next(_next_read_engine)
+    try:
+        conn = await engine.connect()
+    except (DBAPIError, OSError):
+        if engine is async_engine:
+            raise
+        conn = await async_engine.connect()
+    try:
+        await conn.execution_options(postgresql_readonly=True)
+        yield conn
+    finally:
+        await conn.close()
+
+
+async def get_async_read_db() -> AsyncGenerator[AsyncConnection, None]:
+    async with read_connection() as conn:
+        yield conn
+
+
+def is_statement_timeout(exc: DBAPIError) -> bool:
+    # SQLSTATE 57014 query_canceled (psycopg2 and asyncpg both expose pgcode).
+    return getattr(exc.orig, "pgcode", None) == "57014" or getattr(exc.orig, "sqlstate", None) == "57014"
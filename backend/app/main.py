@@ -1,12 +1,23 @@
+import asyncio
+import logging
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from sqlalchemy import text
 
 from .config import settings
+from .database import async_engine
 from .routers.search import router as search_router
+from .routers.metrics import router as metrics_router
 from .services.embedding_service import get_embedding_service
+from .services.local_index import get_local_index
+
+logger = logging.getLogger(__name__)
 
 
 app = FastAPI(title="MediMatch")
+app.state.model_ready = False
 
 app.add_middleware(
     CORSMiddleware,
@@ -17,10 +28,41 @@ app.add_middleware(
 )
 
 
+async def _load_model():
+    try:
+        svc = await asyncio.to_thread(get_embedding_service, settings.device)
+        if settings.model_warmup:
+            await asyncio.to_thread(svc.warmup)
+    except Exception:
+        logger.exception("model load failed; readiness stays false")
+        raise
+    app.state.model_ready = True
+
+
 @app.on_event("startup")
-def startup_event():
-    # Load embedding service on startup
-    get_embedding_service(device=settings.device)
+async def startup_event():
+    # Load (and warm) the embedding service on startup; in background mode the
+    # server is live immediately but not ready until this finishes.
+    if settings.model_preload == "background":
+        app.state.model_loader = asyncio.create_task(_load_model())
+    else:
+        await _load_model()
+
+
+async def _refresh_local_index():
+    index = get_local_index()
+    while True:
+        try:
+            await asyncio.to_thread(index.refresh)
+        except Exception:
+            logger.exception("local index refresh failed")
+        await asyncio.sleep(settings.local_index_refresh_seconds)
+
+
+@app.on_event("startup")
+async def start_local_index():
+    if settings.search_backend == "local":
+        app.state.local_index_refresher = asyncio.create_task(_refresh_local_index())
 
 
 @app.get("/")
@@ -30,7 +72,38 @@ def root():
 
 @app.get("/health")
 def health():
+    return {"status": "ok", "ready": app.state.model_ready}
+
+
+@app.get("/health/live")
+def liveness():
+    """The process is up and serving; restart it only if this fails."""
     return {"status": "ok"}
 
 
+@app.get("/health/ready")
+async def readiness():
+    """Route traffic here only once the model is loaded and warm and the
+    database (and the embedding worker, when one is configured) answers."""
+    checks = {"model": app.state.model_ready, "database": False}
+    try:
+        async with async_engine.connect() as conn:
+            await asyncio.wait_for(conn.execute(text("SELECT 1")), timeout=2.0)
+        checks["database"] = True
+    except Exception:
+        pass
+    if settings.embedding_worker_socket:
+        checks["embedding_worker"] = False
+        if app.state.model_ready:
+            try:
+                svc = get_embedding_service(settings.device)
+                await asyncio.wait_for(asyncio.to_thread(svc.health), timeout=2.0)
+                checks["embedding_worker"] = True
+            except Exception:
+                pass
+    ready = all(checks.values())
+    return JSONResponse({"status": "ready" if ready else "starting", **checks}, status_code=200 if ready else 503)
+
+
 app.include_router(search_router)
+app.include_router(metrics_router)
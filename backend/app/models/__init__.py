@@ -1,5 +1,6 @@
 """Models package for backend."""
 
 from .medical_case import MedicalCase
+from .corpus_version import CorpusVersion
 
-__all__ = ["MedicalCase"]
+__all__ = ["MedicalCase", "CorpusVersion"]
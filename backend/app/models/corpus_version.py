@@ -0,0 +1,17 @@
+from sqlalchemy import Column, Integer, BigInteger, TIMESTAMP
+from sqlalchemy.sql import func
+
+from ..database import Base
+
+
+class CorpusVersion(Base):
+    """Single-row counter bumped whenever loaders change medical_cases.
+
+    Caches derived from search results compare against it to invalidate.
+    """
+
+    __tablename__ = "corpus_version"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(TIMESTAMP(timezone=True), onupdate=func.now(), server_default=func.now())
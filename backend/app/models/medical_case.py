@@ -20,8 +20,13 @@ class MedicalCase(Base):
     clinical_notes = Column(Text, nullable=True)
     image_path = Column(String, nullable=True)
     image_url = Column(String, nullable=True)
+    # SHA-256 of the original image file bytes; lets re-uploads reuse image_embedding.
+    image_sha256 = Column(String(64), nullable=True, index=True)
     image_embedding = Column(Vector(512), nullable=False)
     text_embedding = Column(Vector(512), nullable=True)
+    # CLIP model that produced image_embedding/text_embedding; NULL on rows
+    # loaded before this was recorded (ViT-B/32).
+    embedding_model = Column(String(100), nullable=True)
     source = Column(String, default="custom")
     # `metadata` is a reserved attribute name on Declarative Base (Base.metadata).
     # Use a different Python attribute name but keep the DB column name as `metadata`.
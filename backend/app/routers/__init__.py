@@ -1,5 +1,6 @@
 """API routers package."""
 
 from .search import router as search_router
+from .metrics import router as metrics_router
 
-__all__ = ["search_router"]
+__all__ = ["search_router", "metrics_router"]
@@ -0,0 +1,101 @@
+from fastapi import APIRouter, Request
+from fastapi.responses import PlainTextResponse
+
+from ..config import settings
+from ..database import engine, async_engine, read_engines
+from ..services import telemetry
+from ..services.embedding_service import get_embedding_service
+from ..services.local_index import get_local_index
+from ..services.inference_executor import get_inference_executor
+from ..services.result_cache import get_result_cache
+
+router = APIRouter()
+
+
+def pool_stats(pool) -> dict:
+    """Occupancy of a QueuePool; saturation is checked-out / (size + overflow)."""
+    if not hasattr(pool, "checkedout"):
+        return {}
+    capacity = pool.size() + max(0, getattr(pool, "_max_overflow", 0))
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "overflow": max(0, pool.overflow()),
+        "saturation": pool.checkedout() / capacity if capacity > 0 else None,
+    }
+
+
+def _db_pools() -> dict:
+    pools = {"sync": pool_stats(engine.pool), "async": pool_stats(async_engine.sync_engine.pool)}
+    for i, replica in enumerate(e for e in read_engines if e is not async_engine):
+        pools[f"replica_{i}"] = pool_stats(replica.sync_engine.pool)
+    return pools
+
+
+@router.get("/api/metrics")
+def metrics_endpoint():
+    svc = get_embedding_service(device=settings.device)
+    result_cache = get_result_cache()
+    return {
+        "embedding": svc.stats(),
+        "inference_executor": get_inference_executor().stats(),
+        "db_pools": _db_pools(),
+        "result_cache": result_cache.stats() if result_cache else None,
+        "local_index": get_local_index().stats() if settings.search_backend == "local" else None,
+    }
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics(request: Request):
+    """Prometheus text exposition: per-stage latency histograms plus pool and
+    queue gauges read at scrape time."""
+    blocks = []
+
+    pools = _db_pools()
+    for key, help in (
+        ("size", "Connections kept in the pool."),
+        ("checked_out", "Connections currently in use."),
+        ("overflow", "Connections open beyond the pool size."),
+        ("saturation", "Checked-out connections over pool size plus max overflow."),
+    ):
+        blocks.append(
+            telemetry.gauge_lines(
+                f"medimatch_db_pool_{key}", help, [({"engine": name}, p.get(key)) for name, p in pools.items()]
+            )
+        )
+
+    executor = get_inference_executor().stats()
+    blocks.append(telemetry.gauge_lines(
+        "medimatch_inference_inflight", "Inference calls running or waiting.", [({}, executor["inflight"])]
+    ))
+    blocks.append(telemetry.gauge_lines(
+        "medimatch_inference_queue_depth", "Inference calls waiting for an executor thread.", [({}, executor["queued"])]
+    ))
+    blocks.append(telemetry.gauge_lines(
+        "medimatch_inference_capacity", "Executor threads plus queue slots.",
+        [({}, executor["max_workers"] + executor["max_queue"])],
+    ))
+
+    # Only read the model's queues once it is loaded; a scrape must not load it.
+    if request.app.state.model_ready:
+        stats = get_embedding_service(device=settings.device).stats()
+        depths = [
+            ({"queue": name}, (stats.get(f"{name}_batcher") or {}).get("queue_depth"))
+            for name in ("text", "image")
+        ]
+        worker = stats.get("worker") or {}
+        depths += [({"queue": f"worker_{kind}"}, n) for kind, n in (worker.get("queue_depth") or {}).items()]
+        blocks.append(telemetry.gauge_lines(
+            "medimatch_embedding_queue_depth", "Items waiting for a CLIP forward pass.", depths
+        ))
+
+    result_cache = get_result_cache()
+    if result_cache is not None:
+        cache = result_cache.stats()
+        blocks.append(telemetry.gauge_lines(
+            "medimatch_result_cache_lookups_total", "Result cache lookups by outcome.",
+            [({"outcome": "hit"}, cache["hits"]), ({"outcome": "miss"}, cache["misses"])],
+            kind="counter",
+        ))
+
+    return PlainTextResponse(telemetry.render(blocks), media_type="text/plain; version=0.0.4")
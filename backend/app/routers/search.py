@@ -1,61 +1,671 @@
-from fastapi import APIRouter, Depends, HTTPException
+import asyncio
+import hashlib
+import json
+import time
+
+from contextlib import asynccontextmanager
+from fastapi import APIRouter, HTTPException, Query, Request, Response
 from fastapi import status
-from typing import List
-from sqlalchemy.orm import Session
+from fastapi.responses import StreamingResponse
+from typing import AsyncIterator, List, Literal, Optional, Tuple
+
+from PIL import UnidentifiedImageError
+from starlette.datastructures import UploadFile
+
+import numpy as np
+from sqlalchemy.exc import DBAPIError, TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncConnection
 
-from ..schemas.case import SearchRequest, SearchResponse, MedicalCaseResponse
-from ..database import get_db
-from ..services.embedding_service import get_embedding_service
-from ..services.search_service import SearchService
+from ..config import settings
+from ..schemas.case import (
+    SearchRequest,
+    SearchResponse,
+    MedicalCaseResponse,
+    BatchSearchRequest,
+    BatchSearchResult,
+    BatchSearchResponse,
+)
+from ..database import is_statement_timeout, read_connection
+from ..services.embedding_service import (
+    get_embedding_service,
+    decode_base64_image,
+    decode_image,
+    image_digest,
+    ImageTooLarge,
+)
+from ..services.embedding_worker import EmbeddingWorkerClient, EmbeddingWorkerUnavailable
+from ..services.local_index import get_local_index
+from ..services.pagination import decode_cursor, encode_cursor, query_fingerprint
+from ..services.inference_executor import get_inference_executor, InferenceQueueFull
+from ..services.result_cache import get_result_cache, get_version_tracker, search_cache_key
+from ..services.search_service import DETAIL_FIELDS, SearchService
+from ..services.telemetry import (
+    INFERENCE_REJECTED,
+    POOL_TIMEOUTS,
+    current_timer,
+    filter_label,
+    request_timer,
+    stage,
+)
 
 router = APIRouter()
 
+RETRY_AFTER_SECONDS = "1"
+UPLOAD_CHUNK_BYTES = 64 * 1024
 
-@router.post("/api/search", response_model=SearchResponse)
-def search_endpoint(req: SearchRequest, db: Session = Depends(get_db)):
-    svc = get_embedding_service(device="cpu")
 
+def _busy(detail: str) -> HTTPException:
+    timer = current_timer()
+    if timer is not None:
+        counter = POOL_TIMEOUTS if detail.startswith("database") else INFERENCE_REJECTED
+        counter.inc(timer.endpoint)
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=detail,
+        headers={"Retry-After": RETRY_AFTER_SECONDS},
+    )
+
+
+@asynccontextmanager
+async def _read_db() -> AsyncIterator[AsyncConnection]:
+    """``read_connection`` for a search endpoint. Opened inside the request
+    timer, so a pool timeout while acquiring it is a counted 503 like one
+    during the search, not a 500 from a dependency."""
+    try:
+        async with read_connection() as db:
+            yield db
+    except PoolTimeoutError:
+        raise _busy("database busy, retry later")
+
+
+async def _stored_image_embedding(svc, raw: bytes, db: AsyncConnection):
+    """Reuse an embedding without inference when this exact image was seen before."""
+    digest = image_digest(raw)
+    vec = svc.cached_image_embedding(digest)
+    if vec is not None:
+        return digest, vec.tolist()
+    with stage("embedding_lookup"):
+        stored = await db.run_sync(lambda session: SearchService(session).stored_image_embedding(digest))
+    if stored is not None:
+        svc.cache_image_embedding(digest, stored)
+    return digest, stored
+
+
+async def _embed(req: SearchRequest, db: AsyncConnection) -> List[float]:
+    svc = get_embedding_service(device=settings.device)
+    executor = get_inference_executor()
+    try:
+        if req.image:
+            try:
+                with stage("decode"):
+                    raw = decode_base64_image(req.image)
+            except ValueError:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="image is not valid base64")
+            digest, stored = await _stored_image_embedding(svc, raw, db)
+            if stored is not None:
+                return stored
+            emb = await executor.run(svc.encode_image_bytes, raw, digest)
+        else:
+            emb = await executor.run(svc.encode_text, req.query)
+    except InferenceQueueFull:
+        raise _busy("inference queue full, retry later")
+    except EmbeddingWorkerUnavailable:
+        raise _busy("embedding worker unavailable, retry later")
+    except ImageTooLarge as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    except (UnidentifiedImageError, OSError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="image is not decodable")
+
+    # emb is numpy array (N, dim) or (1, dim)
+    if emb.ndim == 2:
+        return emb[0].tolist()
+    return emb.tolist()
+
+
+@router.post("/api/search", response_model=SearchResponse)
+async def search_endpoint(req: SearchRequest):
     if not req.query and not req.image:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="query or image required")
 
+    with request_timer("/api/search", filter_label(req.modality, req.body_part)):
+        async with _read_db() as db:
+            q = await _embed(req, db)
+            return await _run_search(req, q, db, source=_query_source(req))
+
+
+def _query_source(req: SearchRequest) -> str:
     if req.image:
-        emb = svc.encode_image(req.image)
-    else:
-        emb = svc.encode_text(req.query)
+        return "image:" + hashlib.sha256(req.image.encode("ascii", "replace")).hexdigest()
+    return f"text:{req.query}"
 
-    # emb is numpy array (N, dim) or (1, dim)
-    if emb.ndim == 2:
-        q = emb[0].tolist()
+
+def _page_after(req: SearchRequest, source: str) -> Tuple[Optional[Tuple[float, int]], str]:
+    """Keyset to continue from (``None`` for the first page) and the query
+    fingerprint next_cursor is issued for."""
+    fingerprint = query_fingerprint(source, req.modality, req.body_part, req.similarity_threshold)
+    if not req.cursor:
+        return None, fingerprint
+    if req.mode != "vector":
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="cursor pagination supports mode=vector only")
+    try:
+        return decode_cursor(req.cursor, fingerprint), fingerprint
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
+async def _corpus_version(db: AsyncConnection) -> int:
+    """Current corpus version, once this process is known to search vectors
+    from the model it encodes queries with. A reembed cutover switches the
+    stored vectors to another model; until this process is restarted with it
+    (and a local index is rebuilt from it), searching would return wrong
+    neighbours, so answer 503 instead."""
+    version, live = await get_version_tracker().current(db)
+    if live is None:
+        return version
+    svc = get_embedding_service(device=settings.device)
+    model = svc.model_name
+    if model is None and isinstance(svc, EmbeddingWorkerClient):
+        # Not learned from the worker yet; asking it is a blocking socket call.
+        model = await asyncio.to_thread(svc.fetch_model_name)
+    if model is not None and model != live:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"cases are embedded with {live} but queries with {model}; restart with EMBEDDING_MODEL={live}",
+        )
+    if settings.search_backend == "local" and get_local_index().model != live:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"local index is being rebuilt for {live}",
+            headers={"Retry-After": RETRY_AFTER_SECONDS},
+        )
+    return version
+
+
+def _timing_headers(headers: dict) -> dict:
+    timer = current_timer()
+    if timer is not None:
+        headers["Server-Timing"] = timer.server_timing()
+    return headers
+
+
+async def _run_search(
+    req: SearchRequest, q: List[float], db: AsyncConnection, headers: Optional[dict] = None, source: str = ""
+) -> Response:
+    headers = dict(headers or {})
+    after, fingerprint = _page_after(req, source)
+    version = await _corpus_version(db)
+    # A hit returns the stored JSON as-is, skipping SQL and pydantic entirely.
+    cache = get_result_cache()
+    if cache is not None:
+        key = search_cache_key(
+            q,
+            modality=req.modality,
+            body_part=req.body_part,
+            limit=req.limit,
+            similarity_threshold=req.similarity_threshold,
+            ef_search=req.ef_search or settings.hnsw_ef_search,
+            probes=req.probes or settings.ivfflat_probes,
+            mode=req.mode,
+            view=req.view,
+            cursor=req.cursor,
+            **(
+                {"query": req.query, "fusion": req.fusion, "weights": req.weights, "candidates": req.candidates}
+                if req.mode == "hybrid"
+                else {}
+            ),
+        )
+        body = cache.get(key, version)
+        if body is not None:
+            timer = current_timer()
+            if timer is not None:
+                timer.cache = "hit"
+            headers["X-Cache"] = "HIT"
+            return Response(content=body, media_type="application/json", headers=_timing_headers(headers))
+
+    include_details = req.view == "full"
+    timer = current_timer()
+    if timer is not None and cache is not None:
+        timer.cache = "miss"
+    try:
+        if req.mode == "hybrid":
+            with stage("sql"):
+                res = await db.run_sync(
+                    lambda session: SearchService(session).hybrid_search(
+                        query_embedding=q,
+                        query_text=req.query,
+                        limit=req.limit,
+                        modality=req.modality,
+                        body_part=req.body_part,
+                        fusion=req.fusion,
+                        weights=req.weights,
+                        candidates=req.candidates,
+                        ef_search=req.ef_search,
+                        probes=req.probes,
+                        include_details=include_details,
+                        similarity_threshold=req.similarity_threshold,
+                    )
+                )
+        elif settings.search_backend == "local":
+            # The scan is CPU-bound numpy; keep it off the event loop.
+            start = time.time()
+            with stage("index_scan"):
+                ranked = await asyncio.to_thread(
+                    get_local_index().search, q, req.limit, req.modality, req.body_part, req.similarity_threshold,
+                    after,
+                )
+            scan_ms = (time.time() - start) * 1000.0
+            with stage("sql"):
+                res = await db.run_sync(
+                    lambda session: SearchService(session).local_vector_search(
+                        q, req.limit, req.modality, req.body_part, req.similarity_threshold, ranked=ranked,
+                        include_details=include_details, after=after,
+                    )
+                )
+            res["query_time_ms"] += scan_ms
+        else:
+            # SearchService is written against a sync Session; run_sync drives it
+            # over the asyncpg connection without blocking the event loop.
+            with stage("sql"):
+                res = await db.run_sync(
+                    lambda session: SearchService(session).vector_search(
+                        query_embedding=q,
+                        limit=req.limit,
+                        modality=req.modality,
+                        body_part=req.body_part,
+                        similarity_threshold=req.similarity_threshold,
+                        ef_search=req.ef_search,
+                        probes=req.probes,
+                        include_details=include_details,
+                        after=after,
+                    )
+                )
+    except PoolTimeoutError:
+        raise _busy("database busy, retry later")
+    except DBAPIError as e:
+        if is_statement_timeout(e):
+            raise _timed_out()
+        raise
+
+    # A full page may have more behind it; a short one is the last.
+    next_cursor = None
+    if req.mode == "vector" and res["results"] and len(res["results"]) >= req.limit:
+        last = res["results"][-1]
+        next_cursor = encode_cursor(last["similarity_score"], last["id"], fingerprint)
+
+    # Rows are projected to exactly the response fields in SQL, so they are
+    # trusted as-is: model_construct skips a second validation pass per row.
+    with stage("hydrate"):
+        results = [MedicalCaseResponse.model_construct(**r) for r in res["results"]]
+        response = SearchResponse.model_construct(
+            results=results, total=res["total"], query_time_ms=res["query_time_ms"], next_cursor=next_cursor
+        )
+    with stage("serialize"):
+        body = response.model_dump_json().encode("utf-8")
+    if cache is not None:
+        cache.put(key, version, body)
+    headers["X-Cache"] = "MISS"
+    return Response(content=body, media_type="application/json", headers=_timing_headers(headers))
+
+
+def _timed_out() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+        detail=f"search exceeded {settings.search_statement_timeout_ms} ms",
+    )
+
+
+def _too_large() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"image larger than {settings.upload_max_bytes} bytes",
+    )
+
+
+async def _read_upload(request: Request) -> bytes:
+    """Read the image from a multipart ``image`` part or the raw request body,
+    never buffering more than ``upload_max_bytes``."""
+    limit = settings.upload_max_bytes
+    declared = request.headers.get("content-length", "")
+    # Some slack for multipart boundaries and part headers.
+    if declared.isdigit() and int(declared) > limit + UPLOAD_CHUNK_BYTES:
+        raise _too_large()
+
+    buf = bytearray()
+    if request.headers.get("content-type", "").startswith("multipart/form-data"):
+        form = await request.form(max_files=1, max_fields=16)
+        upload = form.get("image")
+        if not isinstance(upload, UploadFile):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="multipart file part 'image' required")
+        try:
+            while chunk := await upload.read(UPLOAD_CHUNK_BYTES):
+                buf += chunk
+                if len(buf) > limit:
+                    raise _too_large()
+        finally:
+            await form.close()
     else:
-        q = emb.tolist()
-
-    search_svc = SearchService(db)
-    res = search_svc.vector_search(
-        query_embedding=q,
-        limit=req.limit,
-        modality=req.modality,
-        body_part=req.body_part,
-        similarity_threshold=req.similarity_threshold,
+        async for chunk in request.stream():
+            buf += chunk
+            if len(buf) > limit:
+                raise _too_large()
+
+    if not buf:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="empty image upload")
+    return bytes(buf)
+
+
+@router.post("/api/search/image", response_model=SearchResponse)
+async def image_search_endpoint(
+    request: Request,
+    modality: Optional[str] = None,
+    body_part: Optional[str] = None,
+    limit: int = 10,
+    similarity_threshold: float = 0.0,
+    ef_search: Optional[int] = Query(None, ge=1, le=1000),
+    probes: Optional[int] = Query(None, ge=1),
+    view: Literal["full", "grid"] = "full",
+    cursor: Optional[str] = None,
+):
+    """Image search from the uploaded bytes, without base64 or a JSON body.
+
+    Send ``multipart/form-data`` with a file part named ``image``, or the image
+    itself as the request body (e.g. ``Content-Type: image/png``). Search
+    options are query parameters.
+    """
+    with request_timer("/api/search/image", filter_label(modality, body_part)):
+        start = time.perf_counter()
+        with stage("upload"):
+            raw = await _read_upload(request)
+        upload_ms = (time.perf_counter() - start) * 1000.0
+
+        req = SearchRequest(
+            modality=modality,
+            body_part=body_part,
+            limit=limit,
+            similarity_threshold=similarity_threshold,
+            ef_search=ef_search,
+            probes=probes,
+            view=view,
+            cursor=cursor,
+        )
+        # Acquired after the upload, so a slow client does not hold a connection.
+        async with _read_db() as db:
+            svc = get_embedding_service(device=settings.device)
+            digest, q = await _stored_image_embedding(svc, raw, db)
+            if q is None:
+                try:
+                    emb = await get_inference_executor().run(svc.encode_image_bytes, raw, digest)
+                except InferenceQueueFull:
+                    raise _busy("inference queue full, retry later")
+                except EmbeddingWorkerUnavailable:
+                    raise _busy("embedding worker unavailable, retry later")
+                except ImageTooLarge as e:
+                    raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+                except (UnidentifiedImageError, OSError):
+                    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="upload is not a decodable image")
+                q = emb[0].tolist()
+
+            headers = {"X-Upload-Bytes": str(len(raw)), "X-Upload-Ms": f"{upload_ms:.1f}"}
+            return await _run_search(req, q, db, headers, source=f"image:{digest}")
+
+
+@router.post("/api/search/stream")
+async def stream_search_endpoint(req: SearchRequest):
+    """Vector search streamed as NDJSON: one case per line, then a summary line
+    ``{"total", "next_cursor", "query_time_ms"}``.
+
+    For deep result sets (``limit`` up to ``stream_max_results``). Rows come off
+    a server-side cursor in ``stream_fetch_rows`` batches and are written as
+    they arrive, so neither side holds the whole result. A stream that ends
+    without the summary line was cut short (e.g. by the statement timeout).
+    """
+    if not req.query and not req.image:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="query or image required")
+    if req.mode != "vector":
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="streaming supports mode=vector only")
+    if req.limit > settings.stream_max_results:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"at most {settings.stream_max_results} results per stream",
+        )
+    after, fingerprint = _page_after(req, _query_source(req))
+    # Errors are only reportable before the first byte: embed here, stream after.
+    async with _read_db() as db:
+        await _corpus_version(db)
+        q = await _embed(req, db)
+    return StreamingResponse(
+        _stream_rows(req, q, after, fingerprint), media_type="application/x-ndjson"
     )
 
-    results = []
-    for r in res["results"]:
-        item = MedicalCaseResponse(
-            id=r.get("id"),
-            case_id=r.get("case_id"),
-            age=r.get("age"),
-            gender=r.get("gender"),
-            modality=r.get("modality"),
-            body_part=r.get("body_part"),
-            diagnosis=r.get("diagnosis"),
-            findings=r.get("findings"),
-            clinical_notes=r.get("clinical_notes"),
-            image_path=r.get("image_path"),
-            image_url=r.get("image_url"),
-            source=r.get("source"),
-            metadata=r.get("metadata"),
-            similarity_score=float(r.get("similarity", 0.0)),
-        )
-        results.append(item)
-
-    return SearchResponse(results=results, total=res["total"], query_time_ms=res["query_time_ms"])
+
+async def _stream_rows(
+    req: SearchRequest, q: List[float], after: Optional[Tuple[float, int]], fingerprint: str
+) -> AsyncIterator[bytes]:
+    start = time.perf_counter()
+    include_details = req.view == "full"
+    fetch = settings.stream_fetch_rows
+    total, last = 0, None
+    with request_timer("/api/search/stream", filter_label(req.modality, req.body_part)):
+        async with read_connection() as db:
+            if settings.search_backend == "local":
+                with stage("index_scan"):
+                    ranked = await asyncio.to_thread(
+                        get_local_index().search, q, req.limit, req.modality, req.body_part,
+                        req.similarity_threshold, after,
+                    )
+                for lo in range(0, len(ranked), fetch):
+                    chunk = ranked[lo:lo + fetch]
+                    with stage("sql"):
+                        rows = await db.run_sync(lambda session: SearchService(session).hydrate(chunk, include_details))
+                    with stage("serialize"):
+                        lines = [MedicalCaseResponse.model_construct(**r).model_dump_json() for r in rows]
+                    if rows:
+                        total, last = total + len(rows), rows[-1]
+                        yield ("\n".join(lines) + "\n").encode("utf-8")
+            else:
+                with stage("sql"):
+                    stmt, params = await db.run_sync(
+                        lambda session: SearchService(session).vector_search_statement(
+                            query_embedding=q,
+                            limit=req.limit,
+                            modality=req.modality,
+                            body_part=req.body_part,
+                            similarity_threshold=req.similarity_threshold,
+                            ef_search=req.ef_search,
+                            probes=req.probes,
+                            include_details=include_details,
+                            after=after,
+                        )
+                    )
+                    result = await db.stream(stmt, params, execution_options={"yield_per": fetch})
+                async for rows in result.mappings().partitions():
+                    with stage("serialize"):
+                        lines = [MedicalCaseResponse.model_construct(**r).model_dump_json() for r in rows]
+                    total, last = total + len(rows), rows[-1]
+                    yield ("\n".join(lines) + "\n").encode("utf-8")
+
+        next_cursor = None
+        if last is not None and total >= req.limit:
+            next_cursor = encode_cursor(last["similarity_score"], last["id"], fingerprint)
+        summary = {
+            "total": total,
+            "next_cursor": next_cursor,
+            "query_time_ms": (time.perf_counter() - start) * 1000.0,
+        }
+        yield (json.dumps(summary) + "\n").encode("utf-8")
+
+
+@router.post("/api/search/batch", response_model=BatchSearchResponse)
+async def batch_search_endpoint(req: BatchSearchRequest):
+    """Many vector searches in one request: one forward pass per modality and
+    one SQL round trip for all lookups."""
+    items = req.queries
+    if len(items) > settings.batch_search_max_queries:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"at most {settings.batch_search_max_queries} queries per batch",
+        )
+    for i, item in enumerate(items):
+        if not item.query and not item.image:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail=f"queries[{i}]: query or image required"
+            )
+        if item.mode != "vector":
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail=f"queries[{i}]: batch search supports mode=vector only"
+            )
+
+    labels = {filter_label(item.modality, item.body_part) for item in items}
+    with request_timer("/api/search/batch", labels.pop() if len(labels) == 1 else "mixed"):
+        async with _read_db() as db:
+            return await _batch_search(items, db)
+
+
+def _failing_image(indexes: List[int], raws: dict) -> Optional[Tuple[int, Exception]]:
+    """First batch item whose image does not decode, so the error can name it.
+
+    Batched encoding fails as a whole; this re-checks each image only on that
+    error path, with the same limits as the encoder.
+    """
+    for i in indexes:
+        try:
+            decode_image(raws[i], settings.image_downscale_side, settings.upload_max_pixels)
+        except (ImageTooLarge, UnidentifiedImageError, OSError) as e:
+            return i, e
+    return None
+
+
+async def _batch_search(items: List[SearchRequest], db: AsyncConnection) -> Response:
+    await _corpus_version(db)
+    start = time.perf_counter()
+    timings = {}
+    svc = get_embedding_service(device=settings.device)
+    executor = get_inference_executor()
+    vectors = {}
+
+    # Decode every image, then reuse cached or stored embeddings (one lookup).
+    t0 = time.perf_counter()
+    raws, digests = {}, {}
+    for i, item in enumerate(items):
+        if item.image:
+            try:
+                with stage("decode"):
+                    raws[i] = decode_base64_image(item.image)
+            except ValueError:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST, detail=f"queries[{i}]: image is not valid base64"
+                )
+            digests[i] = image_digest(raws[i])
+            cached = svc.cached_image_embedding(digests[i])
+            if cached is not None:
+                vectors[i] = cached
+    unknown = sorted({digests[i] for i in raws if i not in vectors})
+    if unknown:
+        with stage("embedding_lookup"):
+            stored = await db.run_sync(lambda session: SearchService(session).stored_image_embeddings(unknown))
+        for i in raws:
+            if i not in vectors and digests[i] in stored:
+                vectors[i] = np.asarray(stored[digests[i]], dtype=np.float32)
+                svc.cache_image_embedding(digests[i], vectors[i])
+    timings["decode"] = (time.perf_counter() - t0) * 1000.0
+
+    text_idx = [i for i, item in enumerate(items) if not item.image]
+    image_idx = [i for i in raws if i not in vectors]
+
+    async def encode_texts():
+        t = time.perf_counter()
+        if text_idx:
+            embs = await executor.run(svc.encode_query_texts, [items[i].query for i in text_idx])
+            vectors.update(zip(text_idx, embs))
+        timings["encode_text"] = (time.perf_counter() - t) * 1000.0
+
+    async def encode_images():
+        t = time.perf_counter()
+        if image_idx:
+            embs = await executor.run(
+                svc.encode_images_bytes, [raws[i] for i in image_idx], [digests[i] for i in image_idx]
+            )
+            vectors.update(zip(image_idx, embs))
+        timings["encode_image"] = (time.perf_counter() - t) * 1000.0
+
+    try:
+        await asyncio.gather(encode_texts(), encode_images())
+    except InferenceQueueFull:
+        raise _busy("inference queue full, retry later")
+    except EmbeddingWorkerUnavailable:
+        raise _busy("embedding worker unavailable, retry later")
+    except (ImageTooLarge, UnidentifiedImageError, OSError):
+        failing = await asyncio.to_thread(_failing_image, image_idx, raws)
+        if failing is None:
+            raise  # not an image problem, e.g. the embedding worker went away
+        i, e = failing
+        if isinstance(e, ImageTooLarge):
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"queries[{i}]: {e}")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"queries[{i}]: image is not decodable")
+
+    queries = [
+        {
+            "query_embedding": vectors[i],
+            "limit": item.limit,
+            "modality": item.modality,
+            "body_part": item.body_part,
+            "similarity_threshold": item.similarity_threshold,
+        }
+        for i, item in enumerate(items)
+    ]
+    # One query fetches details if any item wants them; grid items drop them again below.
+    include_details = any(item.view == "full" for item in items)
+    t0 = time.perf_counter()
+    try:
+        if settings.search_backend == "local":
+            index = get_local_index()
+            with stage("index_scan"):
+                ranked = await asyncio.to_thread(
+                    lambda: [
+                        index.search(
+                            q["query_embedding"], q["limit"], q["modality"], q["body_part"], q["similarity_threshold"]
+                        )
+                        for q in queries
+                    ]
+                )
+            with stage("sql"):
+                per_query = await db.run_sync(
+                    lambda session: SearchService(session).hydrate_many(ranked, include_details)
+                )
+        else:
+            with stage("sql"):
+                per_query = await db.run_sync(
+                    lambda session: SearchService(session).batch_vector_search(
+                        queries,
+                        ef_search=max((item.ef_search for item in items if item.ef_search), default=None),
+                        probes=max((item.probes for item in items if item.probes), default=None),
+                        include_details=include_details,
+                    )
+                )
+    except PoolTimeoutError:
+        raise _busy("database busy, retry later")
+    except DBAPIError as e:
+        if is_statement_timeout(e):
+            raise _timed_out()
+        raise
+    timings["search"] = (time.perf_counter() - t0) * 1000.0
+
+    with stage("hydrate"):
+        results = []
+        for item, rows in zip(items, per_query):
+            if include_details and item.view != "full":
+                rows = [{k: v for k, v in r.items() if k not in DETAIL_FIELDS} for r in rows]
+            results.append(
+                BatchSearchResult.model_construct(
+                    results=[MedicalCaseResponse.model_construct(**r) for r in rows], total=len(rows)
+                )
+            )
+        response = BatchSearchResponse.model_construct(
+            results=results,
+            total=len(results),
+            query_time_ms=(time.perf_counter() - start) * 1000.0,
+            timings_ms=timings,
+        )
+    with stage("serialize"):
+        body = response.model_dump_json()
+    return Response(content=body, media_type="application/json")
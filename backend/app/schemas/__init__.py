@@ -6,6 +6,9 @@ from .case import (
     MedicalCaseResponse,
     SearchRequest,
     SearchResponse,
+    BatchSearchRequest,
+    BatchSearchResult,
+    BatchSearchResponse,
 )
 
 __all__ = [
@@ -14,4 +17,7 @@ __all__ = [
     "MedicalCaseResponse",
     "SearchRequest",
     "SearchResponse",
+    "BatchSearchRequest",
+    "BatchSearchResult",
+    "BatchSearchResponse",
 ]
@@ -1,4 +1,4 @@
-from typing import Optional, List, Any
+from typing import Optional, List, Any, Dict, Literal
 from pydantic import BaseModel, Field
 
 
@@ -24,6 +24,8 @@ class MedicalCaseCreate(MedicalCaseBase):
 class MedicalCaseResponse(MedicalCaseBase):
     id: int
     similarity_score: Optional[float] = None
+    # Hybrid mode only: the fused rank score results are ordered by (RRF or weighted).
+    fusion_score: Optional[float] = None
 
     class Config:
         orm_mode = True
@@ -35,10 +37,40 @@ class SearchRequest(BaseModel):
     modality: Optional[str] = None
     body_part: Optional[str] = None
     limit: int = 10
-    similarity_threshold: float = 0.0
+    similarity_threshold: float = 0.0  # applied when > 0; hybrid applies it to the image/text sources
+    ef_search: Optional[int] = Field(None, ge=1, le=1000)  # hnsw.ef_search for this request
+    probes: Optional[int] = Field(None, ge=1)  # ivfflat.probes for this request
+    # "hybrid" fuses ANN over image_embedding and text_embedding with full-text search
+    mode: Literal["vector", "hybrid"] = "vector"
+    fusion: Literal["rrf", "weighted"] = "rrf"
+    weights: Optional[Dict[Literal["image", "text", "keyword"], float]] = None
+    candidates: Optional[int] = Field(None, ge=1, le=1000)  # per-source top-k for hybrid
+    # "grid" leaves out clinical_notes and metadata (returned as null)
+    view: Literal["full", "grid"] = "full"
+    # next_cursor of the previous page; limit is then the page size (vector mode)
+    cursor: Optional[str] = None
 
 
 class SearchResponse(BaseModel):
     results: List[MedicalCaseResponse]
     total: int
     query_time_ms: float
+    # Pass back as SearchRequest.cursor for the next page; null on the last page.
+    next_cursor: Optional[str] = None
+
+
+class BatchSearchRequest(BaseModel):
+    queries: List[SearchRequest] = Field(..., min_length=1)
+
+
+class BatchSearchResult(BaseModel):
+    results: List[MedicalCaseResponse]
+    total: int
+
+
+class BatchSearchResponse(BaseModel):
+    results: List[BatchSearchResult]  # one per query, in request order
+    total: int
+    query_time_ms: float
+    # Batch-wide stages: decode, encode_text, encode_image, search
+    timings_ms: Dict[str, float]
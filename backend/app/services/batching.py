@@ -0,0 +1,137 @@
+from concurrent.futures import Future
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Sequence
+import queue
+import threading
+import time
+
+import numpy as np
+
+
+class MicroBatcher:
+    """Coalesce concurrent single-item requests into one batched call.
+
+    Callers ``submit`` one item and block on the returned future. A worker
+    thread takes the first waiting item, keeps collecting until either
+    ``max_batch_size`` items are queued or ``max_wait_ms`` has passed, then
+    calls ``batch_fn`` once with the whole batch. ``batch_fn`` must return an
+    array with one row per item; row ``i`` resolves the ``i``-th future.
+    """
+
+    def __init__(
+        self,
+        batch_fn: Callable[[List[Any]], np.ndarray],
+        max_batch_size: int = 16,
+        max_wait_ms: float = 5.0,
+        name: str = "batcher",
+        history: int = 1024,
+    ):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.name = name
+
+        self._queue: "queue.Queue" = queue.Queue()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._errors = 0
+        # (batch size, forward ms, oldest item's queue wait ms) for recent batches
+        self._recent: deque = deque(maxlen=history)
+
+        self._worker = threading.Thread(target=self._run, name=f"{name}-worker", daemon=True)
+        self._worker.start()
+
+    def submit(self, item: Any) -> Future:
+        if self._closed:
+            raise RuntimeError(f"{self.name} is closed")
+        fut: Future = Future()
+        self._queue.put((item, fut, time.perf_counter()))
+        return fut
+
+    def __call__(self, item: Any, timeout: Optional[float] = None) -> np.ndarray:
+        return self.submit(item).result(timeout=timeout)
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def close(self) -> None:
+        self._closed = True
+        self._queue.put(None)
+        self._worker.join()
+
+    def _collect(self, first) -> list:
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                entry = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is None:
+                self._queue.put(None)  # let the outer loop see the shutdown
+                break
+            batch.append(entry)
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = self._collect(first)
+            items = [entry[0] for entry in batch]
+            futures = [entry[1] for entry in batch]
+
+            started = time.perf_counter()
+            wait_ms = (started - min(entry[2] for entry in batch)) * 1000.0
+            try:
+                out = self.batch_fn(items)
+                if len(out) != len(items):
+                    raise RuntimeError(f"batch function returned {len(out)} results for {len(items)} inputs")
+            except Exception as e:  # propagate to every waiting caller
+                with self._lock:
+                    self._errors += 1
+                for fut in futures:
+                    fut.set_exception(e)
+                continue
+            forward_ms = (time.perf_counter() - started) * 1000.0
+
+            for fut, result in zip(futures, out):
+                fut.set_result(result)
+
+            with self._lock:
+                self._batches += 1
+                self._items += len(batch)
+                self._recent.append((len(batch), forward_ms, wait_ms))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            recent = list(self._recent)
+            batches, items, errors = self._batches, self._items, self._errors
+
+        def pct(values: Sequence[float], q: float) -> Optional[float]:
+            return float(np.percentile(values, q)) if values else None
+
+        sizes = [r[0] for r in recent]
+        forward = [r[1] for r in recent]
+        waits = [r[2] for r in recent]
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "batches": batches,
+            "items": items,
+            "errors": errors,
+            "queue_depth": self.queue_depth(),
+            "mean_batch_size": items / batches if batches else 0.0,
+            # occupancy: how full batches are relative to max_batch_size (recent window)
+            "occupancy": (sum(sizes) / (len(sizes) * self.max_batch_size)) if sizes else 0.0,
+            "forward_ms_p50": pct(forward, 50),
+            "forward_ms_p95": pct(forward, 95),
+            "forward_ms_p99": pct(forward, 99),
+            "queue_wait_ms_p50": pct(waits, 50),
+            "queue_wait_ms_p95": pct(waits, 95),
+            "queue_wait_ms_p99": pct(waits, 99),
+        }
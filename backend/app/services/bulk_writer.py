@@ -0,0 +1,183 @@
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+import hashlib
+import io
+import json
+
+import numpy as np
+
+from ..database import engine as default_engine
+from .corpus import BUMP_CORPUS_VERSION_SQL
+
+
+DEFAULT_COLUMNS = [
+    "case_id",
+    "age",
+    "gender",
+    "modality",
+    "body_part",
+    "diagnosis",
+    "findings",
+    "clinical_notes",
+    "image_path",
+    "image_url",
+    "image_sha256",
+    "image_embedding",
+    "text_embedding",
+    "embedding_model",
+    "source",
+    "metadata",
+]
+
+VECTOR_COLUMNS = {"image_embedding", "text_embedding"}
+
+
+def vector_literal(vec) -> str:
+    """pgvector text form, e.g. '[0.1,0.2]'."""
+    return "[" + ",".join("%.9g" % x for x in np.asarray(vec, dtype=np.float32).reshape(-1)) + "]"
+
+
+def _db_value(column: str, value: Any) -> Any:
+    if value is None:
+        return None
+    if column in VECTOR_COLUMNS:
+        return vector_literal(value)
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+
+def _csv_field(value: Any) -> str:
+    # In PostgreSQL CSV format an unquoted empty field is NULL and "" is ''.
+    if value is None:
+        return ""
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+class BulkCaseWriter:
+    """Write medical_cases rows in bulk over one raw psycopg2 connection.
+
+    ``method="copy"`` streams rows with ``COPY ... FROM STDIN`` into a temp
+    staging table and moves them over with one ``INSERT ... SELECT``;
+    ``method="executemany"`` uses ``execute_values``. Both upsert on
+    ``case_id``: ``on_conflict="nothing"`` keeps existing rows (re-runs are
+    idempotent), ``"update"`` overwrites them. Nothing is committed until
+    ``commit()``, so callers choose the transaction size. With
+    ``bump_corpus_version`` each commit that wrote rows also bumps the corpus
+    version in the same transaction, so cached search results never outlive
+    a committed batch, even if the load is interrupted.
+
+    COPY uses CSV rather than binary format: binary would need every column
+    hand-encoded in its wire format (jsonb version byte, pgvector's dimension
+    header), while the CSV text of a vector parses server-side in the same
+    pass. Vectors are written with 9 significant digits, which round-trips
+    float32 exactly.
+    """
+
+    def __init__(
+        self,
+        engine=None,
+        method: str = "copy",
+        columns: Optional[Sequence[str]] = None,
+        on_conflict: str = "nothing",
+        bump_corpus_version: bool = False,
+    ):
+        if method not in ("copy", "executemany"):
+            raise ValueError(f"Unsupported write method: {method}")
+        if on_conflict not in ("nothing", "update"):
+            raise ValueError(f"Unsupported on_conflict: {on_conflict}")
+        self.engine = engine if engine is not None else default_engine
+        self.method = method
+        self.columns = list(columns or DEFAULT_COLUMNS)
+        self.on_conflict = on_conflict
+        self.bump_corpus_version = bump_corpus_version
+        # Pooled connections outlive the writer; key the temp table on its columns.
+        self.stage_table = "mm_ingest_stage_" + hashlib.sha1(",".join(self.columns).encode()).hexdigest()[:8]
+        self.conn = self.engine.raw_connection()
+        self._staged = False
+        self._uncommitted = 0
+        self.rows_written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.rollback()
+        self.close()
+
+    def _conflict_clause(self) -> str:
+        if self.on_conflict == "nothing":
+            return "ON CONFLICT (case_id) DO NOTHING"
+        updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in self.columns if c != "case_id")
+        return f"ON CONFLICT (case_id) DO UPDATE SET {updates}, updated_at = now()"
+
+    def _ensure_stage(self, cur) -> None:
+        if self._staged:
+            return
+        cols = ", ".join(self.columns)
+        cur.execute(
+            f"CREATE TEMP TABLE IF NOT EXISTS {self.stage_table} ON COMMIT DELETE ROWS AS "
+            f"SELECT {cols} FROM medical_cases WITH NO DATA"
+        )
+        self._staged = True
+
+    def write(self, rows: Iterable[Dict[str, Any]]) -> int:
+        values: List[List[Any]] = [[_db_value(c, row.get(c)) for c in self.columns] for row in rows]
+        if not values:
+            return 0
+        cols = ", ".join(self.columns)
+        with self.conn.cursor() as cur:
+            if self.method == "copy":
+                self._ensure_stage(cur)
+                buf = io.StringIO()
+                for v in values:
+                    buf.write(",".join(_csv_field(x) for x in v))
+                    buf.write("\n")
+                buf.seek(0)
+                cur.copy_expert(f"COPY {self.stage_table} ({cols}) FROM STDIN WITH (FORMAT csv)", buf)
+                cur.execute(
+                    f"INSERT INTO medical_cases ({cols}) SELECT {cols} FROM {self.stage_table} "
+                    f"{self._conflict_clause()}"
+                )
+                written = cur.rowcount
+                cur.execute(f"TRUNCATE {self.stage_table}")
+            else:
+                from psycopg2.extras import execute_values
+
+                # rowcount only covers the last page; RETURNING counts rows
+                # actually inserted or updated across all of them.
+                written = len(
+                    execute_values(
+                        cur,
+                        f"INSERT INTO medical_cases ({cols}) VALUES %s {self._conflict_clause()} RETURNING 1",
+                        values,
+                        page_size=1000,
+                        fetch=True,
+                    )
+                )
+        self.rows_written += written
+        self._uncommitted += written
+        return written
+
+    def existing_case_ids(self, case_ids: Sequence[str]) -> set:
+        """Subset of ``case_ids`` already present, to skip re-embedding them."""
+        if not case_ids:
+            return set()
+        with self.conn.cursor() as cur:
+            cur.execute("SELECT case_id FROM medical_cases WHERE case_id = ANY(%s)", (list(case_ids),))
+            return {r[0] for r in cur.fetchall()}
+
+    def commit(self) -> None:
+        if self.bump_corpus_version and self._uncommitted:
+            with self.conn.cursor() as cur:
+                cur.execute(BUMP_CORPUS_VERSION_SQL)
+        self.conn.commit()
+        self._uncommitted = 0
+
+    def rollback(self) -> None:
+        self.conn.rollback()
+        self._uncommitted = 0
+        self._staged = False  # a rolled-back CREATE TEMP TABLE is gone too
+
+    def close(self) -> None:
+        self.conn.close()
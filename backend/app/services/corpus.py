@@ -0,0 +1,35 @@
+from typing import Optional
+
+from sqlalchemy import text
+
+
+BUMP_CORPUS_VERSION_SQL = (
+    "INSERT INTO corpus_version (id, version) VALUES (1, 1) "
+    "ON CONFLICT (id) DO UPDATE SET version = corpus_version.version + 1, updated_at = now() "
+    "RETURNING version"
+)
+
+
+def get_corpus_version(db) -> int:
+    version = db.execute(text("SELECT version FROM corpus_version WHERE id = 1")).scalar()
+    return int(version or 0)
+
+
+def bump_corpus_version(db, commit: bool = True) -> int:
+    """Mark the corpus as changed; call after committing writes to medical_cases.
+
+    Commits on its own so the new version is visible to API workers immediately;
+    ``commit=False`` makes the bump part of the caller's transaction instead.
+    """
+    version = db.execute(text(BUMP_CORPUS_VERSION_SQL)).scalar()
+    if commit:
+        db.commit()
+    return int(version)
+
+
+def get_live_model(db) -> Optional[str]:
+    """CLIP model behind medical_cases' vectors as of the last reembed cutover,
+    or ``None`` if there never was one (the vectors predate model tracking)."""
+    if db.execute(text("SELECT to_regclass('embedding_reindex')")).scalar() is None:
+        return None
+    return db.execute(text("SELECT live_model FROM embedding_reindex WHERE id = 1")).scalar()
@@ -0,0 +1,170 @@
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+import hashlib
+import sqlite3
+import threading
+import time
+import unicodedata
+
+import numpy as np
+
+
+def normalize_query(text: str) -> str:
+    """Canonical form used for cache keys: NFKC, case-folded, single-spaced."""
+    return " ".join(unicodedata.normalize("NFKC", text).casefold().split())
+
+
+def cache_key(model_name: str, text: str) -> str:
+    return f"{model_name}\x00{normalize_query(text)}"
+
+
+class SQLiteEmbeddingStore:
+    """Shared second-level store so several uvicorn workers can reuse hits.
+
+    Any object with the same ``get``/``put`` methods (e.g. a Redis wrapper)
+    can be passed to ``EmbeddingCache`` instead.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " key TEXT PRIMARY KEY, dtype TEXT NOT NULL, data BLOB NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _hash(key: str) -> str:
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        row = self._conn().execute(
+            "SELECT dtype, data, expires_at FROM embeddings WHERE key = ?", (self._hash(key),)
+        ).fetchone()
+        if row is None or row[2] < time.time():
+            return None
+        return np.frombuffer(row[1], dtype=row[0])
+
+    def put(self, key: str, vec: np.ndarray, ttl_seconds: float) -> None:
+        try:
+            with self._conn() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO embeddings (key, dtype, data, expires_at) VALUES (?, ?, ?, ?)",
+                    (self._hash(key), vec.dtype.str, vec.tobytes(), time.time() + ttl_seconds),
+                )
+        except sqlite3.OperationalError:
+            # Another worker holds the write lock; the shared store is best effort.
+            pass
+
+
+class EmbeddingCache:
+    """Thread-safe LRU cache with TTL, bounded by entry count and bytes.
+
+    Vectors are stored compactly (float16 by default) and handed back as
+    float32. An optional shared ``backend`` acts as a second level: local
+    misses are looked up there and new entries are written through.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 10000,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl_seconds: float = 24 * 3600,
+        dtype: str = "float16",
+        backend: Optional[Any] = None,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.dtype = np.dtype(dtype)
+        self.backend = backend
+
+        # key -> (vector, expiry time), oldest first
+        self._data: OrderedDict = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _remove(self, key: str) -> None:
+        vec, _ = self._data.pop(key)
+        self._bytes -= vec.nbytes
+
+    def _insert(self, key: str, vec: np.ndarray, expires_at: float) -> None:
+        if key in self._data:
+            self._remove(key)
+        self._data[key] = (vec, expires_at)
+        self._bytes += vec.nbytes
+        while self._data and (len(self._data) > self.max_entries or self._bytes > self.max_bytes):
+            oldest = next(iter(self._data))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                vec, expires_at = entry
+                if expires_at >= now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return vec.astype(np.float32)
+                self._remove(key)
+                self.expirations += 1
+
+        if self.backend is not None:
+            vec = self.backend.get(key)
+            if vec is not None:
+                vec = vec.astype(self.dtype)
+                with self._lock:
+                    self._insert(key, vec, now + self.ttl_seconds)
+                    self.shared_hits += 1
+                return vec.astype(np.float32)
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, vec: np.ndarray) -> None:
+        vec = np.ascontiguousarray(vec, dtype=self.dtype).reshape(-1)
+        with self._lock:
+            self._insert(key, vec, time.time() + self.ttl_seconds)
+        if self.backend is not None:
+            self.backend.put(key, vec, self.ttl_seconds)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "dtype": self.dtype.name,
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": (self.hits + self.shared_hits) / lookups if lookups else 0.0,
+                "shared_backend": type(self.backend).__name__ if self.backend is not None else None,
+            }
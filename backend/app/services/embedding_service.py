@@ -1,65 +1,328 @@
-from typing import Union, List
+from collections import deque
+from typing import Union, List, Dict, Any, Optional
+import threading
+import time
 import numpy as np
 import torch
 from PIL import Image
 import io
 import base64
+import hashlib
 
 import clip
 
+from ..config import settings
+from .batching import MicroBatcher
+from .inference_backends import build_backend, configure_threads
+from .model_loader import load_clip
+from .embedding_cache import EmbeddingCache, SQLiteEmbeddingStore, cache_key
+from .telemetry import stage
+
+
+def _build_text_cache() -> EmbeddingCache | None:
+    if not settings.text_cache_enabled:
+        return None
+    backend = None
+    if settings.text_cache_shared_path:
+        backend = SQLiteEmbeddingStore(settings.text_cache_shared_path)
+    return EmbeddingCache(
+        max_entries=settings.text_cache_max_entries,
+        max_bytes=settings.text_cache_max_bytes,
+        ttl_seconds=settings.text_cache_ttl_seconds,
+        dtype=settings.text_cache_dtype,
+        backend=backend,
+    )
+
+
+def _build_image_cache() -> EmbeddingCache | None:
+    if not settings.image_cache_enabled:
+        return None
+    return EmbeddingCache(
+        max_entries=settings.image_cache_max_entries,
+        max_bytes=settings.image_cache_max_bytes,
+        ttl_seconds=settings.image_cache_ttl_seconds,
+        dtype=settings.image_cache_dtype,
+    )
+
+
+def decode_base64_image(image: str) -> bytes:
+    # Accepts both bare base64 and data URLs ("data:image/png;base64,....")
+    header, sep, data = image.partition(",")
+    return base64.b64decode(data if sep else header)
+
+
+def image_digest(raw: bytes) -> str:
+    """Content hash used to recognise re-uploads; matches medical_cases.image_sha256."""
+    return hashlib.sha256(raw).hexdigest()
+
+
+class ImageTooLarge(ValueError):
+    """The image header declares more pixels than ``upload_max_pixels``."""
+
+
+def decode_image(raw: bytes, min_side: Optional[int] = None, max_pixels: Optional[int] = None) -> Image.Image:
+    """Decode image bytes to RGB, downscaled so the short side is ``min_side``.
+
+    The size check uses only the header, before any pixel data is decoded.
+    JPEGs are decoded directly at a reduced scale via ``draft``, which is much
+    cheaper than a full decode followed by a resize.
+    """
+    img = Image.open(io.BytesIO(raw))
+    width, height = img.size
+    if max_pixels and width * height > max_pixels:
+        raise ImageTooLarge(f"image is {width}x{height}, limit is {max_pixels} pixels")
+    if min_side and min(width, height) > min_side:
+        scale = min_side / min(width, height)
+        img.draft("RGB", (int(width * scale) + 1, int(height * scale) + 1))
+    img = img.convert("RGB")
+    if min_side and min(img.size) > min_side:
+        scale = min_side / min(img.size)
+        size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+        img = img.resize(size, Image.BILINEAR, reducing_gap=2.0)
+    return img
+
+
+def decode_corpus_image(raw: bytes) -> Image.Image:
+    """Decode an image being stored, exactly as queries are decoded.
+
+    Same downscale as ``EmbeddingService.decode`` so a case and a query of the
+    same picture embed alike, but without ``upload_max_pixels``: that limit
+    protects the API from uploads and must not drop large images from the corpus.
+    """
+    return decode_image(raw, settings.image_downscale_side)
+
 
 class EmbeddingService:
-    def __init__(self, device: str = "cpu"):
-        print(f"Loading CLIP model on device={device}...")
+    def __init__(self, device: str = "cpu", batching: bool = None, model_name: Optional[str] = None):
+        self.model_name = model_name or settings.embedding_model
+        print(f"Loading CLIP {self.model_name} on device={device}...")
         self.device = device
-        self.model, self.preprocess = clip.load("ViT-B/32", device=self.device)
+        configure_threads()
+        self.model, self.preprocess = load_clip(self.model_name, device=self.device)
         self.model.eval()
-        print("CLIP model loaded.")
+        self.backend = build_backend(settings.inference_backend, self.model, self.model_name, self.device)
+        print(f"CLIP model loaded (backend={self.backend.name}).")
+
+        if batching is None:
+            batching = settings.embedding_batching
+        self.text_batcher = None
+        self.image_batcher = None
+        if batching:
+            self.text_batcher = MicroBatcher(
+                self._forward_text,
+                max_batch_size=settings.embedding_max_batch_size,
+                max_wait_ms=settings.embedding_max_wait_ms,
+                name="clip-text",
+            )
+            self.image_batcher = MicroBatcher(
+                self._forward_image,
+                max_batch_size=settings.embedding_max_batch_size,
+                max_wait_ms=settings.embedding_max_wait_ms,
+                name="clip-image",
+            )
+        self.text_cache = _build_text_cache()
+        self.image_cache = _build_image_cache()
+        self._decode_lock = threading.Lock()
+        self._decode_ms: deque = deque(maxlen=1000)
+        self._decode_rejected = 0
 
-    def _to_numpy(self, tensor: torch.Tensor) -> np.ndarray:
-        arr = tensor.detach().cpu().numpy()
-        return arr
+    def warmup(self) -> None:
+        """Run one text and one image forward pass so the first real request
+        does not pay for lazy initialisation (allocator, kernels, page-in)."""
+        self.encode_text(["warm-up"])
+        size = getattr(self.model.visual, "input_resolution", 224)
+        self._forward_image(torch.zeros((1, 3, size, size)))
 
     def _normalize(self, vec: np.ndarray) -> np.ndarray:
         norms = np.linalg.norm(vec, axis=1, keepdims=True) if vec.ndim == 2 else np.linalg.norm(vec)
         norms = np.where(norms == 0, 1, norms)
         return vec / norms
 
+    def _forward_text(self, texts: List[str]) -> np.ndarray:
+        with stage("forward"):
+            tokens = clip.tokenize(texts, truncate=True)
+            return self._normalize(self.backend.encode_text(tokens))
+
+    def _forward_image(self, tensors: Union[List[torch.Tensor], torch.Tensor]) -> np.ndarray:
+        with stage("forward"):
+            batch = torch.stack(tensors) if isinstance(tensors, list) else tensors
+            return self._normalize(self.backend.encode_image(batch))
+
+    def _prepare(self, image: Union[Image.Image, bytes]) -> torch.Tensor:
+        image = self._load_image(image)
+        with stage("preprocess"):
+            return self.preprocess(image)
+
+    def encode_preprocessed(self, batch: Union[np.ndarray, torch.Tensor]) -> np.ndarray:
+        """Encode images already run through ``self.preprocess``, shape (N, 3, H, W).
+
+        Lets bulk loaders decode and preprocess in worker processes and only
+        bring the batched forward pass to the model.
+        """
+        if isinstance(batch, np.ndarray):
+            batch = torch.from_numpy(batch)
+        return self._forward_image(batch)
+
+    def _load_image(self, image: Union[Image.Image, str, bytes]) -> Image.Image:
+        # Accept PIL image, raw bytes or base64 string
+        if isinstance(image, str):
+            image = decode_base64_image(image)
+        if isinstance(image, bytes):
+            image = self.decode(image)
+        elif not isinstance(image, Image.Image):
+            raise ValueError("Unsupported image input")
+        return image
+
+    def decode(self, raw: bytes) -> Image.Image:
+        """``decode_image`` with the configured limits, timed for ``stats()``."""
+        start = time.perf_counter()
+        try:
+            with stage("decode"):
+                image = decode_image(raw, settings.image_downscale_side, settings.upload_max_pixels)
+        except ImageTooLarge:
+            with self._decode_lock:
+                self._decode_rejected += 1
+            raise
+        with self._decode_lock:
+            self._decode_ms.append((time.perf_counter() - start) * 1000.0)
+        return image
+
     def encode_text(self, text: Union[str, List[str]]) -> np.ndarray:
         if isinstance(text, str):
-            texts = [text]
+            return self._encode_query_text(text)[None, :]
+        return self._forward_text(text)
+
+    def _encode_query_text(self, text: str) -> np.ndarray:
+        # Search queries repeat a lot, so single strings go through the cache.
+        key = cache_key(self.model_name, text) if self.text_cache is not None else None
+        if key is not None:
+            cached = self.text_cache.get(key)
+            if cached is not None:
+                return cached
+
+        if self.text_batcher is not None:
+            # Single queries from concurrent requests share one forward pass;
+            # the batcher thread runs outside this request, so time the wait.
+            with stage("forward"):
+                vec = self.text_batcher(text)
         else:
-            texts = text
-        with torch.no_grad():
-            tokens = clip.tokenize(texts).to(self.device)
-            embeddings = self.model.encode_text(tokens)
-            embeddings = embeddings.cpu().numpy()
-            embeddings = self._normalize(embeddings)
-        return embeddings
-
-    def encode_image(self, image: Union[Image.Image, str]) -> np.ndarray:
-        # Accept PIL image or base64 string
+            vec = self._forward_text([text])[0]
+
+        if key is not None:
+            self.text_cache.put(key, vec)
+        return vec
+
+    def encode_query_texts(self, texts: List[str]) -> np.ndarray:
+        """Encode many search queries: cache hits are reused, and the distinct
+        misses go through one forward pass. Returns (len(texts), dim)."""
+        keys = [cache_key(self.model_name, t) if self.text_cache is not None else None for t in texts]
+        vectors: Dict[str, np.ndarray] = {}
+        for text, key in zip(texts, keys):
+            if key is not None and text not in vectors:
+                cached = self.text_cache.get(key)
+                if cached is not None:
+                    vectors[text] = cached
+        missing = list(dict.fromkeys(t for t in texts if t not in vectors))
+        if missing:
+            for text, vec in zip(missing, self._forward_text(missing)):
+                vectors[text] = vec
+                if self.text_cache is not None:
+                    self.text_cache.put(cache_key(self.model_name, text), vec)
+        return np.stack([vectors[t] for t in texts])
+
+    def _image_key(self, digest: str) -> str:
+        return f"{self.model_name}\x00image:{digest}"
+
+    def cached_image_embedding(self, digest: str) -> np.ndarray | None:
+        if self.image_cache is None:
+            return None
+        return self.image_cache.get(self._image_key(digest))
+
+    def cache_image_embedding(self, digest: str, vec: np.ndarray) -> None:
+        if self.image_cache is not None:
+            self.image_cache.put(self._image_key(digest), np.asarray(vec, dtype=np.float32).reshape(-1))
+
+    def encode_image_bytes(self, raw: bytes, digest: str | None = None) -> np.ndarray:
+        """Encode uploaded image bytes, skipping inference for repeated uploads."""
+        digest = digest or image_digest(raw)
+        cached = self.cached_image_embedding(digest)
+        if cached is not None:
+            return cached[None, :]
+        emb = self._encode_single_image(raw)
+        self.cache_image_embedding(digest, emb[0])
+        return emb
+
+    def encode_images_bytes(self, raws: List[bytes], digests: List[str] | None = None) -> np.ndarray:
+        """Batched ``encode_image_bytes``: one forward pass for all cache misses."""
+        digests = digests or [image_digest(raw) for raw in raws]
+        vectors: Dict[str, np.ndarray] = {}
+        for digest in digests:
+            cached = self.cached_image_embedding(digest)
+            if cached is not None:
+                vectors[digest] = cached
+        missing = {d: raw for d, raw in zip(digests, raws) if d not in vectors}
+        if missing:
+            tensors = [self._prepare(raw) for raw in missing.values()]
+            for digest, vec in zip(missing, self._forward_image(tensors)):
+                vectors[digest] = vec
+                self.cache_image_embedding(digest, vec)
+        return np.stack([vectors[d] for d in digests])
+
+    def encode_image(self, image: Union[Image.Image, str, bytes, List[Image.Image]]) -> np.ndarray:
+        if isinstance(image, list):
+            return self._forward_image([self._prepare(img) for img in image])
         if isinstance(image, str):
-            # assume base64
-            header, _, data = image.partition(",")
-            raw = base64.b64decode(data)
-            image = Image.open(io.BytesIO(raw)).convert("RGB")
-        elif not isinstance(image, Image.Image):
-            raise ValueError("Unsupported image input")
+            return self.encode_image_bytes(decode_base64_image(image))
+        if isinstance(image, bytes):
+            return self.encode_image_bytes(image)
+        return self._encode_single_image(image)
 
-        img_t = self.preprocess(image).unsqueeze(0).to(self.device)
-        with torch.no_grad():
-            embeddings = self.model.encode_image(img_t)
-            embeddings = embeddings.cpu().numpy()
-            embeddings = self._normalize(embeddings)
-        return embeddings
+    def _encode_single_image(self, image: Union[Image.Image, bytes]) -> np.ndarray:
+        # Decode and preprocess on the caller's thread; only the forward pass is batched.
+        img_t = self._prepare(image)
+        if self.image_batcher is not None:
+            with stage("forward"):
+                return self.image_batcher(img_t)[None, :]
+        return self._forward_image([img_t])
+
+    def stats(self) -> Dict[str, Any]:
+        with self._decode_lock:
+            decode_ms, rejected = list(self._decode_ms), self._decode_rejected
+        return {
+            "device": self.device,
+            "backend": self.backend.name,
+            "decode": {
+                "count": len(decode_ms),
+                "rejected": rejected,
+                "ms_p50": float(np.percentile(decode_ms, 50)) if decode_ms else None,
+                "ms_p95": float(np.percentile(decode_ms, 95)) if decode_ms else None,
+                "ms_p99": float(np.percentile(decode_ms, 99)) if decode_ms else None,
+            },
+            "text_batcher": self.text_batcher.stats() if self.text_batcher else None,
+            "image_batcher": self.image_batcher.stats() if self.image_batcher else None,
+            "text_cache": self.text_cache.stats() if self.text_cache else None,
+            "image_cache": self.image_cache.stats() if self.image_cache else None,
+        }
 
 
 _svc: EmbeddingService | None = None
+_svc_lock = threading.Lock()
 
 
 def get_embedding_service(device: str = "cpu") -> EmbeddingService:
     global _svc
     if _svc is None:
-        _svc = EmbeddingService(device=device)
+        # Startup may be loading the model in the background while a request
+        # arrives; only one of them must build it.
+        with _svc_lock:
+            if _svc is None:
+                if settings.embedding_worker_socket:
+                    # The model lives in the shared embedding worker process.
+                    from .embedding_worker import EmbeddingWorkerClient
+
+                    _svc = EmbeddingWorkerClient(
+                        settings.embedding_worker_socket, timeout=settings.embedding_worker_timeout_seconds
+                    )
+                else:
+                    _svc = EmbeddingService(device=device)
     return _svc
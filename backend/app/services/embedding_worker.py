@@ -0,0 +1,393 @@
+"""Standalone embedding worker shared by all API processes on a host.
+
+The worker owns the only copy of the CLIP model and serves encode requests
+over a Unix socket. API processes use ``EmbeddingWorkerClient``, which has
+the same ``encode_text``/``encode_image`` interface as ``EmbeddingService``
+(set ``EMBEDDING_WORKER_SOCKET`` and ``get_embedding_service`` returns one),
+so HTTP workers and inference capacity scale independently and batches fill
+up with requests from every API process.
+
+Wire format, both directions: 4-byte big-endian header length, JSON header,
+4-byte payload length, payload. Texts travel in the header; image bytes are
+concatenated in the payload (sizes in the header); embeddings come back as a
+float32 ``(n, dim)`` payload.
+"""
+from typing import Any, Dict, List, Optional, Tuple, Union
+import asyncio
+import json
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+
+import numpy as np
+from PIL import UnidentifiedImageError
+
+from ..config import settings
+from .embedding_cache import cache_key
+from .embedding_service import EmbeddingService, ImageTooLarge, decode_base64_image, image_digest
+from .inference_executor import InferenceQueueFull
+from .telemetry import stage
+
+
+logger = logging.getLogger(__name__)
+
+_LEN = struct.Struct(">I")
+
+
+def _frame(header: Dict[str, Any], payload: bytes = b"") -> bytes:
+    head = json.dumps(header).encode()
+    return _LEN.pack(len(head)) + head + _LEN.pack(len(payload)) + payload
+
+
+async def _read_frame(reader: asyncio.StreamReader) -> Tuple[Dict[str, Any], bytes]:
+    head = await reader.readexactly(_LEN.unpack(await reader.readexactly(4))[0])
+    payload = await reader.readexactly(_LEN.unpack(await reader.readexactly(4))[0])
+    return json.loads(head), payload
+
+
+class EmbeddingWorkerServer:
+    """Bounded, coalescing, batching front end for one ``EmbeddingService``.
+
+    Identical texts or images (same cache key / SHA-256) already queued or
+    being encoded share one result instead of being encoded again. At most
+    ``queue_size`` distinct items wait per modality; a request that does not
+    fit is answered ``busy`` at once so clients can shed load.
+    """
+
+    def __init__(self, svc, queue_size: int = 256, max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        self.svc = svc
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.queues = {"text": asyncio.Queue(maxsize=queue_size), "image": asyncio.Queue(maxsize=queue_size)}
+        self.inflight: Dict[str, asyncio.Future] = {}
+        self.started = time.time()
+        self.counters = {"requests": 0, "items": 0, "coalesced": 0, "rejected": 0, "batches": 0, "errors": 0}
+
+    # ---- batching ----------------------------------------------------
+
+    def _encode_texts(self, texts: List[str]) -> List[Any]:
+        return list(self.svc.encode_query_texts(texts))
+
+    def _encode_images(self, raws: List[bytes], digests: List[str]) -> List[Any]:
+        # Decode per item so one bad upload does not fail the whole batch.
+        results: List[Any] = [None] * len(raws)
+        tensors, positions = [], []
+        for i, (raw, digest) in enumerate(zip(raws, digests)):
+            cached = self.svc.cached_image_embedding(digest)
+            if cached is not None:
+                results[i] = cached
+                continue
+            try:
+                tensors.append(self.svc._prepare(raw))
+                positions.append(i)
+            except Exception as e:
+                results[i] = e
+        if tensors:
+            for i, vec in zip(positions, self.svc._forward_image(tensors)):
+                results[i] = vec
+                self.svc.cache_image_embedding(digests[i], vec)
+        return results
+
+    async def _consume(self, kind: str) -> None:
+        queue = self.queues[kind]
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            keys = [key for key, _, _ in batch]
+            try:
+                if kind == "text":
+                    out = await asyncio.to_thread(self._encode_texts, [item for _, item, _ in batch])
+                else:
+                    out = await asyncio.to_thread(self._encode_images, [item for _, item, _ in batch], keys)
+                for (_, _, fut), vec in zip(batch, out):
+                    if isinstance(vec, Exception):
+                        fut.set_exception(vec)
+                    else:
+                        fut.set_result(np.asarray(vec, dtype=np.float32))
+                self.counters["batches"] += 1
+            except Exception as e:
+                self.counters["errors"] += 1
+                for _, _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+            finally:
+                for key in keys:
+                    self.inflight.pop(key, None)
+
+    def _submit(self, kind: str, keys: List[str], items: List[Any]) -> Optional[List[asyncio.Future]]:
+        """Futures for ``items``, or None when the queue cannot take them."""
+        queue = self.queues[kind]
+        new = {k for k in keys if k not in self.inflight}
+        if queue.qsize() + len(new) > queue.maxsize:
+            self.counters["rejected"] += 1
+            return None
+        loop = asyncio.get_running_loop()
+        futures = []
+        for key, item in zip(keys, items):
+            fut = self.inflight.get(key)
+            if fut is None:
+                fut = self.inflight[key] = loop.create_future()
+                queue.put_nowait((key, item, fut))
+            else:
+                self.counters["coalesced"] += 1
+            futures.append(fut)
+        self.counters["items"] += len(items)
+        return futures
+
+    # ---- protocol ----------------------------------------------------
+
+    def health(self) -> Dict[str, Any]:
+        return {
+            "status": "ok",
+            "model": self.svc.model_name,
+            "backend": self.svc.backend.name,
+            "pid": os.getpid(),
+            "uptime_s": time.time() - self.started,
+            "queue_depth": {kind: q.qsize() for kind, q in self.queues.items()},
+            "queue_size": self.queues["text"].maxsize,
+            "inflight": len(self.inflight),
+            **self.counters,
+        }
+
+    async def _handle_request(self, header: Dict[str, Any], payload: bytes) -> bytes:
+        op = header.get("op")
+        if op == "health":
+            return _frame(self.health())
+        if op == "stats":
+            return _frame({"ok": True, "stats": self.svc.stats(), "worker": self.health()})
+
+        self.counters["requests"] += 1
+        if op == "encode_text":
+            texts = header["texts"]
+            futures = self._submit("text", [cache_key(self.svc.model_name, t) for t in texts], texts)
+        elif op == "encode_image":
+            raws, offset = [], 0
+            for size in header["sizes"]:
+                raws.append(payload[offset:offset + size])
+                offset += size
+            digests = header.get("digests") or [image_digest(raw) for raw in raws]
+            futures = self._submit("image", digests, raws)
+        else:
+            return _frame({"ok": False, "error": "bad_request", "detail": f"unknown op {op!r}"})
+
+        if futures is None:
+            return _frame({"ok": False, "error": "busy", "detail": "embedding worker queue full"})
+        try:
+            vectors = await asyncio.gather(*futures)
+        except ImageTooLarge as e:
+            return _frame({"ok": False, "error": "too_large", "detail": str(e)})
+        except (UnidentifiedImageError, OSError, ValueError) as e:
+            return _frame({"ok": False, "error": "bad_image", "detail": str(e)})
+        except Exception:
+            # Answer instead of dropping the connection, which the client
+            # would only see as a closed socket (and retry).
+            logger.exception("embedding worker %s failed", op)
+            return _frame({"ok": False, "error": "internal", "detail": f"{op} failed in the embedding worker"})
+        out = np.stack(vectors).astype(np.float32)
+        return _frame({"ok": True, "shape": list(out.shape)}, out.tobytes())
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                header, payload = await _read_frame(reader)
+                writer.write(await self._handle_request(header, payload))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, path: str) -> None:
+        if os.path.exists(path):
+            os.unlink(path)
+        consumers = [asyncio.create_task(self._consume(kind)) for kind in self.queues]
+        server = await asyncio.start_unix_server(self._handle, path=path)
+        os.chmod(path, 0o660)
+        print(f"Embedding worker listening on {path}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in consumers:
+                task.cancel()
+
+
+def serve(path: Optional[str] = None) -> None:
+    svc = EmbeddingService(device=settings.device, batching=False)
+    if settings.model_warmup:
+        svc.warmup()
+    server = EmbeddingWorkerServer(
+        svc,
+        queue_size=settings.embedding_worker_queue_size,
+        max_batch_size=settings.embedding_max_batch_size,
+        max_wait_ms=settings.embedding_max_wait_ms,
+    )
+    asyncio.run(server.serve(path or settings.embedding_worker_socket))
+
+
+class EmbeddingWorkerUnavailable(RuntimeError):
+    """The embedding worker socket could not be reached."""
+
+
+class EmbeddingWorkerClient:
+    """Drop-in for ``EmbeddingService`` that forwards to the embedding worker.
+
+    Blocking and thread-safe: each calling thread (the inference executor's
+    workers) keeps its own connection to the socket.
+    """
+
+    def __init__(self, path: str, timeout: float = 30.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._model_name: Optional[str] = None
+
+    @property
+    def model_name(self) -> Optional[str]:
+        """The worker's model as of the last ``health()`` call (None before one).
+
+        Never does I/O itself, so it is safe to read on the event loop; use
+        ``fetch_model_name`` from a thread to fill it in.
+        """
+        return self._model_name
+
+    def fetch_model_name(self) -> Optional[str]:
+        """``model_name``, asking the worker if it is not known yet (blocking)."""
+        if self._model_name is None:
+            try:
+                self.health()
+            except EmbeddingWorkerUnavailable:
+                pass
+        return self._model_name
+
+    def _connect(self) -> socket.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except OSError as e:
+            sock.close()
+            raise EmbeddingWorkerUnavailable(f"embedding worker not reachable at {self.path}: {e}") from e
+        return sock
+
+    @staticmethod
+    def _recv_exact(sock: socket.socket, n: int) -> bytes:
+        buf = bytearray()
+        while len(buf) < n:
+            chunk = sock.recv(n - len(buf))
+            if not chunk:
+                raise ConnectionError("embedding worker closed the connection")
+            buf += chunk
+        return bytes(buf)
+
+    def _call(self, header: Dict[str, Any], payload: bytes = b"") -> Tuple[Dict[str, Any], bytes]:
+        """One request/reply. Failures raise ``EmbeddingWorkerUnavailable``.
+
+        Only a kept-alive connection that turns out to be dead is retried,
+        once, on a fresh one: the worker restarted since, so it never saw the
+        request. A timeout is not retried, as the worker may still be
+        encoding it and a resend would only add to its queue.
+        """
+        message = _frame(header, payload)
+        while True:
+            sock = getattr(self._local, "sock", None)
+            reused = sock is not None
+            if not reused:
+                sock = self._local.sock = self._connect()
+            try:
+                sock.sendall(message)
+                head = self._recv_exact(sock, _LEN.unpack(self._recv_exact(sock, 4))[0])
+                body = self._recv_exact(sock, _LEN.unpack(self._recv_exact(sock, 4))[0])
+                return json.loads(head), body
+            except socket.timeout as e:
+                self._drop(sock)
+                raise EmbeddingWorkerUnavailable(f"embedding worker did not answer within {self.timeout}s") from e
+            except OSError as e:
+                self._drop(sock)
+                if not (reused and isinstance(e, ConnectionError)):
+                    raise EmbeddingWorkerUnavailable(f"embedding worker connection failed: {e}") from e
+
+    def _drop(self, sock: socket.socket) -> None:
+        sock.close()
+        self._local.sock = None
+
+    def _vectors(self, header: Dict[str, Any], payload: bytes = b"") -> np.ndarray:
+        with stage("embedding_worker"):
+            resp, body = self._call(header, payload)
+        if not resp.get("ok"):
+            error, detail = resp.get("error"), resp.get("detail", "")
+            if error == "busy":
+                raise InferenceQueueFull(detail)
+            if error == "too_large":
+                raise ImageTooLarge(detail)
+            if error == "bad_image":
+                raise UnidentifiedImageError(detail)
+            if error == "internal":
+                raise RuntimeError(f"embedding worker failed: {detail}")
+            raise RuntimeError(f"embedding worker error {error}: {detail}")
+        return np.frombuffer(body, dtype=np.float32).reshape(resp["shape"])
+
+    # ---- EmbeddingService interface ----------------------------------
+
+    def encode_query_texts(self, texts: List[str]) -> np.ndarray:
+        return self._vectors({"op": "encode_text", "texts": list(texts)})
+
+    def encode_text(self, text: Union[str, List[str]]) -> np.ndarray:
+        return self.encode_query_texts([text] if isinstance(text, str) else text)
+
+    def encode_images_bytes(self, raws: List[bytes], digests: Optional[List[str]] = None) -> np.ndarray:
+        header = {"op": "encode_image", "sizes": [len(raw) for raw in raws], "digests": digests}
+        return self._vectors(header, b"".join(raws))
+
+    def encode_image_bytes(self, raw: bytes, digest: Optional[str] = None) -> np.ndarray:
+        return self.encode_images_bytes([raw], [digest] if digest else None)
+
+    def encode_image(self, image: Union[str, bytes, List[bytes]]) -> np.ndarray:
+        if isinstance(image, list):
+            return self.encode_images_bytes(image)
+        if isinstance(image, str):
+            image = decode_base64_image(image)
+        return self.encode_image_bytes(image)
+
+    def cached_image_embedding(self, digest: str) -> Optional[np.ndarray]:
+        return None  # the worker checks its image cache itself
+
+    def cache_image_embedding(self, digest: str, vec) -> None:
+        pass
+
+    def health(self) -> Dict[str, Any]:
+        resp = self._call({"op": "health"})[0]
+        self._model_name = resp.get("model") or self._model_name
+        return resp
+
+    def warmup(self, wait_seconds: float = 60.0) -> None:
+        """Wait for the worker to come up (it may start after the API)."""
+        deadline = time.monotonic() + wait_seconds
+        while True:
+            try:
+                self.health()
+                return
+            except EmbeddingWorkerUnavailable:
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(1.0)
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            resp, _ = self._call({"op": "stats"})
+        except EmbeddingWorkerUnavailable as e:
+            return {"worker": {"status": "unreachable", "detail": str(e)}}
+        return {**resp["stats"], "worker": resp["worker"]}
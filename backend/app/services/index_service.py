@@ -0,0 +1,257 @@
+from typing import Callable, Dict, Any, List, Optional
+import math
+import re
+import threading
+import time
+from sqlalchemy import text
+
+from ..database import engine as default_engine
+
+
+DEFAULT_INDEX_NAME = "idx_medical_cases_image_embedding"
+
+# Distance operator classes accepted by pgvector; the search SQL uses <=>.
+OPCLASSES = {
+    "cosine": "vector_cosine_ops",
+    "l2": "vector_l2_ops",
+    "ip": "vector_ip_ops",
+}
+
+
+EMBEDDING_DIM = 512
+
+# Quantized ANN indexes are expression indexes over the full-precision
+# columns, which stay the source for the exact rerank. SearchService orders
+# candidates by quantized_expression(), so it must match the index exactly.
+QUANTIZATIONS = ("none", "halfvec", "binary")
+
+
+def quantized_expression(column: str, quantization: str = "none") -> str:
+    if quantization == "halfvec":
+        return f"(CAST({column} AS halfvec({EMBEDDING_DIM})))"
+    if quantization == "binary":
+        return f"(CAST(binary_quantize({column}) AS bit({EMBEDDING_DIM})))"
+    if quantization == "none":
+        return column
+    raise ValueError(f"Unsupported quantization: {quantization}")
+
+
+def quantized_order_by(column: str, quantization: str = "none", param: str = ":q") -> str:
+    """ORDER BY expression that can use the ``quantization`` index on ``column``."""
+    if quantization == "binary":
+        # Hamming distance between sign bits; the only bit opclass for HNSW.
+        query = f"CAST(binary_quantize(CAST({param} AS vector({EMBEDDING_DIM}))) AS bit({EMBEDDING_DIM}))"
+        return f"{quantized_expression(column, quantization)} <~> {query}"
+    if quantization == "halfvec":
+        return f"{quantized_expression(column, quantization)} <=> CAST({param} AS halfvec({EMBEDDING_DIM}))"
+    return f"{column} <=> {param}"
+
+
+def quantized_index_name(column: str = "image_embedding", quantization: str = "none") -> str:
+    base = f"idx_medical_cases_{column}"
+    return base if quantization == "none" else f"{base}_{quantization}"
+
+
+def ivfflat_lists_for(rows: int) -> int:
+    """pgvector's guidance: rows / 1000 up to 1M rows, sqrt(rows) above that."""
+    if rows <= 1_000_000:
+        return max(1, rows // 1000)
+    return int(math.sqrt(rows))
+
+
+def partial_index_name(modality: str, column: str = "image_embedding", quantization: str = "none") -> str:
+    slug = re.sub(r"\W+", "_", modality.lower()).strip("_")
+    return f"{quantized_index_name(column, quantization)}_{slug}"
+
+
+class IndexManager:
+    """Build, inspect and swap the ANN indexes on ``medical_cases``.
+
+    All DDL runs in autocommit mode so ``CREATE/DROP INDEX CONCURRENTLY`` can
+    be used and searches keep being served while an index is being built.
+    """
+
+    def __init__(self, engine=None, table: str = "medical_cases"):
+        self.engine = engine if engine is not None else default_engine
+        self.table = table
+
+    def _autocommit(self):
+        return self.engine.execution_options(isolation_level="AUTOCOMMIT").connect()
+
+    def row_count(self) -> int:
+        with self.engine.connect() as conn:
+            # reltuples is free but only as fresh as the last ANALYZE/VACUUM.
+            est = conn.execute(
+                text("SELECT reltuples::bigint FROM pg_class WHERE oid = CAST(:t AS regclass)"),
+                {"t": self.table},
+            ).scalar()
+            if est is None or est < 0:
+                est = conn.execute(text(f"SELECT count(*) FROM {self.table}")).scalar()
+            return int(est)
+
+    def list_indexes(self) -> List[Dict[str, Any]]:
+        sql = """
+        SELECT c.relname AS name, am.amname AS method, i.indisvalid AS valid,
+               pg_relation_size(c.oid) AS size_bytes, pg_get_indexdef(c.oid) AS definition
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        JOIN pg_am am ON am.oid = c.relam
+        WHERE i.indrelid = CAST(:t AS regclass)
+        ORDER BY c.relname
+        """
+        with self.engine.connect() as conn:
+            return [dict(r) for r in conn.execute(text(sql), {"t": self.table}).mappings().all()]
+
+    def index_ddl(
+        self,
+        name: str,
+        column: str = "image_embedding",
+        method: str = "hnsw",
+        m: int = 16,
+        ef_construction: int = 64,
+        lists: Optional[int] = None,
+        distance: str = "cosine",
+        opclass: Optional[str] = None,
+        where: Optional[str] = None,
+        concurrently: bool = True,
+        quantization: str = "none",
+    ) -> str:
+        if opclass is None:
+            opclass = OPCLASSES[distance]
+            if quantization == "halfvec":
+                opclass = opclass.replace("vector_", "halfvec_")
+            elif quantization == "binary":
+                opclass = "bit_hamming_ops"
+        if method == "hnsw":
+            with_clause = f"WITH (m = {int(m)}, ef_construction = {int(ef_construction)})"
+        elif method == "ivfflat":
+            if lists is None:
+                lists = ivfflat_lists_for(self.row_count())
+            with_clause = f"WITH (lists = {int(lists)})"
+        else:
+            raise ValueError(f"Unsupported index method: {method}")
+
+        sql = (
+            f"CREATE INDEX {'CONCURRENTLY ' if concurrently else ''}{name} "
+            f"ON {self.table} USING {method} ({quantized_expression(column, quantization)} {opclass}) {with_clause}"
+        )
+        if where:
+            sql += f" WHERE {where}"
+        return sql
+
+    def _watch_progress(self, stop: threading.Event, callback: Callable[[Dict[str, Any]], None], interval: float):
+        sql = """
+        SELECT phase, blocks_done, blocks_total, tuples_done, tuples_total
+        FROM pg_stat_progress_create_index
+        WHERE relid = CAST(:t AS regclass)
+        """
+        with self.engine.connect() as conn:
+            while not stop.wait(interval):
+                row = conn.execute(text(sql), {"t": self.table}).mappings().first()
+                conn.rollback()
+                if row is not None:
+                    callback(dict(row))
+
+    def build(
+        self,
+        name: str,
+        progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+        progress_interval: float = 2.0,
+        maintenance_work_mem: Optional[str] = None,
+        parallel_workers: Optional[int] = None,
+        ddl: Optional[str] = None,
+        **ddl_options,
+    ) -> Dict[str, Any]:
+        """Create an index concurrently and return its name, DDL and build time.
+
+        ``ddl`` runs a ready-made ``CREATE INDEX CONCURRENTLY`` statement for
+        ``name`` instead of one built from ``ddl_options``.
+        """
+        ddl = ddl or self.index_ddl(name, **ddl_options)
+
+        stop = threading.Event()
+        watcher = None
+        if progress is not None:
+            watcher = threading.Thread(
+                target=self._watch_progress, args=(stop, progress, progress_interval), daemon=True
+            )
+            watcher.start()
+
+        start = time.time()
+        try:
+            with self._autocommit() as conn:
+                # HNSW builds are much faster when the graph fits in memory.
+                if maintenance_work_mem:
+                    conn.execute(text("SELECT set_config('maintenance_work_mem', :v, false)"), {"v": maintenance_work_mem})
+                if parallel_workers is not None:
+                    conn.execute(
+                        text("SELECT set_config('max_parallel_maintenance_workers', :v, false)"),
+                        {"v": str(int(parallel_workers))},
+                    )
+                conn.execute(text(ddl))
+        finally:
+            stop.set()
+            if watcher is not None:
+                watcher.join()
+        seconds = time.time() - start
+
+        # A failed CONCURRENTLY build leaves an INVALID index behind; never
+        # let one of those be swapped in.
+        if not self.is_valid(name):
+            self.drop(name)
+            raise RuntimeError(f"Index {name} was built but is not valid; it has been dropped")
+
+        return {"name": name, "ddl": ddl, "build_seconds": seconds}
+
+    def is_valid(self, name: str) -> bool:
+        with self.engine.connect() as conn:
+            valid = conn.execute(
+                text("SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :n"),
+                {"n": name},
+            ).scalar()
+        return bool(valid)
+
+    def drop(self, name: str) -> None:
+        with self._autocommit() as conn:
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+    def swap(self, old_name: str, new_name: str) -> None:
+        """Replace ``old_name`` with the already-built ``new_name``.
+
+        Both indexes exist while the old one is dropped, so queries always
+        have an index to use; the rename only touches the catalog.
+        """
+        if not self.is_valid(new_name):
+            raise RuntimeError(f"Refusing to swap in invalid index {new_name}")
+        self.drop(old_name)
+        with self._autocommit() as conn:
+            conn.execute(text(f"ALTER INDEX {new_name} RENAME TO {old_name}"))
+
+    def modality_counts(self) -> Dict[str, int]:
+        with self.engine.connect() as conn:
+            rows = conn.execute(text(f"SELECT modality, count(*) FROM {self.table} GROUP BY modality")).all()
+        return {m: int(n) for m, n in rows}
+
+    def build_partial(self, modality: str, **build_options) -> Dict[str, Any]:
+        """(Re)build a partial ANN index covering only ``modality``.
+
+        SearchService detects these from the catalog and routes large
+        modality-filtered searches to them, so the graph walk only visits
+        rows that can pass the filter.
+        """
+        where = "modality = '" + modality.replace("'", "''") + "'"
+        name = partial_index_name(
+            modality, build_options.get("column", "image_embedding"), build_options.get("quantization", "none")
+        )
+        return self.rebuild(name, where=where, **build_options)
+
+    def rebuild(self, name: str = DEFAULT_INDEX_NAME, **build_options) -> Dict[str, Any]:
+        """Build a replacement next to ``name`` and swap it in with no downtime."""
+        tmp_name = f"{name}_new"
+        self.drop(tmp_name)  # leftovers from an interrupted rebuild
+        info = self.build(tmp_name, **build_options)
+        self.swap(name, tmp_name)
+        info["name"] = name
+        with self._autocommit() as conn:
+            conn.execute(text(f"ANALYZE {self.table}"))
+        return info
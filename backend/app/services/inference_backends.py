@@ -0,0 +1,208 @@
+from pathlib import Path
+from typing import Optional
+import copy
+import hashlib
+import os
+import tempfile
+import numpy as np
+import torch
+
+from ..config import settings
+
+
+BACKENDS = ("torch", "torch_int8", "torchscript", "onnx", "onnx_int8")
+
+# Batch of one for tracing/export; the batch axis is dynamic afterwards.
+_TEXT_CONTEXT = 77
+_IMAGE_SIZE = 224
+
+
+def _weights_digest(model) -> str:
+    """Short hash of the state dict, so exports from another checkpoint of the
+    same model name are not mistaken for this one."""
+    h = hashlib.sha1()
+    for name, tensor in model.state_dict().items():
+        h.update(name.encode())
+        h.update(tensor.detach().contiguous().numpy().reshape(-1).view(np.uint8).data)
+    return h.hexdigest()[:12]
+
+
+def _temp_path(path: Path) -> Path:
+    # Unique per writer: several workers may export the same graph at once.
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.stem}.", suffix=path.suffix)
+    os.close(fd)
+    return Path(tmp)
+
+
+class _TextEncoder(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, tokens):
+        return self.model.encode_text(tokens)
+
+
+class _ImageEncoder(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, images):
+        return self.model.encode_image(images)
+
+
+def configure_threads() -> None:
+    """Apply the intra-/inter-op thread settings to torch.
+
+    The inter-op pool can only be sized before it is first used, so a late
+    call (e.g. a second EmbeddingService) leaves it as it is.
+    """
+    if settings.inference_intra_op_threads:
+        torch.set_num_threads(settings.inference_intra_op_threads)
+    if settings.inference_inter_op_threads:
+        try:
+            torch.set_num_interop_threads(settings.inference_inter_op_threads)
+        except RuntimeError:
+            pass
+
+
+class TorchBackend:
+    """Eager PyTorch; ``quantize`` applies dynamic int8 quantization to the
+    Linear layers (the transformer MLPs and projections), CPU only."""
+
+    def __init__(self, model, device: str = "cpu", quantize: bool = False):
+        self.device = device
+        if quantize:
+            if device != "cpu":
+                raise ValueError("int8 dynamic quantization is only supported on CPU")
+            model = torch.ao.quantization.quantize_dynamic(model.float(), {torch.nn.Linear}, dtype=torch.qint8)
+        self.model = model
+        self.name = "torch_int8" if quantize else "torch"
+
+    def encode_text(self, tokens: torch.Tensor) -> np.ndarray:
+        with torch.inference_mode():
+            return self.model.encode_text(tokens.to(self.device)).float().cpu().numpy()
+
+    def encode_image(self, images: torch.Tensor) -> np.ndarray:
+        with torch.inference_mode():
+            return self.model.encode_image(images.to(self.device)).float().cpu().numpy()
+
+
+class TorchScriptBackend:
+    """Traced TorchScript graphs, optimized for inference (fused ops, no
+    Python dispatch per module)."""
+
+    name = "torchscript"
+
+    def __init__(self, model, device: str = "cpu"):
+        self.device = device
+        dtype = next(model.parameters()).dtype
+        with torch.inference_mode():
+            tokens = torch.zeros((1, _TEXT_CONTEXT), dtype=torch.long, device=device)
+            images = torch.zeros((1, 3, _IMAGE_SIZE, _IMAGE_SIZE), dtype=dtype, device=device)
+            self.text = torch.jit.optimize_for_inference(torch.jit.trace(_TextEncoder(model).eval(), tokens))
+            self.image = torch.jit.optimize_for_inference(torch.jit.trace(_ImageEncoder(model).eval(), images))
+        self.dtype = dtype
+
+    def encode_text(self, tokens: torch.Tensor) -> np.ndarray:
+        with torch.inference_mode():
+            return self.text(tokens.to(self.device)).float().cpu().numpy()
+
+    def encode_image(self, images: torch.Tensor) -> np.ndarray:
+        with torch.inference_mode():
+            return self.image(images.to(self.device, self.dtype)).float().cpu().numpy()
+
+
+class OnnxBackend:
+    """ONNX Runtime sessions over graphs exported from the CLIP model.
+
+    Exported (and, for ``onnx_int8``, dynamically quantized) graphs are kept
+    in ``model_dir``, named by model and a hash of its weights, and reused on
+    later starts. Needs the optional ``onnxruntime`` package.
+    """
+
+    def __init__(self, model, model_name: str, device: str = "cpu", quantize: bool = False,
+                 model_dir: Optional[str] = None):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError("INFERENCE_BACKEND=onnx requires onnxruntime: pip install onnxruntime") from e
+
+        self.name = "onnx_int8" if quantize else "onnx"
+        model_dir = Path(model_dir or settings.model_cache_dir)
+        model_dir.mkdir(parents=True, exist_ok=True)
+        param = next(model.parameters())
+        if param.device.type != "cpu" or param.dtype != torch.float32:
+            # Export from a float32 CPU copy; the service keeps its own model.
+            model = copy.deepcopy(model).float().cpu()
+        model.eval()
+        stem = f"{model_name.replace('/', '-')}-{_weights_digest(model)}"
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if settings.inference_intra_op_threads:
+            options.intra_op_num_threads = settings.inference_intra_op_threads
+        if settings.inference_inter_op_threads:
+            options.inter_op_num_threads = settings.inference_inter_op_threads
+            options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+        providers = ["CPUExecutionProvider"]
+        if device.startswith("cuda") and "CUDAExecutionProvider" in ort.get_available_providers():
+            providers.insert(0, "CUDAExecutionProvider")
+
+        text_path = self._export(
+            _TextEncoder(model), torch.zeros((1, _TEXT_CONTEXT), dtype=torch.long),
+            model_dir / f"{stem}-text.onnx", "tokens", quantize,
+        )
+        image_path = self._export(
+            _ImageEncoder(model), torch.zeros((1, 3, _IMAGE_SIZE, _IMAGE_SIZE)),
+            model_dir / f"{stem}-image.onnx", "images", quantize,
+        )
+        self.text = ort.InferenceSession(str(text_path), options, providers=providers)
+        self.image = ort.InferenceSession(str(image_path), options, providers=providers)
+
+    @staticmethod
+    def _export(module, example, path: Path, input_name: str, quantize: bool) -> Path:
+        if not path.exists():
+            tmp = _temp_path(path)
+            try:
+                torch.onnx.export(
+                    module.eval(), example, str(tmp),
+                    input_names=[input_name], output_names=["embedding"],
+                    dynamic_axes={input_name: {0: "batch"}, "embedding": {0: "batch"}},
+                    opset_version=17,
+                )
+                tmp.replace(path)
+            finally:
+                tmp.unlink(missing_ok=True)
+        if not quantize:
+            return path
+        qpath = path.with_suffix(".int8.onnx")
+        if not qpath.exists():
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            tmp = _temp_path(qpath)
+            try:
+                quantize_dynamic(str(path), str(tmp), weight_type=QuantType.QInt8)
+                tmp.replace(qpath)
+            finally:
+                tmp.unlink(missing_ok=True)
+        return qpath
+
+    def encode_text(self, tokens: torch.Tensor) -> np.ndarray:
+        return self.text.run(None, {"tokens": tokens.cpu().numpy().astype(np.int64)})[0]
+
+    def encode_image(self, images: torch.Tensor) -> np.ndarray:
+        return self.image.run(None, {"images": images.cpu().numpy().astype(np.float32)})[0]
+
+
+def build_backend(name: str, model, model_name: str, device: str = "cpu"):
+    if name == "torch":
+        return TorchBackend(model, device)
+    if name == "torch_int8":
+        return TorchBackend(model, device, quantize=True)
+    if name == "torchscript":
+        return TorchScriptBackend(model, device)
+    if name in ("onnx", "onnx_int8"):
+        return OnnxBackend(model, model_name, device, quantize=name == "onnx_int8")
+    raise ValueError(f"Unknown inference backend: {name} (expected one of {', '.join(BACKENDS)})")
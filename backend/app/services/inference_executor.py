@@ -0,0 +1,84 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict
+import asyncio
+import contextvars
+import threading
+
+from ..config import settings
+
+
+class InferenceQueueFull(Exception):
+    """Raised when the inference executor has no room for another request."""
+
+
+class InferenceExecutor:
+    """Bounded thread pool that keeps model inference off the event loop.
+
+    At most ``max_workers`` calls run at once and at most ``max_queue`` more
+    wait for a thread; anything beyond that is rejected immediately with
+    ``InferenceQueueFull`` so overload fails fast instead of queueing up.
+    Workers mostly block on the embedding micro-batcher, so ``max_workers``
+    should be at least the batch size for batches to fill.
+    """
+
+    def __init__(self, max_workers: int = 16, max_queue: int = 64):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="inference")
+        self._lock = threading.Lock()
+        self._inflight = 0
+        self._rejected = 0
+
+    def _acquire(self) -> None:
+        with self._lock:
+            if self._inflight >= self.max_workers + self.max_queue:
+                self._rejected += 1
+                raise InferenceQueueFull(f"inference queue full ({self._inflight} in flight)")
+            self._inflight += 1
+
+    def _release(self) -> None:
+        with self._lock:
+            self._inflight -= 1
+
+    def _release_done(self, _future) -> None:
+        self._release()
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        self._acquire()
+        # Run in a copy of the caller's context so request-scoped state
+        # (the telemetry stage timer) is visible on the worker thread.
+        ctx = contextvars.copy_context()
+        try:
+            future = self._executor.submit(partial(ctx.run, fn, *args, **kwargs))
+        except BaseException:
+            self._release()
+            raise
+        # Release when the call finishes, not when the caller stops waiting:
+        # a cancelled request (client disconnect) leaves the thread running.
+        future.add_done_callback(self._release_done)
+        return await asyncio.wrap_future(future)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            inflight, rejected = self._inflight, self._rejected
+        return {
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "inflight": inflight,
+            "queued": max(0, inflight - self.max_workers),
+            "rejected": rejected,
+        }
+
+
+_executor: InferenceExecutor | None = None
+
+
+def get_inference_executor() -> InferenceExecutor:
+    global _executor
+    if _executor is None:
+        _executor = InferenceExecutor(
+            max_workers=settings.inference_workers,
+            max_queue=settings.inference_queue_size,
+        )
+    return _executor
@@ -0,0 +1,416 @@
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import text
+from pgvector.sqlalchemy import Vector
+
+from ..config import settings
+from ..database import engine as default_engine
+from .corpus import get_live_model
+
+
+EMBEDDING_DIM = 512
+
+_SCAN_CHUNK_ROWS = 65536  # rows per matmul chunk; bounds float32 temporaries
+
+
+def _normalize_rows(mat: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    return mat / np.where(norms == 0, 1, norms)
+
+
+@contextmanager
+def _file_lock(path: Path, exclusive: bool, blocking: bool = True):
+    """``flock`` on ``path`` across processes; yields False instead of waiting
+    when ``blocking`` is off and another process holds it."""
+    with open(path, "a") as f:
+        flags = (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | (0 if blocking else fcntl.LOCK_NB)
+        try:
+            fcntl.flock(f, flags)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _temp_path(directory: Path, name: str) -> Path:
+    """A tmp file next to ``name`` that no other process writes to."""
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=f".{name}.", suffix=".tmp")
+    os.close(fd)
+    return Path(tmp)
+
+
+def _save_npy(path: Path, arr: np.ndarray) -> None:
+    with open(path, "wb") as f:  # a file object: np.save would append ".npy" to the tmp name
+        np.save(f, arr)
+
+
+def _replace_atomic(directory: Path, name: str, write) -> None:
+    # Never truncate a file in place: other workers may have it mmapped.
+    tmp = _temp_path(directory, name)
+    try:
+        write(tmp)
+        tmp.replace(directory / name)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+class LocalVectorIndex:
+    """In-process exact top-k over a memory-mapped copy of ``image_embedding``.
+
+    The main segment lives in ``directory`` as ``.npy`` files (vectors, ids
+    sorted ascending, int16 modality/body_part codes) opened with
+    ``mmap_mode="r"``, so worker processes share the page cache rather than
+    each holding a copy. ``refresh`` pulls rows changed since the
+    ``updated_at`` watermark into a small in-memory delta segment and masks
+    their stale copies in the main segment; ``build`` rewrites everything
+    (and is the only way rows deleted in Postgres disappear). The segment
+    records the model its vectors came from; ``refresh`` rebuilds it when a
+    reembed cutover has switched medical_cases to another model, which
+    leaves ``updated_at`` untouched.
+
+    Every uvicorn worker refreshes the same directory, so builds are
+    serialised with an ``flock`` on ``.build.lock`` and write private tmp
+    files that are renamed into place; a worker that finds a build running
+    skips it and reloads the result once ``meta.json`` changes.
+
+    Scores are dot products of unit vectors, i.e. cosine similarity, the same
+    ``1 - (a <=> b)`` that the pgvector path returns.
+    """
+
+    def __init__(self, directory: str, dtype: str = "float16", engine=None):
+        self.directory = Path(directory)
+        self.dtype = np.dtype(dtype)
+        self.engine = engine if engine is not None else default_engine
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self.vectors = np.zeros((0, EMBEDDING_DIM), dtype=self.dtype)
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.modality_codes = np.zeros(0, dtype=np.int16)
+        self.body_part_codes = np.zeros(0, dtype=np.int16)
+        self.live = np.zeros(0, dtype=bool)
+        self.modalities: List[str] = []
+        self.body_parts: List[str] = []
+        self.watermark: Optional[datetime] = None
+        self.model: Optional[str] = None
+        self.built_at: Optional[str] = None
+        # Delta segment: id -> (vector float32, modality, body_part)
+        self.delta: Dict[int, Tuple[np.ndarray, str, str]] = {}
+        self._delta_cache = None
+        self._masks: Dict[Tuple[str, str], np.ndarray] = {}
+
+    @property
+    def size(self) -> int:
+        return int(self.live.sum()) + len(self.delta)
+
+    # ---- persistence -------------------------------------------------
+
+    @property
+    def _lock_path(self) -> Path:
+        return self.directory / ".build.lock"
+
+    def _built_at_on_disk(self) -> Optional[str]:
+        try:
+            return json.loads((self.directory / "meta.json").read_text()).get("built_at")
+        except FileNotFoundError:
+            return None
+
+    def load(self) -> "LocalVectorIndex":
+        if not (self.directory / "meta.json").exists():
+            with self._lock:
+                self._reset()
+            return self
+        # Shared lock: a build renames several files, never load halfway through.
+        with _file_lock(self._lock_path, exclusive=False):
+            return self._load_files()
+
+    def _load_files(self) -> "LocalVectorIndex":
+        meta_path = self.directory / "meta.json"
+        with self._lock:
+            self._reset()
+            if not meta_path.exists():
+                return self
+            meta = json.loads(meta_path.read_text())
+            self.vectors = np.load(self.directory / "vectors.npy", mmap_mode="r")
+            self.ids = np.load(self.directory / "ids.npy", mmap_mode="r")
+            self.modality_codes = np.load(self.directory / "modality.npy")
+            self.body_part_codes = np.load(self.directory / "body_part.npy")
+            self.live = np.ones(len(self.ids), dtype=bool)
+            self.modalities = meta["modalities"]
+            self.body_parts = meta["body_parts"]
+            self.watermark = datetime.fromisoformat(meta["watermark"]) if meta.get("watermark") else None
+            self.model = meta.get("model")
+            self.built_at = meta.get("built_at")
+        return self
+
+    def build(self, batch_size: int = 10000, blocking: bool = True) -> Optional[Dict[str, Any]]:
+        """Export every row from Postgres into fresh memory-mapped files.
+
+        Returns None without building when ``blocking`` is off and another
+        process is already building.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with _file_lock(self._lock_path, exclusive=True, blocking=blocking) as locked:
+            if not locked:
+                return None
+            tmp = _temp_path(self.directory, "vectors.npy")
+            try:
+                return self._build(tmp, batch_size)
+            finally:
+                tmp.unlink(missing_ok=True)
+
+    def _build(self, tmp: Path, batch_size: int) -> Dict[str, Any]:
+        start = time.time()
+        stmt = text(
+            "SELECT id, modality, body_part, image_embedding, updated_at FROM medical_cases ORDER BY id"
+        ).columns(image_embedding=Vector(EMBEDDING_DIM))
+
+        # One snapshot for the model, the row count and the export.
+        with self.engine.connect().execution_options(isolation_level="REPEATABLE READ") as conn:
+            model = get_live_model(conn)
+            total = conn.execute(text("SELECT count(*) FROM medical_cases")).scalar()
+            vectors = np.lib.format.open_memmap(tmp, mode="w+", dtype=self.dtype, shape=(total, EMBEDDING_DIM))
+            ids = np.zeros(total, dtype=np.int64)
+            modality_codes = np.zeros(total, dtype=np.int16)
+            body_part_codes = np.zeros(total, dtype=np.int16)
+            modalities: Dict[str, int] = {}
+            body_parts: Dict[str, int] = {}
+            watermark = None
+
+            n = 0
+            result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(stmt)
+            for rows in result.partitions():
+                rows = [r for r in rows][: total - n]
+                if not rows:
+                    break
+                block = _normalize_rows(np.stack([np.asarray(r.image_embedding, dtype=np.float32) for r in rows]))
+                vectors[n:n + len(rows)] = block.astype(self.dtype)
+                for i, r in enumerate(rows, start=n):
+                    ids[i] = r.id
+                    modality_codes[i] = modalities.setdefault(r.modality, len(modalities))
+                    body_part_codes[i] = body_parts.setdefault(r.body_part, len(body_parts))
+                    if r.updated_at is not None and (watermark is None or r.updated_at > watermark):
+                        watermark = r.updated_at
+                n += len(rows)
+
+        vectors.flush()
+        del vectors
+        # Rows inserted between count(*) and the scan are picked up by refresh.
+        meta = {
+            "dtype": self.dtype.name,
+            "rows": n,
+            "modalities": list(modalities),
+            "body_parts": list(body_parts),
+            "watermark": watermark.isoformat() if watermark else None,
+            "model": model,
+            "built_at": datetime.now(timezone.utc).isoformat(),
+        }
+        with self._lock:
+            tmp.replace(self.directory / "vectors.npy")
+            arrays = {"ids.npy": ids[:n], "modality.npy": modality_codes[:n], "body_part.npy": body_part_codes[:n]}
+            for name, arr in arrays.items():
+                _replace_atomic(self.directory, name, lambda path, arr=arr: _save_npy(path, arr))
+            # meta.json last: other workers reload when its built_at changes.
+            _replace_atomic(self.directory, "meta.json", lambda path: path.write_text(json.dumps(meta)))
+            self._load_files()
+        return {"rows": n, "seconds": time.time() - start, "directory": str(self.directory)}
+
+    def refresh(self, overlap_seconds: float = 60.0) -> int:
+        """Pull rows updated since the watermark into the delta segment.
+
+        Re-reads ``overlap_seconds`` before the watermark so rows committed
+        late with an earlier ``updated_at`` are not missed; re-reading a row
+        is harmless because rows are keyed by id. A segment another process
+        built since is loaded first; one that was never built, or was built
+        from another model's vectors, is built in full instead, by whichever
+        process gets the build lock (the others skip and reload it later).
+        """
+        if self._built_at_on_disk() != self.built_at:
+            self.load()
+        with self.engine.connect() as conn:
+            live_model = get_live_model(conn)
+        if self.built_at is None or live_model != self.model:
+            built = self.build(blocking=False)
+            return built["rows"] if built else 0
+        since = (self.watermark - timedelta(seconds=overlap_seconds)) if self.watermark else None
+        sql = "SELECT id, modality, body_part, image_embedding, updated_at FROM medical_cases"
+        params = {}
+        if since is not None:
+            sql += " WHERE updated_at > :since"
+            params["since"] = since
+        stmt = text(sql + " ORDER BY updated_at").columns(image_embedding=Vector(EMBEDDING_DIM))
+
+        with self.engine.connect() as conn:
+            rows = conn.execute(stmt, params).all()
+        if not rows:
+            return 0
+
+        with self._lock:
+            for r in rows:
+                vec = np.asarray(r.image_embedding, dtype=np.float32)
+                vec = vec / (np.linalg.norm(vec) or 1.0)
+                pos = np.searchsorted(self.ids, r.id)
+                if pos < len(self.ids) and self.ids[pos] == r.id:
+                    self.live[pos] = False  # superseded by the delta copy
+                self.delta[int(r.id)] = (vec, r.modality, r.body_part)
+                if r.updated_at is not None and (self.watermark is None or r.updated_at > self.watermark):
+                    self.watermark = r.updated_at
+            self._delta_cache = None
+            self._masks.clear()
+        return len(rows)
+
+    # ---- search ------------------------------------------------------
+
+    def _main_mask(self, modality: Optional[str], body_part: Optional[str]) -> np.ndarray:
+        key = (modality or "", body_part or "")
+        mask = self._masks.get(key)
+        if mask is None:
+            mask = self.live.copy()
+            if modality:
+                code = self.modalities.index(modality) if modality in self.modalities else -1
+                mask &= self.modality_codes == code
+            if body_part:
+                code = self.body_parts.index(body_part) if body_part in self.body_parts else -1
+                mask &= self.body_part_codes == code
+            self._masks[key] = mask
+        return mask
+
+    def _delta_arrays(self):
+        if self._delta_cache is None:
+            ids = np.fromiter(self.delta.keys(), dtype=np.int64, count=len(self.delta))
+            vecs = (
+                np.stack([v[0] for v in self.delta.values()])
+                if self.delta
+                else np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+            )
+            mods = np.array([v[1] for v in self.delta.values()], dtype=object)
+            parts = np.array([v[2] for v in self.delta.values()], dtype=object)
+            self._delta_cache = (ids, vecs, mods, parts)
+        return self._delta_cache
+
+    def search(
+        self,
+        query_embedding,
+        k: int = 10,
+        modality: Optional[str] = None,
+        body_part: Optional[str] = None,
+        similarity_threshold: float = 0.0,
+        after: Optional[Tuple[float, int]] = None,
+    ) -> List[Tuple[int, float]]:
+        """Exact top-``k`` ``(id, cosine similarity)`` pairs, best first.
+
+        ``after=(similarity, id)`` returns the page following that row in
+        (similarity desc, id asc) order, the same keyset order as pgvector.
+        """
+        q = np.asarray(query_embedding, dtype=np.float32).reshape(-1)
+        q = q / (np.linalg.norm(q) or 1.0)
+
+        with self._lock:
+            mask = self._main_mask(modality, body_part)
+            d_ids, d_vecs, d_mods, d_parts = self._delta_arrays()
+            vectors, ids = self.vectors, self.ids
+
+        cand_ids, cand_scores = [], []
+        rows = np.flatnonzero(mask)
+        # Filtered subsets are gathered first; unfiltered scans go in chunks.
+        if len(rows) < len(mask):
+            for lo in range(0, len(rows), _SCAN_CHUNK_ROWS):
+                sel = rows[lo:lo + _SCAN_CHUNK_ROWS]
+                scores = vectors[sel].astype(np.float32) @ q
+                chunk_ids = np.asarray(ids[sel])
+                if after is not None:
+                    keep = self._after(scores, chunk_ids, after)
+                    scores, chunk_ids = scores[keep], chunk_ids[keep]
+                top = self._top(scores, k)
+                cand_ids.append(chunk_ids[top])
+                cand_scores.append(scores[top])
+        else:
+            for lo in range(0, len(mask), _SCAN_CHUNK_ROWS):
+                scores = np.asarray(vectors[lo:lo + _SCAN_CHUNK_ROWS], dtype=np.float32) @ q
+                chunk_ids = np.asarray(ids[lo:lo + _SCAN_CHUNK_ROWS])
+                if after is not None:
+                    keep = self._after(scores, chunk_ids, after)
+                    scores, chunk_ids = scores[keep], chunk_ids[keep]
+                top = self._top(scores, k)
+                cand_ids.append(chunk_ids[top])
+                cand_scores.append(scores[top])
+
+        if len(d_ids):
+            keep = np.ones(len(d_ids), dtype=bool)
+            if modality:
+                keep &= d_mods == modality
+            if body_part:
+                keep &= d_parts == body_part
+            scores, chunk_ids = d_vecs[keep] @ q, d_ids[keep]
+            if after is not None:
+                keep = self._after(scores, chunk_ids, after)
+                scores, chunk_ids = scores[keep], chunk_ids[keep]
+            cand_ids.append(chunk_ids)
+            cand_scores.append(scores)
+
+        if not cand_ids:
+            return []
+        all_ids = np.concatenate(cand_ids)
+        all_scores = np.concatenate(cand_scores)
+        if similarity_threshold and similarity_threshold > 0:
+            ok = all_scores >= similarity_threshold
+            all_ids, all_scores = all_ids[ok], all_scores[ok]
+        # Candidates are few (k per chunk); a full sort breaks score ties by id,
+        # which keeps keyset pages stable when identical images are indexed.
+        order = np.lexsort((all_ids, -all_scores))[:k]
+        return [(int(all_ids[i]), float(all_scores[i])) for i in order]
+
+    @staticmethod
+    def _after(scores: np.ndarray, ids: np.ndarray, after: Tuple[float, int]) -> np.ndarray:
+        # Scores are float32 and cursors carry them widened to float, which
+        # compares equal again after the round trip.
+        similarity, last_id = after
+        return (scores < similarity) | ((scores == similarity) & (ids > last_id))
+
+    @staticmethod
+    def _top(scores: np.ndarray, k: int) -> np.ndarray:
+        """Indices of the ``k`` largest scores, sorted descending."""
+        if len(scores) == 0:
+            return np.zeros(0, dtype=np.int64)
+        if len(scores) > k:
+            idx = np.argpartition(-scores, k - 1)[:k]
+        else:
+            idx = np.arange(len(scores))
+        return idx[np.argsort(-scores[idx], kind="stable")]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "directory": str(self.directory),
+                "dtype": self.dtype.name,
+                "main_rows": int(len(self.ids)),
+                "live_rows": self.size,
+                "delta_rows": len(self.delta),
+                "watermark": self.watermark.isoformat() if self.watermark else None,
+                "model": self.model,
+                "built_at": self.built_at,
+            }
+
+
+_local_index: LocalVectorIndex | None = None
+
+
+def get_local_index() -> LocalVectorIndex:
+    global _local_index
+    if _local_index is None:
+        _local_index = LocalVectorIndex(settings.local_index_dir, dtype=settings.local_index_dtype).load()
+    return _local_index
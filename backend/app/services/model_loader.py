@@ -0,0 +1,71 @@
+from pathlib import Path
+from typing import Tuple
+import logging
+import tempfile
+
+import clip
+import torch
+from clip.clip import _transform
+from clip.model import build_model
+
+from ..config import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+def _artifact_path(model_name: str) -> Path:
+    return Path(settings.model_cache_dir) / f"{model_name.replace('/', '-')}.state_dict.pt"
+
+
+def _load_mmap(path: Path):
+    """Build CLIP around a memory-mapped float32 state dict.
+
+    The module is created on the meta device and the mmap'd tensors are then
+    assigned as its parameters, so weights are never copied: every process
+    loading the same file shares its pages through the page cache.
+    """
+    state_dict = torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+    with torch.device("meta"):
+        model = build_model(dict(state_dict))
+    model.load_state_dict(state_dict, assign=True)
+    # The causal mask is a plain attribute, not a buffer, so it was built on meta.
+    mask = model.build_attention_mask()
+    for block in model.transformer.resblocks:
+        block.attn_mask = mask
+    return model.eval()
+
+
+def load_clip(model_name: str, device: str = "cpu") -> Tuple[torch.nn.Module, object]:
+    """``clip.load`` backed by a local, mmap-loadable artifact.
+
+    The first start downloads the checkpoint into ``model_cache_dir`` and saves
+    the prepared float32 state dict next to it; later starts (and every other
+    worker) map that file instead of downloading and deserializing again.
+    """
+    # GPU weights live in device memory (and clip.load makes them fp16), so
+    # mapping the file only helps on CPU.
+    if not settings.model_mmap or device != "cpu":
+        return clip.load(model_name, device=device, download_root=settings.model_cache_dir)
+
+    path = _artifact_path(model_name)
+    if path.exists():
+        try:
+            model = _load_mmap(path)
+            return model, _transform(model.visual.input_resolution)
+        except Exception:
+            logger.exception("could not map %s, falling back to clip.load", path)
+
+    model, preprocess = clip.load(model_name, device="cpu", download_root=settings.model_cache_dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Workers starting together all get here; each writes its own tmp file and
+    # the renames replace one complete artifact with another.
+    f = tempfile.NamedTemporaryFile(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp", delete=False)
+    tmp = Path(f.name)
+    try:
+        with f:
+            torch.save(model.state_dict(), f)
+        tmp.replace(path)
+    finally:
+        tmp.unlink(missing_ok=True)
+    return model, preprocess
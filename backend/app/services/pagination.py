@@ -0,0 +1,46 @@
+"""Opaque keyset cursors for paginated vector search.
+
+A cursor names the last row of a page by its (similarity, id), the keyset the
+next page continues from, plus a fingerprint of the query so it cannot be
+replayed against a different query or filter set.
+"""
+from typing import Optional, Tuple
+import base64
+import hashlib
+import json
+
+
+def query_fingerprint(
+    source: str,
+    modality: Optional[str],
+    body_part: Optional[str],
+    similarity_threshold: float,
+) -> str:
+    """Fingerprint of what was asked (query text or image digest, filters).
+
+    Deliberately not the query vector: a text embedding computed in a batch and
+    one read back from the float16 cache differ in the last bits.
+    """
+    key = f"{source}\x00{modality!r}\x00{body_part!r}\x00{float(similarity_threshold or 0.0)!r}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+def encode_cursor(similarity: float, case_id: int, fingerprint: str) -> str:
+    payload = json.dumps({"s": float(similarity), "i": int(case_id), "f": fingerprint}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, fingerprint: str) -> Tuple[float, int]:
+    """``(similarity, id)`` of the previous page's last row.
+
+    Raises ``ValueError`` for a malformed cursor or one issued for another query.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        similarity, case_id, issued_for = float(payload["s"]), int(payload["i"]), payload["f"]
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError("malformed cursor") from e
+    if issued_for != fingerprint:
+        raise ValueError("cursor belongs to a different query")
+    return similarity, case_id
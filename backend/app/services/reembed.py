@@ -0,0 +1,495 @@
+"""Move medical_cases to another CLIP model without taking search down.
+
+New vectors are written to shadow columns (``image_embedding_next``,
+``text_embedding_next``, ``embedding_model_next``) while searches keep reading
+``image_embedding``/``text_embedding``. Once every row is covered, ``cutover``
+swaps the columns and their ANN indexes in one short transaction. Progress is
+kept in the one-row ``embedding_reindex`` table, so an interrupted run resumes
+where it stopped.
+"""
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+import hashlib
+import re
+import time
+
+from sqlalchemy import text
+
+from ..config import settings
+from ..database import engine as default_engine
+from .bulk_writer import vector_literal
+from .corpus import bump_corpus_version
+from .index_service import EMBEDDING_DIM, IndexManager
+
+
+SHADOW = "_next"
+PREVIOUS = "_prev"
+VECTOR_COLUMNS = ("image_embedding", "text_embedding")
+# Swapped at cutover together with the vectors they describe.
+SWAPPED_COLUMNS = VECTOR_COLUMNS + ("embedding_model",)
+MISSING_IMAGE_POLICIES = ("skip", "text")
+
+# A row still needs encoding when it was never encoded for the target model,
+# or ingestion rewrote it after it was (updated_at moved on).
+PENDING = "(embedding_model_next IS DISTINCT FROM :model OR reembedded_from IS DISTINCT FROM updated_at)"
+
+# pg_try_advisory_lock key: one job per database.
+LOCK_KEY = 0x6D6D7265
+
+NOT_NULL_CHECK = "medical_cases_image_embedding_not_null"
+
+STATE_DDL = """
+CREATE TABLE IF NOT EXISTS embedding_reindex (
+    id integer PRIMARY KEY,
+    target_model varchar(100) NOT NULL,
+    status varchar(20) NOT NULL,
+    pass integer NOT NULL DEFAULT 1,
+    last_id integer NOT NULL DEFAULT 0,
+    rows_embedded bigint NOT NULL DEFAULT 0,
+    rows_failed bigint NOT NULL DEFAULT 0,
+    started_at timestamptz DEFAULT NOW(),
+    updated_at timestamptz DEFAULT NOW(),
+    cutover_at timestamptz,
+    live_model varchar(100)
+)
+"""
+
+_VECTOR_COLUMN_RE = re.compile(r"\b(image_embedding|text_embedding)\b")
+
+
+def case_text(row) -> str:
+    """Text a case's text_embedding is computed from (the loaders use findings)."""
+    return row["findings"] or row["diagnosis"] or ""
+
+
+def shadow_index_ddl(definition: str, name: str) -> str:
+    """``CREATE INDEX CONCURRENTLY`` of an index definition over the shadow columns."""
+    ddl = re.sub(
+        r"^CREATE (UNIQUE )?INDEX \S+ ON ",
+        lambda m: f"CREATE {m.group(1) or ''}INDEX CONCURRENTLY {name} ON ",
+        definition,
+    )
+    return _VECTOR_COLUMN_RE.sub(lambda m: m.group(1) + SHADOW, ddl)
+
+
+class ReembedJob:
+    """Re-encode every case with a new model into the shadow columns, then cut over.
+
+    Writes are throttled (``max_rows_per_second``) and pause while the primary
+    is busy serving other queries, so query latency is not traded for speed.
+    """
+
+    def __init__(self, engine=None, image_roots: Sequence[str] = ()):
+        self.engine = engine if engine is not None else default_engine
+        roots = list(image_roots) or [settings.data_dir, settings.upload_dir]
+        self.image_roots = [Path(r) for r in roots]
+        self.indexes = IndexManager(self.engine)
+
+    # -- state -----------------------------------------------------------
+
+    def state(self) -> Optional[Dict[str, Any]]:
+        with self.engine.connect() as conn:
+            conn.execute(text(STATE_DDL))
+            row = conn.execute(text("SELECT * FROM embedding_reindex WHERE id = 1")).mappings().first()
+            conn.commit()
+        return dict(row) if row is not None else None
+
+    def _columns(self) -> set:
+        with self.engine.connect() as conn:
+            return set(
+                conn.execute(
+                    text("SELECT column_name FROM information_schema.columns WHERE table_name = 'medical_cases'")
+                ).scalars()
+            )
+
+    def _running(self) -> Dict[str, Any]:
+        state = self.state()
+        if state is None or state["status"] != "running":
+            raise RuntimeError("no re-embed in progress; start one with: reembed.py run --model <name>")
+        return state
+
+    def start(self, model: str) -> Dict[str, Any]:
+        """Add the shadow columns and record ``model`` as the target.
+
+        Resumes an unfinished run for the same model; refuses to start a second
+        migration before the previous one is finished and cleaned up.
+        """
+        state = self.state()
+        if state is not None and state["status"] == "running":
+            if state["target_model"] != model:
+                raise RuntimeError(
+                    f"re-embed to {state['target_model']} is in progress; finish it or run: reembed.py abort"
+                )
+            return state
+        columns = self._columns()
+        if any(c + PREVIOUS in columns for c in SWAPPED_COLUMNS):
+            raise RuntimeError("columns from the previous cutover are still there; run: reembed.py cleanup")
+        if self._live_models() == {model}:
+            raise RuntimeError(f"medical_cases is already embedded with {model}")
+
+        with self.engine.begin() as conn:
+            # New nullable columns without a default only touch the catalog, but
+            # still need a brief exclusive lock; do not queue behind long queries.
+            conn.execute(text("SELECT set_config('lock_timeout', '5s', true)"))
+            conn.execute(text("ALTER TABLE medical_cases ADD COLUMN IF NOT EXISTS embedding_model varchar(100)"))
+            for column in VECTOR_COLUMNS:
+                conn.execute(
+                    text(f"ALTER TABLE medical_cases ADD COLUMN IF NOT EXISTS {column}{SHADOW} vector({EMBEDDING_DIM})")
+                )
+            conn.execute(text("ALTER TABLE medical_cases ADD COLUMN IF NOT EXISTS embedding_model_next varchar(100)"))
+            conn.execute(text("ALTER TABLE medical_cases ADD COLUMN IF NOT EXISTS reembedded_from timestamptz"))
+            conn.execute(
+                text(
+                    "INSERT INTO embedding_reindex (id, target_model, status) VALUES (1, :model, 'running') "
+                    "ON CONFLICT (id) DO UPDATE SET target_model = :model, status = 'running', pass = 1, "
+                    "last_id = 0, rows_embedded = 0, rows_failed = 0, started_at = now(), updated_at = now(), "
+                    "cutover_at = NULL"
+                ),
+                {"model": model},
+            )
+        return self.state()
+
+    def _live_models(self) -> set:
+        if "embedding_model" not in self._columns():
+            return {None}
+        with self.engine.connect() as conn:
+            return set(conn.execute(text("SELECT DISTINCT embedding_model FROM medical_cases")).scalars())
+
+    def coverage(self, model: Optional[str] = None) -> Dict[str, Any]:
+        """Rows already encoded with the target model, out of all rows."""
+        model = model or self._running()["target_model"]
+        with self.engine.connect() as conn:
+            total, covered = conn.execute(
+                text(f"SELECT count(*), count(*) FILTER (WHERE NOT {PENDING}) FROM medical_cases"),
+                {"model": model},
+            ).one()
+        return {"total": int(total), "covered": int(covered), "percent": 100.0 * covered / total if total else 100.0}
+
+    # -- backfill --------------------------------------------------------
+
+    def run(
+        self,
+        svc,
+        batch_size: Optional[int] = None,
+        max_rows_per_second: Optional[float] = None,
+        max_active_queries: Optional[int] = None,
+        missing_image: str = "skip",
+        progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+    ) -> Dict[str, Any]:
+        """Encode every pending row with ``svc`` in throttled batches.
+
+        Walks the table in id order from the saved position; when a pass ends
+        with rows still pending (written or changed behind it), another pass
+        starts from the beginning. Rows that fail (missing or undecodable
+        image) are skipped for the rest of this run and counted.
+        """
+        if missing_image not in MISSING_IMAGE_POLICIES:
+            raise ValueError(f"missing_image must be one of {MISSING_IMAGE_POLICIES}")
+        state = self._running()
+        model = state["target_model"]
+        if svc.model_name != model:
+            raise ValueError(f"job targets {model} but the embedding service runs {svc.model_name}")
+        dim = svc.encode_text(["dimension check"]).shape[-1]
+        if dim != EMBEDDING_DIM:
+            raise ValueError(f"{model} produces {dim}-d vectors; medical_cases stores vector({EMBEDDING_DIM})")
+
+        batch_size = batch_size or settings.reembed_batch_size
+        if max_rows_per_second is None:
+            max_rows_per_second = settings.reembed_max_rows_per_second
+        if max_active_queries is None:
+            max_active_queries = settings.reembed_max_active_queries
+
+        with self.engine.connect() as lock_conn:
+            if not lock_conn.execute(text("SELECT pg_try_advisory_lock(:k)"), {"k": LOCK_KEY}).scalar():
+                raise RuntimeError("another re-embed job is running against this database")
+            try:
+                return self._run(
+                    svc, model, state, batch_size, max_rows_per_second, max_active_queries, missing_image, progress
+                )
+            finally:
+                lock_conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": LOCK_KEY})
+                lock_conn.commit()
+
+    def _run(self, svc, model, state, batch_size, max_rows_per_second, max_active_queries, missing_image, progress):
+        pass_no, last_id = state["pass"], state["last_id"]
+        failed: Dict[int, str] = {}
+        embedded = paused = 0.0
+        started = time.perf_counter()
+        with self.engine.connect() as conn:
+            max_id = conn.execute(text("SELECT coalesce(max(id), 0) FROM medical_cases")).scalar()
+
+        while True:
+            paused += self._wait_until_quiet(max_active_queries)
+            t0 = time.perf_counter()
+            rows = self._pending_rows(model, last_id, batch_size)
+            if not rows:
+                if not self._pending_count(model, list(failed)):
+                    break
+                pass_no, last_id = pass_no + 1, 0
+                self._save_progress(last_id, pass_no, 0, 0)
+                continue
+
+            updates, errors = self._encode(svc, rows, missing_image)
+            self._write(model, updates)
+            failed.update(errors)
+            last_id = rows[-1]["id"]
+            self._save_progress(last_id, pass_no, len(updates), len(errors))
+            embedded += len(updates)
+
+            if progress is not None:
+                elapsed = time.perf_counter() - started
+                progress(
+                    {
+                        "pass": pass_no,
+                        "last_id": last_id,
+                        "max_id": max_id,
+                        "embedded": int(embedded),
+                        "failed": len(failed),
+                        "errors": errors,
+                        "rows_per_second": embedded / elapsed if elapsed else 0.0,
+                        "paused_seconds": paused,
+                    }
+                )
+            # Rate cap: a batch may not finish faster than its share of the budget.
+            if max_rows_per_second and max_rows_per_second > 0:
+                time.sleep(max(0.0, len(rows) / max_rows_per_second - (time.perf_counter() - t0)))
+
+        coverage = self.coverage(model)
+        return {
+            **coverage,
+            "embedded": int(embedded),
+            "failed": failed,
+            "passes": pass_no,
+            "seconds": time.perf_counter() - started,
+        }
+
+    def _wait_until_quiet(self, max_active_queries: int) -> float:
+        """Sleep while more than ``max_active_queries`` other queries are running."""
+        if not max_active_queries or max_active_queries <= 0:
+            return 0.0
+        start = time.perf_counter()
+        with self.engine.connect() as conn:
+            while True:
+                active = conn.execute(
+                    text(
+                        "SELECT count(*) FROM pg_stat_activity WHERE datname = current_database() "
+                        "AND state = 'active' AND backend_type = 'client backend' AND pid <> pg_backend_pid()"
+                    )
+                ).scalar()
+                conn.rollback()
+                if active <= max_active_queries:
+                    return time.perf_counter() - start
+                time.sleep(1.0)
+
+    def _pending_rows(self, model: str, after_id: int, limit: int) -> List[Dict[str, Any]]:
+        sql = (
+            "SELECT id, image_path, image_sha256, diagnosis, findings, "
+            "text_embedding IS NOT NULL AS has_text, updated_at "
+            f"FROM medical_cases WHERE id > :after AND {PENDING} ORDER BY id LIMIT :n"
+        )
+        with self.engine.connect() as conn:
+            rows = conn.execute(text(sql), {"after": after_id, "model": model, "n": limit}).mappings().all()
+        return [dict(r) for r in rows]
+
+    def _pending_count(self, model: str, exclude: List[int]) -> int:
+        with self.engine.connect() as conn:
+            return int(
+                conn.execute(
+                    text(f"SELECT count(*) FROM medical_cases WHERE {PENDING} AND NOT (id = ANY(:exclude))"),
+                    {"model": model, "exclude": exclude},
+                ).scalar()
+            )
+
+    def _image_bytes(self, row) -> Tuple[Optional[bytes], Optional[str]]:
+        """The case's original image, or why it cannot be used."""
+        if not row["image_path"]:
+            return None, "no image_path"
+        path = Path(row["image_path"])
+        candidates = [path] if path.is_absolute() else [root / path for root in self.image_roots]
+        found = next((p for p in candidates if p.is_file()), None)
+        if found is None:
+            return None, f"image not found: {row['image_path']}"
+        raw = found.read_bytes()
+        # A different file under the same name would silently change the case.
+        if row["image_sha256"] and hashlib.sha256(raw).hexdigest() != row["image_sha256"]:
+            return None, f"image changed on disk: {found}"
+        return raw, None
+
+    def _encode(self, svc, rows, missing_image: str):
+        """``(updates, errors)``: shadow values per encodable row, reason per failed id."""
+        from .embedding_service import decode_corpus_image  # torch; only the run command needs it
+
+        errors: Dict[int, str] = {}
+        images: Dict[int, Any] = {}
+        for row in rows:
+            raw, reason = self._image_bytes(row)
+            if raw is not None:
+                try:
+                    images[row["id"]] = decode_corpus_image(raw)
+                except (ValueError, OSError) as e:
+                    reason = f"image not decodable: {e}"
+            if reason is not None and missing_image != "text":
+                errors[row["id"]] = reason
+
+        # The text vector doubles as the image vector under missing_image="text",
+        # the same fallback the sample loader uses.
+        need_text = [r for r in rows if r["id"] not in errors and (r["has_text"] or r["id"] not in images)]
+        texts = list(dict.fromkeys(case_text(r) for r in need_text))
+        text_vecs = dict(zip(texts, svc.encode_text(texts))) if texts else {}
+        image_ids = list(images)
+        image_vecs = dict(zip(image_ids, svc.encode_image([images[i] for i in image_ids]))) if image_ids else {}
+
+        updates = []
+        for row in rows:
+            if row["id"] in errors:
+                continue
+            text_vec = text_vecs.get(case_text(row))
+            image_vec = image_vecs.get(row["id"], text_vec)
+            updates.append(
+                {
+                    "id": row["id"],
+                    "seen": row["updated_at"],
+                    "image": vector_literal(image_vec),
+                    "text": vector_literal(text_vec) if row["has_text"] else None,
+                }
+            )
+        return updates, errors
+
+    def _write(self, model: str, updates: List[Dict[str, Any]]) -> None:
+        if not updates:
+            return
+        # Rows ingestion touched since they were read keep their new updated_at,
+        # miss the WHERE and stay pending for the next pass.
+        sql = (
+            f"UPDATE medical_cases SET image_embedding{SHADOW} = CAST(:image AS vector({EMBEDDING_DIM})), "
+            f"text_embedding{SHADOW} = CAST(:text AS vector({EMBEDDING_DIM})), "
+            "embedding_model_next = :model, reembedded_from = updated_at "
+            "WHERE id = :id AND updated_at IS NOT DISTINCT FROM :seen"
+        )
+        with self.engine.begin() as conn:
+            conn.execute(text(sql), [{**u, "model": model} for u in updates])
+
+    def _save_progress(self, last_id: int, pass_no: int, embedded: int, failed: int) -> None:
+        with self.engine.begin() as conn:
+            conn.execute(
+                text(
+                    "UPDATE embedding_reindex SET last_id = :last_id, pass = :pass, "
+                    "rows_embedded = rows_embedded + :embedded, rows_failed = rows_failed + :failed, "
+                    "updated_at = now() WHERE id = 1"
+                ),
+                {"last_id": last_id, "pass": pass_no, "embedded": embedded, "failed": failed},
+            )
+
+    # -- cutover ---------------------------------------------------------
+
+    def _vector_indexes(self) -> List[Dict[str, Any]]:
+        """ANN indexes over the live vector columns (not shadow or previous copies)."""
+        return [
+            idx
+            for idx in self.indexes.list_indexes()
+            if _VECTOR_COLUMN_RE.search(idx["definition"]) and not idx["name"].endswith((SHADOW, PREVIOUS))
+        ]
+
+    def build_shadow_indexes(self, progress: Optional[Callable[[Dict[str, Any]], None]] = None) -> List[Dict[str, Any]]:
+        """Build a copy of every ANN index over the shadow columns, concurrently.
+
+        Built after the backfill, so the backfill's updates do not pay for index
+        maintenance. Indexes already built by an earlier attempt are kept.
+        """
+        built = []
+        for idx in self._vector_indexes():
+            name = idx["name"] + SHADOW
+            if len(name) > 63:
+                raise ValueError(f"shadow index name {name} exceeds PostgreSQL's 63 characters")
+            if self.indexes.is_valid(name):
+                continue
+            self.indexes.drop(name)
+            built.append(self.indexes.build(name, ddl=shadow_index_ddl(idx["definition"], name), progress=progress))
+        return built
+
+    def cutover(self, lock_timeout_ms: int = 5000, progress=None) -> Dict[str, Any]:
+        """Swap the shadow columns in once every row is covered.
+
+        Writes to medical_cases wait while the coverage is re-checked; searches
+        only wait for the catalog renames. The new model is recorded as
+        ``live_model``: API processes still encoding queries with another model
+        answer 503 until restarted with it. The previous columns stay
+        (nullable) until ``cleanup``.
+        """
+        state = self._running()
+        model = state["target_model"]
+        coverage = self.coverage(model)
+        if coverage["covered"] < coverage["total"]:
+            raise RuntimeError(
+                f"{coverage['total'] - coverage['covered']} rows are not re-embedded yet; run the job again"
+            )
+        self.build_shadow_indexes(progress)
+        swapped = [idx["name"] for idx in self._vector_indexes() if self.indexes.is_valid(idx["name"] + SHADOW)]
+
+        with self.engine.begin() as conn:
+            conn.execute(text("SELECT set_config('lock_timeout', :v, true)"), {"v": f"{int(lock_timeout_ms)}ms"})
+            # SHARE blocks writers but not searches while the last check runs.
+            conn.execute(text("LOCK TABLE medical_cases IN SHARE MODE"))
+            pending = conn.execute(text(f"SELECT count(*) FROM medical_cases WHERE {PENDING}"), {"model": model}).scalar()
+            if pending:
+                raise RuntimeError(f"{pending} rows were written since the backfill; run the job again")
+            for column in SWAPPED_COLUMNS:
+                conn.execute(text(f"ALTER TABLE medical_cases RENAME COLUMN {column} TO {column}{PREVIOUS}"))
+                conn.execute(text(f"ALTER TABLE medical_cases RENAME COLUMN {column}{SHADOW} TO {column}"))
+            for name in swapped:
+                conn.execute(text(f"ALTER INDEX {name} RENAME TO {name}{PREVIOUS}"))
+                conn.execute(text(f"ALTER INDEX {name}{SHADOW} RENAME TO {name}"))
+            # New rows no longer fill the previous column; the live one gets its
+            # NOT NULL back below without holding this lock for a full scan.
+            conn.execute(text(f"ALTER TABLE medical_cases ALTER COLUMN image_embedding{PREVIOUS} DROP NOT NULL"))
+            conn.execute(
+                text(
+                    f"ALTER TABLE medical_cases ADD CONSTRAINT {NOT_NULL_CHECK} "
+                    "CHECK (image_embedding IS NOT NULL) NOT VALID"
+                )
+            )
+            conn.execute(
+                text(
+                    "UPDATE embedding_reindex SET status = 'done', live_model = target_model, "
+                    "cutover_at = now(), updated_at = now() WHERE id = 1"
+                )
+            )
+            # Same transaction: API processes see the new version and the new
+            # live model together, and refuse searches until their query
+            # encoder matches it; results cached before the swap stop hitting.
+            bump_corpus_version(conn, commit=False)
+
+        with self.engine.execution_options(isolation_level="AUTOCOMMIT").connect() as conn:
+            # VALIDATE only blocks other DDL; SET NOT NULL then reuses the valid
+            # check instead of scanning (PostgreSQL 12+).
+            conn.execute(text(f"ALTER TABLE medical_cases VALIDATE CONSTRAINT {NOT_NULL_CHECK}"))
+            conn.execute(text("ALTER TABLE medical_cases ALTER COLUMN image_embedding SET NOT NULL"))
+            conn.execute(text(f"ALTER TABLE medical_cases DROP CONSTRAINT {NOT_NULL_CHECK}"))
+        return {"model": model, "rows": coverage["total"], "indexes": swapped}
+
+    def abort(self) -> None:
+        """Drop the shadow columns and indexes; searches are not affected."""
+        for idx in self.indexes.list_indexes():
+            if idx["name"].endswith(SHADOW):
+                self.indexes.drop(idx["name"])
+        with self.engine.begin() as conn:
+            conn.execute(text("SELECT set_config('lock_timeout', '5s', true)"))
+            for column in SWAPPED_COLUMNS:
+                conn.execute(text(f"ALTER TABLE medical_cases DROP COLUMN IF EXISTS {column}{SHADOW}"))
+            conn.execute(text("ALTER TABLE medical_cases DROP COLUMN IF EXISTS reembedded_from"))
+            conn.execute(text(STATE_DDL))
+            conn.execute(text("UPDATE embedding_reindex SET status = 'aborted', updated_at = now() WHERE id = 1"))
+
+    def cleanup(self) -> None:
+        """Drop the columns and indexes the last cutover replaced."""
+        state = self.state()
+        if state is not None and state["status"] == "running":
+            raise RuntimeError("a re-embed is in progress; cleanup only runs after cutover")
+        for idx in self.indexes.list_indexes():
+            if idx["name"].endswith(PREVIOUS):
+                self.indexes.drop(idx["name"])
+        with self.engine.begin() as conn:
+            conn.execute(text("SELECT set_config('lock_timeout', '5s', true)"))
+            for column in SWAPPED_COLUMNS:
+                conn.execute(text(f"ALTER TABLE medical_cases DROP COLUMN IF EXISTS {column}{PREVIOUS}"))
+            conn.execute(text("ALTER TABLE medical_cases DROP COLUMN IF EXISTS reembedded_from"))
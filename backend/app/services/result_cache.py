@@ -0,0 +1,154 @@
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Sequence
+import asyncio
+import hashlib
+import threading
+import time
+
+import numpy as np
+
+from ..config import settings
+from .corpus import get_corpus_version, get_live_model
+
+
+def search_cache_key(query_embedding: Sequence[float], **params: Any) -> str:
+    """Key on the query vector's float32 bytes plus every parameter that shapes the result."""
+    h = hashlib.sha1(np.asarray(query_embedding, dtype=np.float32).tobytes())
+    for name in sorted(params):
+        h.update(f"\x00{name}={params[name]!r}".encode("utf-8"))
+    return h.hexdigest()
+
+
+class SearchResultCache:
+    """LRU of pre-serialized search responses tagged with the corpus version.
+
+    An entry only hits when it was stored under the current corpus version,
+    so a loader bumping the version invalidates everything at once without
+    having to enumerate keys.
+    """
+
+    def __init__(self, max_entries: int = 5000, max_bytes: int = 64 * 1024 * 1024, ttl_seconds: float = 600):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        # key -> (corpus version, expiry time, JSON body), oldest first
+        self._data: OrderedDict = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _remove(self, key: str) -> None:
+        _, _, body = self._data.pop(key)
+        self._bytes -= len(body)
+
+    def get(self, key: str, version: int) -> Optional[bytes]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                entry_version, expires_at, body = entry
+                if entry_version == version and expires_at >= time.time():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return body
+                self._remove(key)
+                self.invalidations += 1
+            self.misses += 1
+            return None
+
+    def put(self, key: str, version: int, body: bytes) -> None:
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (version, time.time() + self.ttl_seconds, body)
+            self._bytes += len(body)
+            while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+class _TrackedVersion:
+    def __init__(self):
+        self.version = 0
+        self.live_model: Optional[str] = None
+        self.model_version: Optional[int] = None
+        self.checked_at = float("-inf")
+
+
+class CorpusVersionTracker:
+    """Reads corpus_version at most once per ``check_seconds`` per process
+    and database.
+
+    Keeps a result-cache hit free of database round trips; writes become
+    visible to cached searches within ``check_seconds``. The model behind the
+    stored vectors (``live_model``) is re-read whenever the version moves,
+    which a reembed cutover does in the same transaction as the swap.
+
+    Versions are tracked per engine, i.e. per replica, and read through the
+    connection the search then runs on. A replica's version therefore never
+    runs ahead of the data it serves, and a result from a lagging replica is
+    cached under that replica's older version rather than a newer one it
+    would never be invalidated from.
+    """
+
+    def __init__(self, check_seconds: float = 1.0):
+        self.check_seconds = check_seconds
+        self._tracked: Dict[Any, _TrackedVersion] = {}
+        self._lock = asyncio.Lock()
+
+    async def current(self, db) -> tuple:
+        """``(corpus version, live model)`` as seen by ``db``'s database."""
+        tracked = self._tracked.get(db.engine)
+        if tracked is None:
+            tracked = self._tracked.setdefault(db.engine, _TrackedVersion())
+        if time.monotonic() - tracked.checked_at < self.check_seconds:
+            return tracked.version, tracked.live_model
+        async with self._lock:
+            if time.monotonic() - tracked.checked_at >= self.check_seconds:
+                tracked.version = await db.run_sync(get_corpus_version)
+                if tracked.model_version != tracked.version:
+                    tracked.live_model = await db.run_sync(get_live_model)
+                    tracked.model_version = tracked.version
+                tracked.checked_at = time.monotonic()
+        return tracked.version, tracked.live_model
+
+
+_result_cache: SearchResultCache | None = None
+_version_tracker: CorpusVersionTracker | None = None
+
+
+def get_result_cache() -> SearchResultCache | None:
+    global _result_cache
+    if not settings.result_cache_enabled:
+        return None
+    if _result_cache is None:
+        _result_cache = SearchResultCache(
+            max_entries=settings.result_cache_max_entries,
+            max_bytes=settings.result_cache_max_bytes,
+            ttl_seconds=settings.result_cache_ttl_seconds,
+        )
+    return _result_cache
+
+
+def get_version_tracker() -> CorpusVersionTracker:
+    global _version_tracker
+    if _version_tracker is None:
+        _version_tracker = CorpusVersionTracker(check_seconds=settings.corpus_version_check_seconds)
+    return _version_tracker
@@ -1,56 +1,704 @@
-from typing import List, Optional, Any, Dict
+from typing import List, Optional, Any, Dict, Tuple
+import hashlib
+import json
+import re
+import threading
 import time
-from sqlalchemy import text
+from sqlalchemy import text, bindparam
+from sqlalchemy.engine import Connection
+from pgvector.sqlalchemy import Vector
+
+from ..config import settings
+from ..schemas.case import MedicalCaseResponse
+from .local_index import get_local_index
+from .index_service import quantized_order_by
+from .bulk_writer import vector_literal
+
+
+EMBEDDING_DIM = 512
+
+# Postgres types for the named parameters used in search SQL; needed to PREPARE.
+_PARAM_TYPES = {
+    "q": "vector",
+    "limit": "integer",
+    "modality": "text",
+    "body_part": "text",
+    "k": "integer",
+    "qtext": "text",
+    "ids": "integer[]",
+    "fetch": "integer",
+    "max_dist": "double precision",
+    "overfetch": "integer",
+    "qvecs": "text[]",
+    "qmods": "text[]",
+    "qparts": "text[]",
+    "qlimits": "integer[]",
+    "qmaxdists": "double precision[]",
+    "after_dist": "double precision",
+    "after_sim": "double precision",
+    "after_id": "integer",
+}
+
+# Keyset pages skip rows closer than the previous page's last distance inside
+# the CTE. The bound is loosened by this much so float rounding in 1 - s can
+# never drop a row; the exact (similarity, id) comparison happens outside.
+KEYSET_SLACK = 1e-6
+
+# Must match idx_medical_cases_fts in scripts/setup_database.sql exactly, or
+# the planner cannot use the GIN index.
+FTS_DOCUMENT = "to_tsvector('english', coalesce(diagnosis, '') || ' ' || coalesce(findings, ''))"
+
+HYBRID_SOURCES = ("image", "text", "keyword")
+
+
+def fuse_rankings(
+    rankings: Dict[str, List[Tuple[int, float]]],
+    method: str = "rrf",
+    weights: Optional[Dict[str, float]] = None,
+    rrf_k: int = 60,
+) -> List[Tuple[int, float]]:
+    """Merge per-source ``(id, score)`` lists, each best-first, into one ranking.
+
+    ``rrf`` sums ``w / (rrf_k + rank)`` and ignores raw scores, so sources
+    with incomparable scales (cosine vs. ts_rank) mix safely. ``weighted``
+    min-max normalises each source's scores and sums ``w * score``.
+    """
+    weights = weights or {}
+    fused: Dict[int, float] = {}
+    for source, ranked in rankings.items():
+        w = weights.get(source, 1.0)
+        if not ranked or w == 0:
+            continue
+        if method == "rrf":
+            for rank, (case_id, _) in enumerate(ranked, start=1):
+                fused[case_id] = fused.get(case_id, 0.0) + w / (rrf_k + rank)
+        elif method == "weighted":
+            scores = [score for _, score in ranked]
+            lo, hi = min(scores), max(scores)
+            span = (hi - lo) or 1.0
+            for case_id, score in ranked:
+                norm = (score - lo) / span if hi > lo else 1.0
+                fused[case_id] = fused.get(case_id, 0.0) + w * norm
+        else:
+            raise ValueError(f"Unknown fusion method: {method}")
+    return sorted(fused.items(), key=lambda kv: kv[1], reverse=True)
+
+def _hybrid_scores(results: List[Dict[str, Any]], image_ranked: List[Tuple[int, float]]) -> List[Dict[str, Any]]:
+    """Move the fused score to ``fusion_score``; ``similarity_score`` becomes the
+    image-source cosine, as in vector mode (None if that source missed the case)."""
+    cosine = dict(image_ranked)
+    for r in results:
+        r["fusion_score"] = r["similarity_score"]
+        r["similarity_score"] = cosine.get(r["id"])
+    return results
+
+
+# Large text/JSON fields a results grid does not display.
+DETAIL_FIELDS = ("clinical_notes", "metadata")
+# Response fields computed per search, not stored in medical_cases.
+NON_COLUMN_FIELDS = ("similarity_score", "fusion_score")
+
+
+def result_columns(include_details: bool = True) -> List[str]:
+    """Columns to SELECT for search results, taken from MedicalCaseResponse.
+
+    Never includes the embedding columns: two 512-float vectors per row sent
+    as text and parsed by the driver would otherwise dominate each search.
+    """
+    columns = [f for f in MedicalCaseResponse.model_fields if f not in NON_COLUMN_FIELDS]
+    if not include_details:
+        columns = [c for c in columns if c not in DETAIL_FIELDS]
+    return columns
+
+
+_PARAM_RE = re.compile(r"(?<!:):(\w+)")
+
+
+def _quote_literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+class FilterStats:
+    """Per-process snapshot of row counts per (modality, body_part) and of the
+    modalities that have a partial ANN index, refreshed every ``ttl`` seconds.
+    Drives the exact-vs-ANN choice for filtered searches.
+    """
+
+    _PARTIAL_RE = re.compile(r"\(?modality\)?::text = '((?:[^']|'')*)'::text")
+
+    def __init__(self, ttl: float = 300.0, quantization: str = "none"):
+        self.ttl = ttl
+        self.quantization = quantization
+        self.counts: Dict[Tuple[str, str], int] = {}
+        self.partial_modalities: set = set()
+        self._loaded_at = float("-inf")
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded_at > float("-inf")
+
+    def get(self, db) -> "FilterStats":
+        """Refresh if stale, unless another caller already is: then serve the old
+        snapshot (check ``loaded``). ``get`` runs inside ``run_sync``, i.e. in a
+        greenlet on the event-loop thread, so blocking on a lock held by a
+        parked greenlet would deadlock the loop."""
+        if time.monotonic() - self._loaded_at >= self.ttl and self._lock.acquire(blocking=False):
+            try:
+                if time.monotonic() - self._loaded_at >= self.ttl:
+                    self._load(db)
+            finally:
+                self._lock.release()
+        return self
+
+    def _load(self, db) -> None:
+        # Index-only scan on idx_medical_cases_modality_body_part
+        rows = db.execute(
+            text("SELECT modality, body_part, count(*) FROM medical_cases GROUP BY modality, body_part")
+        ).all()
+        defs = db.execute(
+            text(
+                "SELECT indexdef FROM pg_indexes WHERE tablename = 'medical_cases' "
+                "AND indexdef LIKE '%image_embedding%' AND indexdef LIKE '%WHERE%'"
+            )
+        ).scalars().all()
+        self.counts = {(m, b): int(n) for m, b, n in rows}
+        # Only partial indexes over the expression searches order by are usable.
+        marker = {"halfvec": "halfvec", "binary": "binary_quantize"}.get(self.quantization)
+        defs = [d for d in defs if (marker in d if marker else "halfvec" not in d and "binary_quantize" not in d)]
+        self.partial_modalities = {
+            m.group(1).replace("''", "'") for d in defs for m in [self._PARTIAL_RE.search(d)] if m
+        }
+        self._loaded_at = time.monotonic()
+
+    def matching_rows(self, modality: Optional[str], body_part: Optional[str]) -> int:
+        return sum(
+            n
+            for (m, b), n in self.counts.items()
+            if (not modality or m == modality) and (not body_part or b == body_part)
+        )
+
+
+_filter_stats = FilterStats(ttl=settings.filter_stats_ttl_seconds, quantization=settings.embedding_quantization)
+
+
+def hybrid_candidate_count(limit: int) -> int:
+    # Over-fetch a little from each source so fusion has overlap to work with.
+    return min(max(limit * settings.hybrid_overfetch, 20), 200)
 
 
 class SearchService:
     def __init__(self, db):
+        # An ORM Session, or a plain Connection on the lightweight read path.
         self.db = db
 
-    def vector_search(
-        self,
-        query_embedding: List[float],
-        limit: int = 10,
-        modality: Optional[str] = None,
-        body_part: Optional[str] = None,
-        similarity_threshold: float = 0.0,
-    ) -> Dict[str, Any]:
-        start = time.time()
+    def _bind(self, sql: str):
+        stmt = text(sql)
+        if re.search(r"(?<!:):q\b", sql):
+            stmt = stmt.bindparams(bindparam("q", type_=Vector(EMBEDDING_DIM)))
+        return stmt
 
-        # Convert list to pgvector format string
-        query_vector_str = '[' + ','.join(map(str, query_embedding)) + ']'
+    def _execute(self, sql: str, params: Dict[str, Any]):
+        """Execute ``sql`` as a named server-side prepared statement.
 
-        # Build SQL dynamically to allow optional filters
-        filters = []
-        params = {"limit": limit}
+        psycopg2 interpolates parameters client-side, so without PREPARE every
+        search is planned from scratch. The statement name is derived from the
+        SQL text, and prepared names are tracked on the pooled DBAPI connection
+        so each connection prepares a given statement only once. Other drivers
+        (asyncpg) already prepare and cache statements themselves.
+        """
+        conn = self.db if isinstance(self.db, Connection) else self.db.connection()
+        if conn.dialect.driver != "psycopg2":
+            return self.db.execute(self._bind(sql), params)
+
+        order = list(dict.fromkeys(_PARAM_RE.findall(sql)))
+        name = "mm_" + hashlib.sha1(sql.encode()).hexdigest()[:16]
+        prepared = conn.info.setdefault("prepared_statements", set())
+        if name not in prepared:
+            positional = _PARAM_RE.sub(lambda m: "$%d" % (order.index(m.group(1)) + 1), sql)
+            arg_types = ", ".join(_PARAM_TYPES[p] for p in order)
+            self.db.execute(text(f"PREPARE {name} ({arg_types}) AS {positional}"))
+            prepared.add(name)
+
+        # Explicit casts so arrays of only NULLs still match the declared types.
+        args = ", ".join(f"CAST(:{p} AS {_PARAM_TYPES[p]})" for p in order)
+        return self.db.execute(self._bind(f"EXECUTE {name}({args})"), params)
+
+    def _apply_index_params(self, ef_search: Optional[int], probes: Optional[int]) -> None:
+        # set_config(..., true) is the parameterisable form of SET LOCAL, so the
+        # settings only last for the current transaction (i.e. this request).
+        ef_search = ef_search or settings.hnsw_ef_search
+        probes = probes or settings.ivfflat_probes
+        if ef_search:
+            self.db.execute(text("SELECT set_config('hnsw.ef_search', :v, true)"), {"v": str(int(ef_search))})
+        if probes:
+            self.db.execute(text("SELECT set_config('ivfflat.probes', :v, true)"), {"v": str(int(probes))})
+        # Iterative index scans (pgvector >= 0.8) keep pulling candidates from
+        # the index until enough rows pass the WHERE filters, instead of
+        # returning whatever survives the first ef_search/probes candidates.
+        if settings.iterative_scan:
+            # ivfflat has no strict_order mode; relaxed_order is its only "on".
+            modes = {"hnsw.iterative_scan": settings.iterative_scan, "ivfflat.iterative_scan": "relaxed_order"}
+            for guc, value in modes.items():
+                self.db.execute(text("SELECT set_config(:g, :v, true)"), {"g": guc, "v": value})
+            if settings.hnsw_max_scan_tuples:
+                self.db.execute(
+                    text("SELECT set_config('hnsw.max_scan_tuples', :v, true)"),
+                    {"v": str(int(settings.hnsw_max_scan_tuples))},
+                )
 
-        if modality:
+    def _filters(
+        self,
+        params: Dict[str, Any],
+        modality: Optional[str],
+        body_part: Optional[str],
+        inline_modality: bool = False,
+    ) -> List[str]:
+        filters = []
+        if modality and inline_modality:
+            # A partial index is only considered when the planner can prove its
+            # predicate (modality = 'ct') from the query, which a bind parameter
+            # of a prepared statement does not allow; so inline the literal.
+            filters.append(f"modality = {_quote_literal(modality)}")
+        elif modality:
             filters.append("modality = :modality")
             params["modality"] = modality
         if body_part:
             filters.append("body_part = :body_part")
             params["body_part"] = body_part
+        return filters
+
+    def plan_filtered_search(self, modality: Optional[str], body_part: Optional[str]) -> str:
+        """Pick how to run a (possibly filtered) vector search.
+
+        ``exact``: the filters match few rows, so fetch them by B-tree and sort
+        by exact distance; always complete and cheaper than an ANN scan that
+        has to skip most of the graph. ``ann_partial``: a partial HNSW index
+        covers this modality. ``ann``: the full index with iterative scans.
+        """
+        if not modality and not body_part:
+            return "ann"
+        stats = _filter_stats.get(self.db)
+        if not stats.loaded:
+            return "ann"  # first load still running elsewhere; iterative scans stay complete
+        if stats.matching_rows(modality, body_part) <= settings.exact_search_max_rows:
+            return "exact"
+        if modality and modality in stats.partial_modalities:
+            return "ann_partial"
+        return "ann"
+
+    def _build_vector_query(
+        self,
+        query_embedding: List[float],
+        limit: int,
+        modality: Optional[str],
+        body_part: Optional[str],
+        similarity_threshold: float = 0.0,
+        strategy: str = "ann",
+        quantization: Optional[str] = None,
+        rerank_factor: Optional[int] = None,
+        include_details: bool = True,
+        after: Optional[Tuple[float, int]] = None,
+    ):
+        # Build SQL dynamically to allow optional filters
+        params = {"q": query_embedding, "limit": limit}
+        filters = self._filters(params, modality, body_part, inline_modality=strategy == "ann_partial")
 
         where_clause = ""
         if filters:
             where_clause = "WHERE " + " AND ".join(filters)
 
-        # Use pgvector operator <=> which returns cosine distance; similarity = 1 - distance
+        # similarity >= threshold  <=>  cosine distance <= 1 - threshold. The
+        # bound is applied outside the MATERIALIZED CTE: inside it would turn
+        # the ordered index scan into a scan-until-exhausted filter. Since the
+        # CTE is already in distance order, nothing past the bound is lost.
+        outer_filters = []
+        if similarity_threshold and similarity_threshold > 0:
+            outer_filters.append("distance <= :max_dist")
+            params["max_dist"] = 1.0 - float(similarity_threshold)
+
+        # Keyset pagination: continue after the row the previous page ended on,
+        # in (distance, id) order. The comparison uses the same 1 - distance
+        # expression that page returned as similarity_score, so it is exact.
+        # Inside the CTE only the (loosened) lower distance bound applies; the
+        # index scan still walks past earlier pages, which needs iterative
+        # scans for deep pages, but no earlier row leaves Postgres.
+        keyset_filter = ""
+        if after is not None:
+            params["after_sim"], params["after_id"] = float(after[0]), int(after[1])
+            params["after_dist"] = 1.0 - params["after_sim"] - KEYSET_SLACK
+            keyset_filter = "image_embedding <=> :q >= :after_dist"
+            outer_filters.append("(1 - distance < :after_sim OR (1 - distance = :after_sim AND id > :after_id))")
+        distance_filter = "WHERE " + " AND ".join(outer_filters) if outer_filters else ""
+
+        # Relaxed iterative scans can return rows slightly out of order, so
+        # over-fetch a little and re-sort outside the CTE. With a quantized
+        # index the CTE orders by the approximate distance while computing the
+        # exact one, and the outer ORDER BY distance is the float32 rerank.
+        quantization = quantization or settings.embedding_quantization
+        if strategy == "exact":
+            quantization = "none"
+        overfetch = settings.vector_overfetch
+        if quantization != "none":
+            overfetch = max(overfetch, rerank_factor or settings.quantized_rerank_factor)
+        params["fetch"] = limit * max(1, overfetch)
+
+        # pgvector's <=> is cosine distance; similarity = 1 - distance. Ordering
+        # by the bare distance expression (ascending) is what lets the planner
+        # use the HNSW/ivfflat index instead of sorting the whole table.
+        columns = ", ".join(result_columns(include_details))
+        source = "medical_cases"
+        subset = ""
+        if strategy == "exact":
+            # Materialising the filtered rows first keeps the planner from
+            # choosing the ANN index, so the distance sort is exact.
+            subset = f"subset AS MATERIALIZED (SELECT {columns}, image_embedding FROM medical_cases {where_clause}),"
+            source, where_clause = "subset", ""
+        if keyset_filter:
+            where_clause = f"{where_clause} AND {keyset_filter}" if where_clause else f"WHERE {keyset_filter}"
+
         sql = f"""
-        SELECT *, 1 - (image_embedding <=> '{query_vector_str}'::vector) AS similarity
-        FROM medical_cases
-        {where_clause}
-        ORDER BY similarity DESC
+        WITH {subset} candidates AS MATERIALIZED (
+            SELECT {columns}, image_embedding <=> :q AS distance
+            FROM {source}
+            {where_clause}
+            ORDER BY {quantized_order_by("image_embedding", quantization)}
+            LIMIT :fetch
+        )
+        SELECT {columns}, 1 - distance AS similarity_score
+        FROM candidates
+        {distance_filter}
+        ORDER BY similarity_score DESC, id
         LIMIT :limit
         """
+        return sql, params
 
-        result = self.db.execute(text(sql), params)
-        rows = result.mappings().all()
+    def vector_search_statement(
+        self,
+        query_embedding: List[float],
+        limit: int,
+        modality: Optional[str] = None,
+        body_part: Optional[str] = None,
+        similarity_threshold: float = 0.0,
+        ef_search: Optional[int] = None,
+        probes: Optional[int] = None,
+        include_details: bool = True,
+        after: Optional[Tuple[float, int]] = None,
+    ):
+        """``(statement, params)`` of a vector search the caller executes itself,
+        e.g. through a server-side cursor to stream a deep result set. The
+        per-transaction index settings are applied on this connection first."""
+        self._apply_index_params(ef_search, probes)
+        strategy = self.plan_filtered_search(modality, body_part)
+        sql, params = self._build_vector_query(
+            query_embedding, limit, modality, body_part, similarity_threshold, strategy,
+            include_details=include_details, after=after,
+        )
+        return self._bind(sql), params
 
-        results = []
-        for row in rows:
-            r = dict(row)
-            results.append(r)
+    def vector_search(
+        self,
+        query_embedding: List[float],
+        limit: int = 10,
+        modality: Optional[str] = None,
+        body_part: Optional[str] = None,
+        similarity_threshold: float = 0.0,
+        ef_search: Optional[int] = None,
+        probes: Optional[int] = None,
+        include_details: bool = True,
+        after: Optional[Tuple[float, int]] = None,
+    ) -> Dict[str, Any]:
+        if settings.search_backend == "local":
+            return self.local_vector_search(
+                query_embedding, limit, modality, body_part, similarity_threshold,
+                include_details=include_details, after=after,
+            )
+
+        start = time.time()
+
+        self._apply_index_params(ef_search, probes)
+        strategy = self.plan_filtered_search(modality, body_part)
+        sql, params = self._build_vector_query(
+            query_embedding, limit, modality, body_part, similarity_threshold, strategy,
+            include_details=include_details, after=after,
+        )
+
+        # RowMappings already carry exactly the response fields; no copy needed.
+        results = self._execute(sql, params).mappings().all()
+
+        query_time_ms = (time.time() - start) * 1000.0
+        return {
+            "results": results,
+            "total": len(results),
+            "query_time_ms": query_time_ms,
+            "strategy": strategy,
+        }
+
+    def local_vector_search(
+        self,
+        query_embedding: List[float],
+        limit: int = 10,
+        modality: Optional[str] = None,
+        body_part: Optional[str] = None,
+        similarity_threshold: float = 0.0,
+        ranked: Optional[List[Tuple[int, float]]] = None,
+        include_details: bool = True,
+        after: Optional[Tuple[float, int]] = None,
+    ) -> Dict[str, Any]:
+        """Vector search on the in-process index; only the top-k rows touch Postgres.
+
+        Callers on the event loop compute ``ranked`` in a worker thread and
+        pass it in, so the scan never runs on the loop.
+        """
+        start = time.time()
+        if ranked is None:
+            ranked = get_local_index().search(
+                query_embedding, limit, modality, body_part, similarity_threshold, after=after
+            )
+        # Rows deleted since the index was built simply fail to hydrate.
+        results = self.hydrate(ranked, include_details)
+        return {
+            "results": results,
+            "total": len(results),
+            "query_time_ms": (time.time() - start) * 1000.0,
+            "strategy": "local",
+        }
+
+    def candidates(
+        self,
+        source: str,
+        k: int,
+        query_embedding: Optional[List[float]] = None,
+        query_text: Optional[str] = None,
+        modality: Optional[str] = None,
+        body_part: Optional[str] = None,
+        ef_search: Optional[int] = None,
+        probes: Optional[int] = None,
+        similarity_threshold: float = 0.0,
+    ) -> List[Tuple[int, float]]:
+        """Top-``k`` ``(id, score)`` pairs from one retrieval source, best first.
+
+        ``image``/``text`` run ANN over image_embedding/text_embedding and drop
+        candidates below ``similarity_threshold``; ``keyword`` runs full-text
+        search over diagnosis and findings (ts_rank has no comparable scale).
+        """
+        params: Dict[str, Any] = {"k": k}
+        filters = self._filters(params, modality, body_part)
+
+        if source in ("image", "text"):
+            self._apply_index_params(ef_search, probes)
+            column = f"{source}_embedding"
+            params["q"] = query_embedding
+            where_clause = ("WHERE " + " AND ".join(filters)) if filters else ""
+            sql = f"""
+            SELECT id, 1 - ({column} <=> :q) AS score
+            FROM medical_cases
+            {where_clause}
+            ORDER BY {column} <=> :q
+            LIMIT :k
+            """
+            if settings.embedding_quantization != "none":
+                # Quantized ANN candidates, reranked on the exact score.
+                params["fetch"] = k * max(1, settings.quantized_rerank_factor)
+                sql = f"""
+                SELECT id, score FROM (
+                    SELECT id, 1 - ({column} <=> :q) AS score
+                    FROM medical_cases
+                    {where_clause}
+                    ORDER BY {quantized_order_by(column, settings.embedding_quantization)}
+                    LIMIT :fetch
+                ) reranked
+                ORDER BY score DESC
+                LIMIT :k
+                """
+        elif source == "keyword":
+            params["qtext"] = query_text
+            filters.insert(0, f"{FTS_DOCUMENT} @@ tsq")
+            sql = f"""
+            SELECT id, ts_rank_cd({FTS_DOCUMENT}, tsq) AS score
+            FROM medical_cases, websearch_to_tsquery('english', :qtext) AS tsq
+            WHERE {" AND ".join(filters)}
+            ORDER BY score DESC
+            LIMIT :k
+            """
+        else:
+            raise ValueError(f"Unknown retrieval source: {source}")
+
+        ranked = [(row[0], float(row[1])) for row in self._execute(sql, params).all()]
+        if source != "keyword" and similarity_threshold:
+            ranked = [(case_id, score) for case_id, score in ranked if score >= similarity_threshold]
+        return ranked
+
+    def hydrate(self, ranked: List[Tuple[int, float]], include_details: bool = True) -> List[Dict[str, Any]]:
+        """Fetch result rows for ``(id, score)`` pairs, keeping their order."""
+        if not ranked:
+            return []
+        columns = ", ".join(result_columns(include_details))
+        rows = self._execute(
+            f"SELECT {columns} FROM medical_cases WHERE id = ANY(:ids)", {"ids": [case_id for case_id, _ in ranked]}
+        ).mappings().all()
+        by_id = {row["id"]: row for row in rows}
+        return [{**by_id[case_id], "similarity_score": score} for case_id, score in ranked if case_id in by_id]
 
+    def hybrid_search(
+        self,
+        query_embedding: List[float],
+        query_text: Optional[str] = None,
+        limit: int = 10,
+        modality: Optional[str] = None,
+        body_part: Optional[str] = None,
+        fusion: str = "rrf",
+        weights: Optional[Dict[str, float]] = None,
+        candidates: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        probes: Optional[int] = None,
+        include_details: bool = True,
+        similarity_threshold: float = 0.0,
+    ) -> Dict[str, Any]:
+        """Fuse the image, text and (with ``query_text``) keyword candidates.
+
+        The sources run one after another on this session's connection: a
+        request already holds a pooled connection, and checking out one more
+        per source would let a burst of hybrid requests hold every slot while
+        waiting for their second one. It also keeps every source on the
+        replica the corpus version was read from.
+
+        ``similarity_threshold`` filters the vector sources' candidates. Results
+        carry the fused score as ``fusion_score`` and the image cosine as
+        ``similarity_score``.
+        """
+        start = time.time()
+        k = candidates or hybrid_candidate_count(limit)
+        rankings = {}
+        for source in HYBRID_SOURCES:
+            if source == "keyword" and not query_text:
+                continue
+            rankings[source] = self.candidates(
+                source, k, query_embedding, query_text, modality, body_part, ef_search, probes,
+                similarity_threshold,
+            )
+        fused = fuse_rankings(rankings, fusion, weights, settings.hybrid_rrf_k)[:limit]
+        results = _hybrid_scores(self.hydrate(fused, include_details), rankings.get("image", []))
         query_time_ms = (time.time() - start) * 1000.0
-        return {"results": results, "total": len(results), "query_time_ms": query_time_ms}
\ No newline at end of file
+        return {"results": results, "total": len(results), "query_time_ms": query_time_ms}
+
+    def batch_vector_search(
+        self,
+        queries: List[Dict[str, Any]],
+        ef_search: Optional[int] = None,
+        probes: Optional[int] = None,
+        include_details: bool = True,
+    ) -> List[List[Dict[str, Any]]]:
+        """Run many vector searches in one round trip.
+
+        Each query is a dict with ``query_embedding`` and optional ``limit``,
+        ``modality``, ``body_part`` and ``similarity_threshold``. The query
+        vectors and their parameters are passed as parallel arrays, unnested,
+        and each one drives an index-ordered LATERAL subquery. Returns one
+        result list per query, in order.
+        """
+        self._apply_index_params(ef_search, probes)
+        columns = ", ".join(result_columns(include_details))
+        qvec = f"CAST(qs.q_vec AS vector({EMBEDDING_DIM}))"
+        quantization = settings.embedding_quantization
+        overfetch = settings.vector_overfetch
+        if quantization != "none":
+            overfetch = max(overfetch, settings.quantized_rerank_factor)
+
+        sql = f"""
+        SELECT qs.q_ord, {columns}, 1 - distance AS similarity_score
+        FROM unnest(
+            CAST(:qvecs AS text[]), CAST(:qmods AS text[]), CAST(:qparts AS text[]),
+            CAST(:qlimits AS integer[]), CAST(:qmaxdists AS double precision[])
+        ) WITH ORDINALITY AS qs(q_vec, q_modality, q_body_part, q_limit, q_max_dist, q_ord)
+        CROSS JOIN LATERAL (
+            SELECT * FROM (
+                SELECT {columns}, image_embedding <=> {qvec} AS distance
+                FROM medical_cases
+                WHERE (qs.q_modality IS NULL OR modality = qs.q_modality)
+                  AND (qs.q_body_part IS NULL OR body_part = qs.q_body_part)
+                ORDER BY {quantized_order_by("image_embedding", quantization, qvec)}
+                LIMIT qs.q_limit * :overfetch
+            ) candidates
+            WHERE qs.q_max_dist IS NULL OR distance <= qs.q_max_dist
+            ORDER BY distance
+            LIMIT qs.q_limit
+        ) c
+        ORDER BY qs.q_ord, distance
+        """
+        params = {
+            "qvecs": [vector_literal(q["query_embedding"]) for q in queries],
+            "qmods": [q.get("modality") for q in queries],
+            "qparts": [q.get("body_part") for q in queries],
+            "qlimits": [int(q.get("limit", 10)) for q in queries],
+            "qmaxdists": [
+                1.0 - float(q["similarity_threshold"]) if q.get("similarity_threshold") else None for q in queries
+            ],
+            "overfetch": max(1, overfetch),
+        }
+
+        results: List[List[Dict[str, Any]]] = [[] for _ in queries]
+        for row in self._execute(sql, params).mappings():
+            r = dict(row)
+            results[r.pop("q_ord") - 1].append(r)
+        return results
+
+    def hydrate_many(
+        self, ranked_lists: List[List[Tuple[int, float]]], include_details: bool = True
+    ) -> List[List[Dict[str, Any]]]:
+        """``hydrate`` for several rankings with a single query."""
+        ids = {case_id for ranked in ranked_lists for case_id, _ in ranked}
+        rows = {r["id"]: r for r in self.hydrate([(case_id, 0.0) for case_id in ids], include_details)}
+        return [
+            [{**rows[case_id], "similarity_score": score} for case_id, score in ranked if case_id in rows]
+            for ranked in ranked_lists
+        ]
+
+    def stored_image_embeddings(self, digests: List[str]) -> Dict[str, List[float]]:
+        """``stored_image_embedding`` for many digests with a single query."""
+        if not digests:
+            return {}
+        stmt = text(
+            "SELECT DISTINCT ON (image_sha256) image_sha256, image_embedding FROM medical_cases "
+            "WHERE image_sha256 = ANY(:hs)"
+        ).columns(image_embedding=Vector(EMBEDDING_DIM))
+        return {h: vec.tolist() for h, vec in self.db.execute(stmt, {"hs": list(digests)}).all()}
+
+    def stored_image_embedding(self, digest: str) -> Optional[List[float]]:
+        """Embedding of an already indexed case whose image has this SHA-256."""
+        stmt = text(
+            "SELECT image_embedding FROM medical_cases WHERE image_sha256 = :h LIMIT 1"
+        ).columns(image_embedding=Vector(EMBEDDING_DIM))
+        vec = self.db.execute(stmt, {"h": digest}).scalar()
+        return None if vec is None else vec.tolist()
+
+    def explain_vector_search(
+        self,
+        query_embedding: List[float],
+        limit: int = 10,
+        modality: Optional[str] = None,
+        body_part: Optional[str] = None,
+        similarity_threshold: float = 0.0,
+        ef_search: Optional[int] = None,
+        probes: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """Return the JSON plan for ``vector_search`` and the indexes it scans."""
+        self._apply_index_params(ef_search, probes)
+        strategy = self.plan_filtered_search(modality, body_part)
+        sql, params = self._build_vector_query(
+            query_embedding, limit, modality, body_part, similarity_threshold, strategy
+        )
+        plan = self.db.execute(self._bind("EXPLAIN (FORMAT JSON) " + sql), params).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+
+        indexes = []
+
+        def walk(node):
+            if "Index Name" in node:
+                indexes.append(node["Index Name"])
+            for child in node.get("Plans", []):
+                walk(child)
+
+        walk(plan[0]["Plan"])
+        return {"plan": plan, "indexes": indexes, "strategy": strategy}
@@ -0,0 +1,195 @@
+"""Per-stage latency histograms, rendered in the Prometheus text format.
+
+A request handler opens ``request_timer(endpoint, filter_label(...))``;
+code anywhere below it (including inference executor threads, which run in a
+copy of the caller's context) wraps work in ``stage("sql")`` and similar.
+When the request ends every stage is observed once into
+``medimatch_stage_duration_seconds`` labelled by endpoint, stage and filter
+combination, so a regression can be pinned on one stage. Outside a request,
+``stage`` is a no-op.
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+import threading
+import time
+
+
+# Upper bounds in seconds, 0.5 ms .. 10 s.
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{str(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str], buckets: Sequence[float] = BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # labels -> [per-bucket counts (last is +Inf), sum, count]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {k: (list(v[0]), v[1], v[2]) for k, v in self._series.items()}
+        for labels, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_labels(self.labelnames, k)} {v}" for k, v in sorted(values.items())]
+        return lines
+
+
+def gauge_lines(
+    name: str, help: str, samples: Iterable[Tuple[Dict[str, str], Optional[float]]], kind: str = "gauge"
+) -> List[str]:
+    """Render values read at scrape time (pool occupancy, queue depths)."""
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        if value is not None:
+            lines.append(f"{name}{_labels(list(labels), list(labels.values()))} {float(value)}")
+    return lines
+
+
+STAGE_SECONDS = Histogram(
+    "medimatch_stage_duration_seconds",
+    "Time spent per request in each stage (decode, preprocess, forward, sql, hydrate, serialize, ...).",
+    ("endpoint", "stage", "filters"),
+)
+REQUEST_SECONDS = Histogram(
+    "medimatch_request_duration_seconds",
+    "Search request latency by endpoint, filter combination and result-cache outcome.",
+    ("endpoint", "filters", "cache"),
+)
+POOL_TIMEOUTS = Counter(
+    "medimatch_db_pool_timeouts_total",
+    "Requests rejected because no database connection became free in time.",
+    ("endpoint",),
+)
+INFERENCE_REJECTED = Counter(
+    "medimatch_inference_rejected_total",
+    "Requests rejected because the inference queue was full.",
+    ("endpoint",),
+)
+
+
+def filter_label(modality: Optional[str], body_part: Optional[str]) -> str:
+    """Which filters a search used (not their values, to bound cardinality)."""
+    used = [name for name, value in (("modality", modality), ("body_part", body_part)) if value]
+    return "+".join(used) or "none"
+
+
+class RequestTimer:
+    def __init__(self, endpoint: str, filters: str = "none"):
+        self.endpoint = endpoint
+        self.filters = filters
+        self.cache = "none"
+        self.start = time.perf_counter()
+        self._lock = threading.Lock()
+        self.stages: Dict[str, float] = {}  # seconds, in first-seen order
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def server_timing(self) -> str:
+        """``Server-Timing`` header value, durations in milliseconds."""
+        with self._lock:
+            stages = dict(self.stages)
+        parts = [f"{name};dur={seconds * 1000.0:.2f}" for name, seconds in stages.items()]
+        if self.cache != "none":
+            parts.append(f'cache;desc="{self.cache}"')
+        parts.append(f"total;dur={self.elapsed() * 1000.0:.2f}")
+        return ", ".join(parts)
+
+    def record(self) -> None:
+        with self._lock:
+            stages = dict(self.stages)
+        for name, seconds in stages.items():
+            STAGE_SECONDS.observe(seconds, self.endpoint, name, self.filters)
+        REQUEST_SECONDS.observe(self.elapsed(), self.endpoint, self.filters, self.cache)
+
+
+_current: ContextVar[Optional[RequestTimer]] = ContextVar("medimatch_request_timer", default=None)
+
+
+def current_timer() -> Optional[RequestTimer]:
+    return _current.get()
+
+
+@contextmanager
+def request_timer(endpoint: str, filters: str = "none") -> Iterator[RequestTimer]:
+    timer = RequestTimer(endpoint, filters)
+    token = _current.set(timer)
+    try:
+        yield timer
+    finally:
+        _current.reset(token)
+        timer.record()
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    timer = _current.get()
+    if timer is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(name, time.perf_counter() - start)
+
+
+def render(extra: Iterable[List[str]] = ()) -> str:
+    lines: List[str] = []
+    for metric in (STAGE_SECONDS, REQUEST_SECONDS, POOL_TIMEOUTS, INFERENCE_REJECTED):
+        lines += metric.render()
+    for block in extra:
+        lines += block
+    return "\n".join(lines) + "\n"
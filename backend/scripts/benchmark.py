@@ -0,0 +1,506 @@
+# backend/scripts/benchmark.py
+"""
+Search benchmark and recall suite over a synthetic corpus.
+
+``generate`` writes N random or clustered 512-d unit vectors with a skewed
+modality/body_part mix into medical_cases (case_id ``bench-<n>``, via
+BulkCaseWriter COPY) and keeps a copy of the vectors and filter codes in
+--corpus-dir for exact ground truth. ``run`` measures QPS, latency
+percentiles and recall@k against a brute-force scan of that copy:
+
+  --mode embedding   CLIP encode only (in-process, or the embedding worker)
+  --mode db          SearchService.vector_search on the configured backend
+  --mode e2e         POST /api/search on a running server
+
+Use a dedicated database: other rows in medical_cases are not part of the
+ground truth and lower the measured recall. Build the ANN index after
+loading (scripts/manage_index.py build) so the numbers mean something.
+
+Examples:
+    python scripts/benchmark.py generate --rows 1000000 --kind clustered
+    python scripts/benchmark.py run --mode db --queries 500 --concurrency 8 --filters mixed --json db.json
+    python scripts/benchmark.py run --mode e2e --url http://localhost:8000 --queries 200 --json e2e.json
+    python scripts/benchmark.py run --mode embedding --input image --queries 200
+    python scripts/benchmark.py clean
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+current_dir = Path(__file__).parent
+backend_dir = current_dir.parent
+sys.path.insert(0, str(backend_dir))
+
+from sqlalchemy import text
+
+from app.config import settings
+from app.database import SessionLocal, engine
+from app.services.bulk_writer import BulkCaseWriter
+from app.services.corpus import bump_corpus_version
+from app.services.search_service import SearchService, EMBEDDING_DIM
+
+
+CASE_PREFIX = "bench-"
+SOURCE = "synthetic-benchmark"
+
+# Roughly what a radiology archive looks like: mostly chest X-rays, a long tail
+# of everything else. Body parts are drawn conditionally on the modality.
+MODALITIES = {"xray": 0.55, "ct": 0.22, "mri": 0.15, "ultrasound": 0.08}
+BODY_PARTS = {
+    "xray": {"chest": 0.75, "hand": 0.08, "knee": 0.09, "spine": 0.08},
+    "ct": {"chest": 0.45, "head": 0.30, "abdomen": 0.25},
+    "mri": {"head": 0.55, "knee": 0.25, "spine": 0.20},
+    "ultrasound": {"abdomen": 0.70, "pelvis": 0.30},
+}
+MODALITY_NAMES = list(MODALITIES)
+BODY_PART_NAMES = sorted({part for parts in BODY_PARTS.values() for part in parts})
+DIAGNOSES = ["Normal", "Pneumonia", "Fracture", "Effusion", "Mass", "Atelectasis"]
+
+
+def _normalize(x):
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+def _draw_filters(rng, n):
+    """Skewed (modality, body_part) codes for n rows."""
+    modality = rng.choice(len(MODALITY_NAMES), size=n, p=list(MODALITIES.values())).astype(np.int8)
+    body_part = np.empty(n, dtype=np.int8)
+    for m, name in enumerate(MODALITY_NAMES):
+        rows = np.flatnonzero(modality == m)
+        parts = BODY_PARTS[name]
+        codes = [BODY_PART_NAMES.index(p) for p in parts]
+        body_part[rows] = rng.choice(codes, size=len(rows), p=list(parts.values()))
+    return modality, body_part
+
+
+class CorpusGenerator:
+    """Deterministic chunks of synthetic vectors and filter codes.
+
+    ``clustered`` draws rows around ``clusters`` centres with Zipf-like
+    cluster sizes; each cluster has a home (modality, body_part) that most of
+    its rows share, so filters select correlated regions the way real data does.
+    """
+
+    def __init__(self, kind, clusters, spread, seed):
+        self.kind = kind
+        self.seed = seed
+        self.spread = spread
+        rng = np.random.default_rng([seed, 0])
+        self.centers = _normalize(rng.standard_normal((clusters, EMBEDDING_DIM)).astype(np.float32))
+        weights = 1.0 / np.arange(1, clusters + 1) ** 0.8
+        self.cluster_p = weights / weights.sum()
+        self.home_modality, self.home_body_part = _draw_filters(rng, clusters)
+
+    def chunk(self, index, n):
+        rng = np.random.default_rng([self.seed, index + 1])
+        if self.kind == "random":
+            vectors = rng.standard_normal((n, EMBEDDING_DIM)).astype(np.float32)
+            modality, body_part = _draw_filters(rng, n)
+        else:
+            cluster = rng.choice(len(self.centers), size=n, p=self.cluster_p)
+            noise = rng.standard_normal((n, EMBEDDING_DIM)).astype(np.float32)
+            vectors = self.centers[cluster] + noise * (self.spread / np.sqrt(EMBEDDING_DIM))
+            modality, body_part = self.home_modality[cluster], self.home_body_part[cluster]
+            stray = rng.random(n) < 0.1
+            modality[stray], body_part[stray] = _draw_filters(rng, int(stray.sum()))
+        return _normalize(vectors).astype(np.float32), modality, body_part
+
+
+# ---- corpus on disk -------------------------------------------------------
+
+def corpus_paths(corpus_dir):
+    d = Path(corpus_dir)
+    return {
+        "vectors": d / "vectors.npy",
+        "modality": d / "modality.npy",
+        "body_part": d / "body_part.npy",
+        "meta": d / "meta.json",
+    }
+
+
+def load_corpus(corpus_dir):
+    paths = corpus_paths(corpus_dir)
+    if not paths["meta"].exists():
+        raise SystemExit(f"No corpus in {corpus_dir}; run `benchmark.py generate` first")
+    return {
+        "vectors": np.load(paths["vectors"], mmap_mode="r"),
+        "modality": np.load(paths["modality"], mmap_mode="r"),
+        "body_part": np.load(paths["body_part"], mmap_mode="r"),
+        "meta": json.loads(paths["meta"].read_text()),
+    }
+
+
+def generate(args):
+    paths = corpus_paths(args.corpus_dir)
+    paths["meta"].parent.mkdir(parents=True, exist_ok=True)
+    gen = CorpusGenerator(args.kind, args.clusters, args.spread, args.seed)
+    vectors = np.lib.format.open_memmap(
+        paths["vectors"], mode="w+", dtype=np.float32, shape=(args.rows, EMBEDDING_DIM)
+    )
+    modality = np.empty(args.rows, dtype=np.int8)
+    body_part = np.empty(args.rows, dtype=np.int8)
+
+    start = time.perf_counter()
+    written = 0
+    writer = None if args.no_db else BulkCaseWriter(
+        engine=engine,
+        columns=["case_id", "modality", "body_part", "diagnosis", "findings", "image_embedding", "source"],
+        on_conflict="update",
+    )
+    with writer or contextlib.nullcontext():
+        for index, lo in enumerate(range(0, args.rows, args.chunk_size)):
+            n = min(args.chunk_size, args.rows - lo)
+            vecs, mods, parts = gen.chunk(index, n)
+            vectors[lo:lo + n] = vecs
+            modality[lo:lo + n] = mods
+            body_part[lo:lo + n] = parts
+            if writer is not None:
+                written += writer.write(
+                    {
+                        "case_id": f"{CASE_PREFIX}{lo + i:09d}",
+                        "modality": MODALITY_NAMES[mods[i]],
+                        "body_part": BODY_PART_NAMES[parts[i]],
+                        "diagnosis": DIAGNOSES[(lo + i) % len(DIAGNOSES)],
+                        "findings": "Synthetic benchmark case",
+                        "image_embedding": vecs[i],
+                        "source": SOURCE,
+                    }
+                    for i in range(n)
+                )
+                writer.commit()
+            done = lo + n
+            rate = done / (time.perf_counter() - start)
+            print(f"\r  {done:,}/{args.rows:,} rows ({rate:,.0f} rows/s)", end="", flush=True)
+    print()
+
+    vectors.flush()
+    del vectors
+    np.save(paths["modality"], modality)
+    np.save(paths["body_part"], body_part)
+    meta = {
+        "rows": args.rows,
+        "dim": EMBEDDING_DIM,
+        "kind": args.kind,
+        "clusters": args.clusters if args.kind == "clustered" else None,
+        "spread": args.spread if args.kind == "clustered" else None,
+        "seed": args.seed,
+        "modalities": MODALITY_NAMES,
+        "body_parts": BODY_PART_NAMES,
+    }
+    paths["meta"].write_text(json.dumps(meta, indent=2))
+
+    if not args.no_db:
+        db = SessionLocal()
+        try:
+            db.execute(text("ANALYZE medical_cases"))
+            db.commit()
+            bump_corpus_version(db)
+        finally:
+            db.close()
+    print(f"Wrote {written:,} rows to medical_cases and the corpus copy to {args.corpus_dir}")
+    print("Build the ANN index before measuring: python scripts/manage_index.py build")
+
+
+def clean(args):
+    db = SessionLocal()
+    try:
+        deleted = db.execute(text("DELETE FROM medical_cases WHERE source = :s"), {"s": SOURCE}).rowcount
+        db.commit()
+        bump_corpus_version(db)
+    finally:
+        db.close()
+    print(f"Deleted {deleted:,} benchmark rows")
+
+
+# ---- queries and ground truth ---------------------------------------------
+
+def make_filters(corpus, n, mode, rng):
+    """Per-query (modality, body_part) names, sampled from the corpus so that
+    popular combinations are queried as often as they occur."""
+    if mode == "none":
+        return [(None, None)] * n
+    rows = rng.integers(0, corpus["meta"]["rows"], size=n)
+    filters = []
+    for i, row in enumerate(rows):
+        m = MODALITY_NAMES[corpus["modality"][row]]
+        b = BODY_PART_NAMES[corpus["body_part"][row]]
+        choice = mode if mode != "mixed" else ("none", "modality", "modality+body_part")[i % 3]
+        filters.append({"none": (None, None), "modality": (m, None), "modality+body_part": (m, b)}[choice])
+    return filters
+
+
+def sample_queries(corpus, n, noise, rng):
+    rows = rng.integers(0, corpus["meta"]["rows"], size=n)
+    q = np.asarray(corpus["vectors"][np.sort(rows)], dtype=np.float32)
+    q = q + rng.standard_normal(q.shape).astype(np.float32) * (noise / np.sqrt(q.shape[1]))
+    return _normalize(q)
+
+
+def brute_force(corpus, queries, filters, k):
+    """Exact top-k case_ids per query under its filters (chunked matmul)."""
+    vectors = corpus["vectors"]
+    chunk_size = max(k, 20_000_000 // max(1, len(queries)))  # ~80 MB of scores per chunk
+    mod_codes = np.array([-1 if m is None else MODALITY_NAMES.index(m) for m, _ in filters])
+    part_codes = np.array([-1 if b is None else BODY_PART_NAMES.index(b) for _, b in filters])
+    n_q = len(queries)
+    best_scores = np.full((n_q, k), -np.inf, dtype=np.float32)
+    best_rows = np.full((n_q, k), -1, dtype=np.int64)
+    for lo in range(0, len(vectors), chunk_size):
+        hi = min(lo + chunk_size, len(vectors))
+        scores = queries @ np.asarray(vectors[lo:hi], dtype=np.float32).T  # (n_q, chunk)
+        mods = np.asarray(corpus["modality"][lo:hi])
+        parts = np.asarray(corpus["body_part"][lo:hi])
+        mask = (mod_codes[:, None] >= 0) & (mods[None, :] != mod_codes[:, None])
+        mask |= (part_codes[:, None] >= 0) & (parts[None, :] != part_codes[:, None])
+        scores[mask] = -np.inf
+        if scores.shape[1] > k:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            chunk_scores, chunk_rows = np.take_along_axis(scores, top, axis=1), top + lo
+        else:
+            chunk_scores, chunk_rows = scores, np.broadcast_to(np.arange(lo, hi), scores.shape)
+        all_scores = np.concatenate([best_scores, chunk_scores], axis=1)
+        all_rows = np.concatenate([best_rows, chunk_rows], axis=1)
+        top = np.argpartition(-all_scores, k - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(all_scores, top, axis=1)
+        best_rows = np.take_along_axis(all_rows, top, axis=1)
+    return [
+        {f"{CASE_PREFIX}{r:09d}" for r, s in zip(rows, scores) if r >= 0 and np.isfinite(s)}
+        for rows, scores in zip(best_rows, best_scores)
+    ]
+
+
+# ---- measurement ----------------------------------------------------------
+
+def measure(fn, items, concurrency, warmup_items=()):
+    """Run ``fn`` over items with a thread pool; returns (results, latencies_ms, wall_s, errors).
+
+    ``warmup_items`` are run first and not measured; they should differ from
+    ``items`` so caches do not turn the measured run into hits.
+    """
+    for item in warmup_items:
+        fn(item)
+    results = [None] * len(items)
+    latencies = np.zeros(len(items))
+    errors = []
+
+    def call(i):
+        start = time.perf_counter()
+        try:
+            results[i] = fn(items[i])
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+        latencies[i] = (time.perf_counter() - start) * 1000.0
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(call, range(len(items))))
+    return results, latencies, time.perf_counter() - start, errors
+
+
+def summarize(latencies, wall, errors):
+    return {
+        "qps": len(latencies) / wall if wall else None,
+        "mean_ms": float(latencies.mean()),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "max_ms": float(latencies.max()),
+        "errors": len(errors),
+        "error_samples": errors[:5],
+    }
+
+
+def recall(results, truth):
+    scores = [
+        len(expected.intersection(ids)) / len(expected)
+        for ids, expected in zip(results, truth)
+        if ids is not None and expected
+    ]
+    return float(np.mean(scores)) if scores else None
+
+
+def query_texts(filters, tag="query"):
+    # Distinct strings so the text and result caches do not short-circuit the run.
+    return [
+        " ".join(filter(None, [DIAGNOSES[i % len(DIAGNOSES)], b, m, f"benchmark {tag} {i}"]))
+        for i, (m, b) in enumerate(filters)
+    ]
+
+
+def run_embedding(args, rng):
+    from PIL import Image
+    from app.services.embedding_service import get_embedding_service
+
+    svc = get_embedding_service(device=settings.device)
+    n = args.queries + args.warmup
+    if args.input == "text":
+        items = query_texts([(None, None)] * n)
+        fn = svc.encode_text
+    else:
+        items = []
+        for _ in range(n):
+            buf = io.BytesIO()
+            pixels = rng.integers(0, 256, (args.image_side, args.image_side, 3), dtype=np.uint8)
+            Image.fromarray(pixels).save(buf, "PNG")
+            items.append(buf.getvalue())
+        fn = svc.encode_image_bytes
+    _, latencies, wall, errors = measure(fn, items[args.warmup:], args.concurrency, items[:args.warmup])
+    return {**summarize(latencies, wall, errors), "input": args.input}
+
+
+def run_db(args, corpus, rng):
+    filters = make_filters(corpus, args.queries, args.filters, rng)
+    queries = sample_queries(corpus, args.queries, args.noise, rng)
+    print(f"Computing exact top-{args.k} for {len(queries)} queries...")
+    truth = brute_force(corpus, queries, filters, args.k)
+
+    local = threading.local()
+
+    def search(i):
+        if not hasattr(local, "db"):
+            local.db = SessionLocal()
+        db = local.db
+        try:
+            m, b = filters[i]
+            out = SearchService(db).vector_search(
+                queries[i].tolist(), args.k, m, b,
+                ef_search=args.ef_search, probes=args.probes, include_details=False,
+            )
+            return [row["case_id"] for row in out["results"]]
+        finally:
+            db.rollback()
+
+    warmup = sample_queries(corpus, args.warmup, args.noise, rng)
+    for q in warmup:
+        db = SessionLocal()
+        try:
+            SearchService(db).vector_search(q.tolist(), args.k, include_details=False)
+        finally:
+            db.close()
+    results, latencies, wall, errors = measure(search, list(range(len(queries))), args.concurrency)
+    return {**summarize(latencies, wall, errors), "recall_at_k": recall(results, truth)}
+
+
+def run_e2e(args, corpus, rng):
+    import requests
+
+    filters = make_filters(corpus, args.queries, args.filters, rng)
+    texts = query_texts(filters)
+    truth = None
+    if not args.no_recall:
+        from app.services.embedding_service import get_embedding_service
+
+        print("Encoding queries locally for ground truth...")
+        svc = get_embedding_service(device=settings.device)
+        queries = np.asarray(svc.encode_query_texts(texts), dtype=np.float32)
+        truth = brute_force(corpus, queries, filters, args.k)
+
+    local = threading.local()
+    url = args.url.rstrip("/") + "/api/search"
+
+    def search(item):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        query, (m, b) = item
+        body = {"query": query, "modality": m, "body_part": b, "limit": args.k, "view": "grid"}
+        if args.ef_search:
+            body["ef_search"] = args.ef_search
+        resp = local.session.post(url, json=body, timeout=60)
+        resp.raise_for_status()
+        return [r["case_id"] for r in resp.json()["results"]]
+
+    warmup_filters = [(None, None)] * args.warmup
+    warmup = list(zip(query_texts(warmup_filters, "warmup"), warmup_filters))
+    results, latencies, wall, errors = measure(search, list(zip(texts, filters)), args.concurrency, warmup)
+    return {**summarize(latencies, wall, errors), "recall_at_k": recall(results, truth) if truth else None}
+
+
+def run(args):
+    rng = np.random.default_rng(args.seed)
+    corpus = load_corpus(args.corpus_dir) if args.mode != "embedding" else None
+    if args.mode == "embedding":
+        metrics = run_embedding(args, rng)
+    elif args.mode == "db":
+        metrics = run_db(args, corpus, rng)
+    else:
+        metrics = run_e2e(args, corpus, rng)
+
+    report = {
+        "mode": args.mode,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "host": platform.node(),
+        "corpus": corpus["meta"] if corpus else None,
+        "params": {
+            "queries": args.queries,
+            "concurrency": args.concurrency,
+            "k": args.k,
+            "filters": args.filters,
+            "ef_search": args.ef_search,
+            "probes": args.probes,
+            "search_backend": settings.search_backend,
+            "inference_backend": settings.inference_backend,
+            "embedding_worker": bool(settings.embedding_worker_socket),
+        },
+        "results": metrics,
+    }
+    recall_at_k = metrics.get("recall_at_k")
+    print(
+        f"{args.mode}: {metrics['qps']:.1f} QPS  p50={metrics['p50_ms']:.1f}ms p95={metrics['p95_ms']:.1f}ms "
+        f"p99={metrics['p99_ms']:.1f}ms  recall@{args.k}="
+        + (f"{recall_at_k:.3f}" if recall_at_k is not None else "n/a")
+        + f"  errors={metrics['errors']}"
+    )
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2))
+        print(f"Wrote {args.json}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search benchmark and recall suite")
+    parser.add_argument("--corpus-dir", default="data/benchmark", help="where the corpus copy lives")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("generate", help="generate a synthetic corpus and bulk-load it")
+    p.add_argument("--rows", type=int, default=100_000)
+    p.add_argument("--kind", choices=["random", "clustered"], default="clustered")
+    p.add_argument("--clusters", type=int, default=1000)
+    p.add_argument("--spread", type=float, default=0.6, help="within-cluster noise (relative to a unit vector)")
+    p.add_argument("--chunk-size", type=int, default=20_000, help="rows per COPY/commit")
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--no-db", action="store_true", help="only write the corpus copy (e.g. for the local index)")
+
+    p = sub.add_parser("run", help="measure QPS, latency percentiles and recall@k")
+    p.add_argument("--mode", choices=["embedding", "db", "e2e"], required=True)
+    p.add_argument("--queries", type=int, default=200)
+    p.add_argument("--warmup", type=int, default=10)
+    p.add_argument("--concurrency", type=int, default=1)
+    p.add_argument("--k", type=int, default=10)
+    p.add_argument("--filters", choices=["none", "modality", "modality+body_part", "mixed"], default="none")
+    p.add_argument("--ef-search", type=int, default=None)
+    p.add_argument("--probes", type=int, default=None)
+    p.add_argument("--noise", type=float, default=0.3, help="perturbation of sampled query vectors (db mode)")
+    p.add_argument("--input", choices=["text", "image"], default="text", help="embedding mode input")
+    p.add_argument("--image-side", type=int, default=512)
+    p.add_argument("--url", default="http://localhost:8000", help="server for e2e mode")
+    p.add_argument("--no-recall", action="store_true", help="e2e: skip encoding queries for ground truth")
+    p.add_argument("--seed", type=int, default=7)
+    p.add_argument("--json", default=None, help="also write the report to this file")
+
+    sub.add_parser("clean", help="delete the benchmark rows from medical_cases")
+
+    args = parser.parse_args(argv)
+    {"generate": generate, "run": run, "clean": clean}[args.command](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# backend/scripts/check_inference_parity.py
+"""
+Check an inference backend against the eager PyTorch CLIP model.
+
+Encodes the same texts and images with eager torch and with each requested
+backend, then reports per-item cosine similarity and forward-pass time. Exits
+non-zero if any embedding falls below --min-cosine, so it can gate a
+deployment switching INFERENCE_BACKEND.
+
+Example:
+    python scripts/check_inference_parity.py --backend torch_int8 onnx_int8 --min-cosine 0.99
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+current_dir = Path(__file__).parent
+backend_dir = current_dir.parent
+sys.path.insert(0, str(backend_dir))
+
+import clip
+import torch
+from PIL import Image
+
+from app.config import settings
+from app.services.inference_backends import BACKENDS, build_backend, configure_threads
+
+TEXTS = [
+    "Pneumonia",
+    "Right lower lobe consolidation with air bronchograms",
+    "Clear lung fields, no acute cardiopulmonary abnormality",
+    "Enlarged cardiac silhouette",
+    "Small right pneumothorax",
+    "MRI of the knee showing a torn anterior cruciate ligament",
+]
+
+
+def synthetic_images(n, seed=0):
+    # Smooth gradients plus noise: closer to real image statistics than pure noise.
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(n):
+        base = np.linspace(0, 255, 256)[None, :, None] * rng.uniform(0.2, 1.0, size=(1, 1, 3))
+        arr = np.clip(base + rng.normal(0, 25, size=(256, 256, 3)), 0, 255).astype(np.uint8)
+        images.append(Image.fromarray(arr))
+    return images
+
+
+def normalized(x):
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+def timed(fn, arg, repeat):
+    fn(arg)  # warm-up
+    start = time.perf_counter()
+    for _ in range(repeat):
+        out = fn(arg)
+    return normalized(out), (time.perf_counter() - start) * 1000.0 / repeat
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare inference backends with eager CLIP")
+    parser.add_argument("--backend", nargs="+", choices=BACKENDS, default=[settings.inference_backend])
+    parser.add_argument("--images", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=5, help="timed forward passes per backend")
+    parser.add_argument("--min-cosine", type=float, default=0.99)
+    args = parser.parse_args(argv)
+
+    configure_threads()
+    model, preprocess = clip.load(settings.embedding_model, device=settings.device)
+    model.eval()
+    tokens = clip.tokenize(TEXTS, truncate=True)
+    images = torch.stack([preprocess(img) for img in synthetic_images(args.images)])
+
+    reference = build_backend("torch", model, settings.embedding_model, settings.device)
+    ref_text, ref_text_ms = timed(reference.encode_text, tokens, args.repeat)
+    ref_image, ref_image_ms = timed(reference.encode_image, images, args.repeat)
+    print(f"torch (reference): text {ref_text_ms:.1f} ms/batch, image {ref_image_ms:.1f} ms/batch")
+
+    failed = False
+    for name in args.backend:
+        backend = build_backend(name, model, settings.embedding_model, settings.device)
+        text, text_ms = timed(backend.encode_text, tokens, args.repeat)
+        image, image_ms = timed(backend.encode_image, images, args.repeat)
+        text_cos = (text * ref_text).sum(axis=1)
+        image_cos = (image * ref_image).sum(axis=1)
+        worst = float(min(text_cos.min(), image_cos.min()))
+        ok = worst >= args.min_cosine
+        failed |= not ok
+        print(
+            f"{name}: text cos min={text_cos.min():.5f} mean={text_cos.mean():.5f} "
+            f"({text_ms:.1f} ms, {ref_text_ms / text_ms:.2f}x) | "
+            f"image cos min={image_cos.min():.5f} mean={image_cos.mean():.5f} "
+            f"({image_ms:.1f} ms, {ref_image_ms / image_ms:.2f}x) -> {'OK' if ok else 'FAIL'}"
+        )
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+# backend/scripts/embedding_worker.py
+"""
+Run the shared CLIP embedding worker.
+
+One worker process holds the model and serves every API process on the host
+over a Unix socket; start the API with the same EMBEDDING_WORKER_SOCKET to
+use it. Batching, the queue bound and the thread settings come from the usual
+EMBEDDING_* / INFERENCE_* environment variables.
+
+Example:
+    python scripts/embedding_worker.py --socket /tmp/medimatch-embedding.sock
+    python scripts/embedding_worker.py --socket /tmp/medimatch-embedding.sock --health
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+current_dir = Path(__file__).parent
+backend_dir = current_dir.parent
+sys.path.insert(0, str(backend_dir))
+
+from app.config import settings
+from app.services.embedding_worker import EmbeddingWorkerClient, serve
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Shared CLIP embedding worker")
+    parser.add_argument("--socket", default=settings.embedding_worker_socket, help="Unix socket path")
+    parser.add_argument("--health", action="store_true", help="query a running worker and exit")
+    args = parser.parse_args(argv)
+    if not args.socket:
+        parser.error("--socket or EMBEDDING_WORKER_SOCKET is required")
+
+    if args.health:
+        print(json.dumps(EmbeddingWorkerClient(args.socket, timeout=5).health(), indent=2))
+        return
+    serve(args.socket)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,20 @@
 # backend/scripts/load_from_huggingface.py
 """
-Fixed version with correct method names
+Streaming, resumable loader for Hugging Face medical data.
+
+The dataset is read in streaming mode and processed in fixed-size batches,
+so memory stays bounded whatever the dataset size. Case ids are derived from
+the stream position, rows that already exist are skipped before any
+embedding work, and writes upsert on case_id through the bulk path, so the
+script can simply be re-run (or resumed with --skip) after an interruption.
 """
 
+import argparse
+import hashlib
 import sys
 import os
+import time
+from itertools import islice
 from pathlib import Path
 
 current_dir = Path(__file__).parent
@@ -17,7 +27,9 @@ print(f"📂 Backend directory: {backend_dir}")
 try:
     from app.database import SessionLocal, engine
     from app.models.medical_case import MedicalCase, Base
-    from app.services.embedding_service import EmbeddingService
+    from app.services.embedding_service import EmbeddingService, decode_corpus_image
+    from app.services.bulk_writer import BulkCaseWriter
+    from app.services.corpus import bump_corpus_version
     print("✅ Imports successful!")
 except ImportError as e:
     print(f"❌ Import error: {e}")
@@ -26,164 +38,166 @@ except ImportError as e:
 from tqdm import tqdm
 import random
 
-def load_from_huggingface():
+DATASET_NAME = "keremberke/chest-xray-classification"
+
+DIAGNOSIS_MAP = {
+    0: 'Normal',
+    1: 'Pneumonia',
+    2: 'COVID-19'
+}
+
+
+def batched(iterable, size):
+    it = iter(iterable)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class TextEmbeddingMemo:
+    """Findings text repeats heavily; encode each distinct string once per run."""
+
+    def __init__(self, embedding_service):
+        self.embedding_service = embedding_service
+        self.vectors = {}
+
+    def encode(self, texts):
+        missing = sorted({t for t in texts if t not in self.vectors})
+        if missing:
+            for text, vec in zip(missing, self.embedding_service.encode_text(missing)):
+                self.vectors[text] = vec
+        return [self.vectors[t] for t in texts]
+
+
+def load_from_huggingface(
+    max_cases=None,
+    batch_size=32,
+    skip=0,
+    write_method="copy",
+    dataset_name=DATASET_NAME,
+):
     """Load real medical data"""
-    
+
     print("\n🤗 Hugging Face Medical Data Loader")
     print("=" * 50)
-    
+
     # Initialize database
     print("🗄️  Initializing database...")
     Base.metadata.create_all(bind=engine)
-    db = SessionLocal()
-    
+
     # Initialize embedding service
     print("🤖 Loading CLIP model...")
-    embedding_service = EmbeddingService()
+    embedding_service = EmbeddingService(batching=False)
     print("✅ CLIP model loaded!")
-    
-    # Check what methods are available
-    print("\n🔍 Checking available methods...")
-    methods = [m for m in dir(embedding_service) if not m.startswith('_')]
-    print(f"Available methods: {methods}")
-    
+
+    try:
+        from datasets import load_dataset, Image as HFImage
+        print("✅ 'datasets' package found")
+    except ImportError:
+        print("❌ The 'datasets' package is required: pip install -r requirements.txt")
+        sys.exit(1)
+
+    print("\n📥 Streaming dataset from Hugging Face...")
+    try:
+        dataset = load_dataset(dataset_name, name="full", split="train", streaming=True)
+        # Keep the original encoded bytes so rows get the same image_sha256 as uploads.
+        dataset = dataset.cast_column("image", HFImage(decode=False))
+    except Exception as e:
+        print(f"⚠️  Could not load from Hugging Face: {e}")
+        print("Creating realistic sample data instead...")
+        create_sample_data(embedding_service, write_method=write_method)
+        return
+
+    stream = enumerate(dataset)
+    if skip:
+        stream = islice(stream, skip, None)
+    if max_cases is not None:
+        stream = islice(stream, max_cases)
+
+    texts = TextEmbeddingMemo(embedding_service)
+    added = skipped = failed = 0
+    started = time.perf_counter()
+    progress = tqdm(desc="Loading cases", unit="case")
+
+    # Each committed batch bumps the corpus version, so an interrupted load
+    # never leaves cached search results behind the table.
+    with BulkCaseWriter(engine=engine, method=write_method, bump_corpus_version=True) as writer:
+        for batch in batched(stream, batch_size):
+            case_ids = [f"hf_case_{idx:05d}" for idx, _ in batch]
+            existing = writer.existing_case_ids(case_ids)
+
+            records, images = [], []
+            for (idx, item), case_id in zip(batch, case_ids):
+                if case_id in existing:
+                    skipped += 1
+                    continue
+                try:
+                    raw = item['image']['bytes']
+                    images.append(decode_corpus_image(raw))
+                except Exception as e:
+                    print(f"\n❌ Error decoding case {idx}: {e}")
+                    failed += 1
+                    continue
+
+                diagnosis = DIAGNOSIS_MAP.get(item['labels'], 'Unknown')
+                # Seeded per row so a re-run produces identical rows
+                rng = random.Random(idx)
+                records.append({
+                    "case_id": case_id,
+                    "diagnosis": diagnosis,
+                    "findings": f"Chest X-ray demonstrating findings consistent with {diagnosis}",
+                    "modality": "xray",
+                    "body_part": "chest",
+                    "age": str(rng.randint(25, 75)),
+                    "gender": rng.choice(['M', 'F']),
+                    "image_path": f"hf_xray_{idx}.jpg",
+                    "image_url": f"huggingface_xray_{idx}",
+                    "image_sha256": hashlib.sha256(raw).hexdigest(),
+                    "source": "huggingface",
+                })
+
+            if records:
+                # One batched forward pass per modality for the whole batch
+                img_embs = embedding_service.encode_image(images)
+                txt_embs = texts.encode([r["findings"] for r in records])
+                for rec, img_emb, txt_emb in zip(records, img_embs, txt_embs):
+                    rec["image_embedding"] = img_emb
+                    rec["text_embedding"] = txt_emb
+                    rec["embedding_model"] = embedding_service.model_name
+                added += writer.write(records)
+                writer.commit()
+
+            progress.update(len(batch))
+            progress.set_postfix(added=added, skipped=skipped, failed=failed)
+    progress.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"\n🎉 SUCCESS!")
+    print(f"✅ Loaded {added} REAL medical cases in {elapsed:.1f}s "
+          f"({added / elapsed if elapsed else 0:.1f} cases/s); {skipped} already present, {failed} failed")
+    print_stats()
+
+
+def print_stats():
+    print("\n📈 Database Statistics:")
+    db = SessionLocal()
     try:
-        # Try to import datasets
-        try:
-            from datasets import load_dataset
-            print("✅ 'datasets' package found")
-        except ImportError:
-            print("Installing datasets...")
-            import subprocess
-            subprocess.check_call([sys.executable, "-m", "pip", "install", "datasets"])
-            from datasets import load_dataset
-        
-        print("\n📥 Loading dataset from Hugging Face...")
-        
-        # Try to load dataset
-        try:
-            dataset = load_dataset(
-                "keremberke/chest-xray-classification",
-                name="full",
-                split="train",
-                streaming=False
-            )
-            print(f"✅ Loaded dataset with {len(dataset)} images!")
-            
-            max_cases = min(500, len(dataset))
-            dataset = dataset.select(range(max_cases))
-            
-        except Exception as e:
-            print(f"⚠️  Could not load from Hugging Face: {e}")
-            print("Creating realistic sample data instead...")
-            create_sample_data(db, embedding_service)
-            return
-        
-        # Process cases
-        added = 0
-        print(f"\n📊 Processing {len(dataset)} cases...")
-        
-        diagnosis_map = {
-            0: 'Normal',
-            1: 'Pneumonia',
-            2: 'COVID-19'
-        }
-        
-        for idx, item in enumerate(tqdm(dataset, desc="Loading cases")):
-            try:
-                image = item['image']
-                label = item['labels']
-                diagnosis = diagnosis_map.get(label, 'Unknown')
-                findings = f"Chest X-ray demonstrating findings consistent with {diagnosis}"
-                
-                # TRY DIFFERENT METHOD NAMES
-                # Check which method exists and use it
-                if hasattr(embedding_service, 'generate_text_embedding'):
-                    txt_emb = embedding_service.generate_text_embedding(findings)
-                    img_emb = embedding_service.generate_image_embedding(image)
-                elif hasattr(embedding_service, 'encode_text'):
-                    txt_emb = embedding_service.encode_text(findings)
-                    img_emb = embedding_service.encode_image(image)
-                elif hasattr(embedding_service, 'get_text_embedding'):
-                    txt_emb = embedding_service.get_text_embedding(findings)
-                    img_emb = embedding_service.get_image_embedding(image)
-                elif hasattr(embedding_service, 'create_embedding'):
-                    txt_emb = embedding_service.create_embedding(findings, 'text')
-                    img_emb = embedding_service.create_embedding(image, 'image')
-                else:
-                    print(f"❌ Cannot find embedding methods!")
-                    print(f"Available methods: {[m for m in dir(embedding_service) if not m.startswith('_')]}")
-                    create_sample_data(db, embedding_service)
-                    return
-                
-                # Convert embeddings to list, handle numpy arrays
-                if hasattr(txt_emb, 'tolist'):
-                    txt_list = txt_emb.tolist()
-                else:
-                    txt_list = list(txt_emb)
-                
-                if hasattr(img_emb, 'tolist'):
-                    img_list = img_emb.tolist()
-                else:
-                    img_list = list(img_emb)
-                
-                # Flatten if nested (embeddings should be 1D list)
-                if isinstance(txt_list[0], list):
-                    txt_list = txt_list[0]
-                if isinstance(img_list[0], list):
-                    img_list = img_list[0]
-                
-                case = MedicalCase(
-                    case_id=f"hf_case_{idx:05d}",
-                    diagnosis=diagnosis,
-                    findings=findings,
-                    modality="xray",
-                    body_part="chest",
-                    age=random.randint(25, 75),
-                    gender=random.choice(['M', 'F']),
-                    image_path=f"hf_xray_{idx}.jpg",  # Add this
-                    image_url=f"huggingface_xray_{idx}",
-                    text_embedding=txt_list,
-                    image_embedding=img_list
-                )
-                
-                db.add(case)
-                added += 1
-                
-                if added % 50 == 0:
-                    db.commit()
-                    print(f"✅ Added {added} cases...")
-                    
-            except Exception as e:
-                print(f"\n❌ Error processing case {idx}: {e}")
-                continue
-        
-        db.commit()
-        
-        print(f"\n🎉 SUCCESS!")
-        print(f"✅ Loaded {added} REAL medical cases!")
-        
-        # Show stats
-        print("\n📈 Database Statistics:")
         total = db.query(MedicalCase).count()
         print(f"Total cases: {total}")
-        
-        for diag in diagnosis_map.values():
+
+        for diag in DIAGNOSIS_MAP.values():
             count = db.query(MedicalCase).filter(MedicalCase.diagnosis == diag).count()
             print(f"  {diag}: {count} cases")
-        
-    except Exception as e:
-        print(f"\n❌ Error: {e}")
-        import traceback
-        traceback.print_exc()
-        db.rollback()
     finally:
         db.close()
 
-def create_sample_data(db, embedding_service):
+
+def create_sample_data(embedding_service, write_method="copy"):
     """Fallback: Create realistic sample data"""
     print("\n📝 Creating realistic medical sample data...")
-    
+
     cases = [
         ("Pneumonia", "Right lower lobe consolidation with air bronchograms", 45, "M"),
         ("Pneumonia", "Bilateral infiltrates consistent with bacterial pneumonia", 62, "F"),
@@ -196,68 +210,56 @@ def create_sample_data(db, embedding_service):
         ("Normal", "No focal consolidation or effusion", 34, "F"),
         ("Pneumothorax", "Small right pneumothorax", 29, "M"),
     ]
-    
+
     # Multiply to get 100 cases
     cases = cases * 10
-    
-    added = 0
     print(f"Creating {len(cases)} cases...")
-    
-    for idx, (diagnosis, findings, age, gender) in enumerate(tqdm(cases, desc="Creating")):
-        try:
-            txt = f"{diagnosis}. {findings}"
-            
-            # Try different method names
-            if hasattr(embedding_service, 'generate_text_embedding'):
-                txt_emb = embedding_service.generate_text_embedding(txt)
-            elif hasattr(embedding_service, 'encode_text'):
-                txt_emb = embedding_service.encode_text(txt)
-            elif hasattr(embedding_service, 'get_text_embedding'):
-                txt_emb = embedding_service.get_text_embedding(txt)
-            elif hasattr(embedding_service, 'create_embedding'):
-                txt_emb = embedding_service.create_embedding(txt, 'text')
-            else:
-                print("❌ Cannot create embeddings - method not found!")
-                print(f"Available methods: {[m for m in dir(embedding_service) if not m.startswith('_')]}")
-                return
-            
-            # Convert to list and flatten if needed
-            if hasattr(txt_emb, 'tolist'):
-                txt_list = txt_emb.tolist()
-            else:
-                txt_list = list(txt_emb)
-            
-            # Flatten if nested
-            if isinstance(txt_list[0], list):
-                txt_list = txt_list[0]
-            
-            case = MedicalCase(
-                case_id=f"sample_{idx:05d}",
-                diagnosis=diagnosis,
-                findings=findings,
-                modality="xray",
-                body_part="chest",
-                age=age + (idx % 10),
-                gender=gender,
-                image_path=f"sample_{idx}.jpg",  # Add this
-                image_url=f"sample_{idx}",
-                text_embedding=txt_list,
-                image_embedding=txt_list  # Use same for fallback
-            )
-            
-            db.add(case)
-            added += 1
-            
-            if added % 50 == 0:
-                db.commit()
-                
-        except Exception as e:
-            print(f"Error creating case {idx}: {e}")
-            continue
-    
-    db.commit()
+
+    texts = TextEmbeddingMemo(embedding_service)
+    txt_embs = texts.encode([f"{diagnosis}. {findings}" for diagnosis, findings, _, _ in cases])
+
+    records = []
+    for idx, ((diagnosis, findings, age, gender), txt_emb) in enumerate(zip(cases, txt_embs)):
+        records.append({
+            "case_id": f"sample_{idx:05d}",
+            "diagnosis": diagnosis,
+            "findings": findings,
+            "modality": "xray",
+            "body_part": "chest",
+            "age": str(age + (idx % 10)),
+            "gender": gender,
+            "image_path": f"sample_{idx}.jpg",
+            "image_url": f"sample_{idx}",
+            "text_embedding": txt_emb,
+            "image_embedding": txt_emb,  # Use same for fallback
+            "embedding_model": embedding_service.model_name,
+            "source": "custom",
+        })
+
+    with BulkCaseWriter(engine=engine, method=write_method) as writer:
+        added = writer.write(records)
+        writer.commit()
+
+    db = SessionLocal()
+    try:
+        bump_corpus_version(db)
+    finally:
+        db.close()
     print(f"✅ Created {added} sample cases")
     print("\n🎉 Database ready with realistic medical data!")
 
 if __name__ == "__main__":
-    load_from_huggingface()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Load medical cases from Hugging Face")
+    parser.add_argument("--max-cases", type=int, default=None, help="stop after this many stream rows (default: all)")
+    parser.add_argument("--batch-size", type=int, default=32, help="rows per encode/write batch")
+    parser.add_argument("--skip", type=int, default=0, help="resume from this stream position")
+    parser.add_argument("--write-method", choices=["copy", "executemany"], default="copy")
+    parser.add_argument("--dataset", default=DATASET_NAME)
+    args = parser.parse_args()
+    load_from_huggingface(
+        max_cases=args.max_cases,
+        batch_size=args.batch_size,
+        skip=args.skip,
+        write_method=args.write_method,
+        dataset_name=args.dataset,
+    )
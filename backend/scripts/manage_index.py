@@ -0,0 +1,200 @@
+# backend/scripts/manage_index.py
+"""
+Build, rebuild and inspect the pgvector ANN indexes on medical_cases.
+
+Examples:
+    python scripts/manage_index.py status
+    python scripts/manage_index.py build --method hnsw --m 16 --ef-construction 64
+    python scripts/manage_index.py rebuild --method ivfflat          # lists sized from row count
+    python scripts/manage_index.py swap idx_old idx_new
+    python scripts/manage_index.py partial --min-rows 50000  # per-modality partial HNSW
+    python scripts/manage_index.py local build     # export for SEARCH_BACKEND=local
+    python scripts/manage_index.py quantize --quantization halfvec --drop-full
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+current_dir = Path(__file__).parent
+backend_dir = current_dir.parent
+sys.path.insert(0, str(backend_dir))
+
+from app.config import settings
+from app.services.local_index import LocalVectorIndex
+from app.services.index_service import (
+    IndexManager,
+    DEFAULT_INDEX_NAME,
+    OPCLASSES,
+    QUANTIZATIONS,
+    ivfflat_lists_for,
+    quantized_index_name,
+)
+
+
+def print_progress(row):
+    done, total = row.get("blocks_done") or 0, row.get("blocks_total") or 0
+    tuples_done, tuples_total = row.get("tuples_done") or 0, row.get("tuples_total") or 0
+    pct = f"{100.0 * done / total:5.1f}% blocks" if total else f"{tuples_done}/{tuples_total} tuples"
+    print(f"  [{row.get('phase')}] {pct}", flush=True)
+
+
+def build_options(args):
+    return {
+        "column": args.column,
+        "method": args.method,
+        "m": args.m,
+        "ef_construction": args.ef_construction,
+        "lists": args.lists,
+        "distance": args.distance,
+        "maintenance_work_mem": args.maintenance_work_mem,
+        "parallel_workers": args.parallel_workers,
+        "quantization": args.quantization,
+        "progress": None if args.quiet else print_progress,
+    }
+
+
+def cmd_status(mgr, args):
+    rows = mgr.row_count()
+    print(f"Rows in {mgr.table}: ~{rows} (ivfflat lists would be {ivfflat_lists_for(rows)})")
+    for idx in mgr.list_indexes():
+        flag = "" if idx["valid"] else "  INVALID"
+        print(f"- {idx['name']} [{idx['method']}] {idx['size_bytes'] / 1024 / 1024:.1f} MB{flag}")
+        print(f"    {idx['definition']}")
+
+
+def cmd_build(mgr, args):
+    print(f"Building {args.name} ({args.method}) concurrently...")
+    info = mgr.build(args.name, **build_options(args))
+    print(f"Built {info['name']} in {info['build_seconds']:.1f}s")
+    print(f"  {info['ddl']}")
+
+
+def cmd_rebuild(mgr, args):
+    print(f"Rebuilding {args.name} ({args.method}) alongside the current index...")
+    info = mgr.rebuild(args.name, **build_options(args))
+    print(f"Swapped in new {info['name']} after {info['build_seconds']:.1f}s build")
+    print(f"  {info['ddl']}")
+
+
+def cmd_partial(mgr, args):
+    counts = mgr.modality_counts()
+    modalities = args.modality or [m for m, n in sorted(counts.items()) if n >= args.min_rows]
+    if not modalities:
+        print(f"No modality has at least {args.min_rows} rows; nothing to build")
+    for modality in modalities:
+        print(f"Building partial index for modality={modality!r} ({counts.get(modality, 0)} rows)...")
+        info = mgr.build_partial(modality, **build_options(args))
+        print(f"Built {info['name']} in {info['build_seconds']:.1f}s")
+
+
+def cmd_quantize(mgr, args):
+    """Migrate existing data to quantized ANN indexes.
+
+    The float32 columns are left as they are (they feed the exact rerank);
+    the migration is building the expression indexes concurrently, after
+    which EMBEDDING_QUANTIZATION can be switched and the full-precision
+    indexes dropped.
+    """
+    sizes = {i["name"]: i["size_bytes"] for i in mgr.list_indexes()}
+    for column in args.columns:
+        name = quantized_index_name(column, args.quantization)
+        print(f"Building {name} ({args.quantization}, {args.method}) concurrently...")
+        info = mgr.rebuild(name, **{**build_options(args), "column": column})
+        built = {i["name"]: i["size_bytes"] for i in mgr.list_indexes()}
+        full = quantized_index_name(column)
+        before = sizes.get(full)
+        note = f" vs {before / 1024 / 1024:.1f} MB for {full}" if before else ""
+        print(f"Built {name} in {info['build_seconds']:.1f}s: {built[name] / 1024 / 1024:.1f} MB{note}")
+        if args.drop_full and before is not None:
+            mgr.drop(full)
+            print(f"Dropped {full}")
+    print(f"Set EMBEDDING_QUANTIZATION={args.quantization} to search through the new indexes")
+
+
+def cmd_swap(mgr, args):
+    mgr.swap(args.old, args.new)
+    print(f"{args.new} is now {args.old}")
+
+
+def cmd_drop(mgr, args):
+    mgr.drop(args.name)
+    print(f"Dropped {args.name}")
+
+
+def cmd_local(mgr, args):
+    index = LocalVectorIndex(args.dir, dtype=args.dtype).load()
+    if args.action == "build":
+        info = index.build()
+        print(f"Exported {info['rows']} rows to {info['directory']} in {info['seconds']:.1f}s")
+    elif args.action == "refresh":
+        print(f"Pulled {index.refresh()} changed rows")
+    for key, value in index.stats().items():
+        print(f"  {key}: {value}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage pgvector indexes on medical_cases")
+    parser.add_argument("--table", default="medical_cases")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("status", help="show row count and existing indexes")
+
+    for name, help_text in (
+        ("build", "create a new index"),
+        ("rebuild", "build a replacement and swap it in"),
+        ("partial", "(re)build per-modality partial indexes"),
+        ("quantize", "build halfvec/binary indexes for existing data"),
+    ):
+        p = sub.add_parser(name, help=help_text)
+        if name == "quantize":
+            p.add_argument("--columns", nargs="+", default=["image_embedding", "text_embedding"])
+            p.add_argument("--drop-full", action="store_true",
+                           help="drop the full-precision index once its quantized replacement is built")
+        elif name == "partial":
+            p.add_argument("--modality", action="append", help="modality to index (repeatable)")
+            p.add_argument("--min-rows", type=int, default=50000,
+                           help="without --modality: index every modality with at least this many rows")
+        else:
+            p.add_argument("--name", default=DEFAULT_INDEX_NAME)
+        p.add_argument("--column", default="image_embedding")
+        p.add_argument("--method", choices=["hnsw", "ivfflat"], default="hnsw")
+        p.add_argument("--m", type=int, default=16)
+        p.add_argument("--ef-construction", type=int, default=64)
+        p.add_argument("--lists", type=int, default=None, help="ivfflat lists (default: sized from row count)")
+        p.add_argument("--distance", choices=sorted(OPCLASSES), default="cosine")
+        p.add_argument("--maintenance-work-mem", default=None, help="e.g. 2GB")
+        p.add_argument("--parallel-workers", type=int, default=None)
+        p.add_argument("--quiet", action="store_true", help="do not report build progress")
+        p.add_argument("--quantization", choices=QUANTIZATIONS,
+                       default="halfvec" if name == "quantize" else "none")
+
+    p = sub.add_parser("swap", help="replace OLD with the already built NEW index")
+    p.add_argument("old")
+    p.add_argument("new")
+
+    p = sub.add_parser("drop", help="drop an index concurrently")
+    p.add_argument("name")
+
+    p = sub.add_parser("local", help="build or inspect the in-process vector index")
+    p.add_argument("action", choices=["build", "refresh", "status"])
+    p.add_argument("--dir", default=settings.local_index_dir)
+    p.add_argument("--dtype", choices=["float16", "float32"], default=settings.local_index_dtype)
+
+    args = parser.parse_args(argv)
+    mgr = IndexManager(table=args.table)
+    commands = {
+        "status": cmd_status,
+        "build": cmd_build,
+        "rebuild": cmd_rebuild,
+        "partial": cmd_partial,
+        "quantize": cmd_quantize,
+        "swap": cmd_swap,
+        "drop": cmd_drop,
+        "local": cmd_local,
+    }
+    commands[args.command](mgr, args)
+
+
+if __name__ == "__main__":
+    main()
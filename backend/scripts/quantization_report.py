@@ -0,0 +1,122 @@
+# backend/scripts/quantization_report.py
+"""
+Recall@k vs. latency for full-precision and quantized ANN indexes.
+
+Query vectors are sampled from the table and slightly perturbed; ground truth
+is an exact (sequential) scan. Each quantization with an index present is
+measured at several rerank factors, so the trade-off can be read off one table.
+
+Example:
+    python scripts/quantization_report.py --queries 200 --k 10 --rerank 1 2 4 8 --json report.json
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+current_dir = Path(__file__).parent
+backend_dir = current_dir.parent
+sys.path.insert(0, str(backend_dir))
+
+from sqlalchemy import text
+from pgvector.sqlalchemy import Vector
+
+from app.database import SessionLocal
+from app.services.index_service import IndexManager, QUANTIZATIONS, quantized_index_name
+from app.services.search_service import SearchService, EMBEDDING_DIM
+
+
+def sample_queries(db, n, noise, seed):
+    stmt = text("SELECT image_embedding FROM medical_cases ORDER BY random() LIMIT :n").columns(
+        image_embedding=Vector(EMBEDDING_DIM)
+    )
+    db.execute(text("SELECT setseed(:s)"), {"s": (seed % 1000) / 1000.0})
+    vecs = np.array([np.asarray(v, dtype=np.float32) for v in db.execute(stmt, {"n": n}).scalars()])
+    rng = np.random.default_rng(seed)
+    vecs = vecs + rng.normal(scale=noise, size=vecs.shape).astype(np.float32)
+    return vecs / np.linalg.norm(vecs, axis=1, keepdims=True)
+
+
+def ground_truth(db, q, k):
+    db.execute(text("SET LOCAL enable_indexscan = off"))
+    ids = db.execute(
+        SearchService(db)._bind("SELECT id FROM medical_cases ORDER BY image_embedding <=> :q LIMIT :k"),
+        {"q": q.tolist(), "k": k},
+    ).scalars().all()
+    db.rollback()
+    return set(ids)
+
+
+def measure(db, queries, truth, k, quantization, rerank, ef_search):
+    svc = SearchService(db)
+    latencies, recalls = [], []
+    for q, expected in zip(queries, truth):
+        start = time.perf_counter()
+        svc._apply_index_params(ef_search, None)
+        sql, params = svc._build_vector_query(
+            q.tolist(), k, None, None, quantization=quantization, rerank_factor=rerank
+        )
+        ids = [row["id"] for row in svc._execute(sql, params).mappings().all()]
+        latencies.append((time.perf_counter() - start) * 1000.0)
+        db.rollback()
+        recalls.append(len(expected.intersection(ids)) / max(1, len(expected)))
+    lat = np.array(latencies)
+    return {
+        "quantization": quantization,
+        "rerank_factor": rerank,
+        "recall_at_k": float(np.mean(recalls)),
+        "p50_ms": float(np.percentile(lat, 50)),
+        "p95_ms": float(np.percentile(lat, 95)),
+        "p99_ms": float(np.percentile(lat, 99)),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recall@k vs. latency of quantized ANN indexes")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--rerank", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--ef-search", type=int, default=None)
+    parser.add_argument("--noise", type=float, default=0.02, help="perturbation of sampled query vectors")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", default=None, help="also write results to this file")
+    args = parser.parse_args(argv)
+
+    indexes = {i["name"]: i for i in IndexManager().list_indexes()}
+    db = SessionLocal()
+    try:
+        queries = sample_queries(db, args.queries, args.noise, args.seed)
+        print(f"Computing exact top-{args.k} for {len(queries)} queries...")
+        truth = [ground_truth(db, q, args.k) for q in queries]
+
+        results = []
+        for quantization in QUANTIZATIONS:
+            name = quantized_index_name("image_embedding", quantization)
+            if name not in indexes:
+                print(f"- {quantization}: no {name}, skipped")
+                continue
+            size_mb = indexes[name]["size_bytes"] / 1024 / 1024
+            for rerank in args.rerank if quantization != "none" else [1]:
+                row = measure(db, queries, truth, args.k, quantization, rerank, args.ef_search)
+                row["index"] = name
+                row["index_size_mb"] = round(size_mb, 1)
+                results.append(row)
+                print(
+                    f"- {quantization:8s} rerank x{rerank:<2d} recall@{args.k}={row['recall_at_k']:.3f} "
+                    f"p50={row['p50_ms']:.1f}ms p95={row['p95_ms']:.1f}ms p99={row['p99_ms']:.1f}ms "
+                    f"index={size_mb:.1f} MB"
+                )
+    finally:
+        db.close()
+
+    if args.json:
+        Path(args.json).write_text(json.dumps({"k": args.k, "queries": args.queries, "results": results}, indent=2))
+        print(f"Wrote {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+# backend/scripts/reembed.py
+"""
+Re-embed medical_cases with another CLIP model while search keeps serving the
+current vectors, then cut over to the new ones.
+
+Examples:
+    python scripts/reembed.py run --model ViT-B/16        # resumable; re-run after an interruption
+    python scripts/reembed.py run --model ViT-B/16 --max-rows-per-second 5 --image-root /data/images
+    python scripts/reembed.py status
+    python scripts/reembed.py cutover                     # once status shows 100%
+    python scripts/reembed.py cleanup                     # drop the replaced columns later
+    python scripts/reembed.py abort                       # give up; drops the shadow columns
+
+After cutover, set EMBEDDING_MODEL to the new model and restart the API (and
+the embedding worker). Until then its searches answer 503 rather than encode
+queries with a model the stored vectors no longer come from.
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+current_dir = Path(__file__).parent
+backend_dir = current_dir.parent
+sys.path.insert(0, str(backend_dir))
+
+from app.config import settings
+from app.services.reembed import MISSING_IMAGE_POLICIES, ReembedJob
+
+
+def print_progress(p):
+    done = f"{100.0 * p['last_id'] / p['max_id']:5.1f}%" if p["max_id"] else "  -  "
+    print(
+        f"  pass {p['pass']} {done} of ids | {p['embedded']} embedded, {p['failed']} failed | "
+        f"{p['rows_per_second']:.1f} rows/s, paused {p['paused_seconds']:.0f}s",
+        flush=True,
+    )
+    for case_id, reason in p["errors"].items():
+        print(f"    id {case_id}: {reason}", flush=True)
+
+
+def cmd_run(job, args):
+    from app.services.embedding_service import EmbeddingService
+
+    state = job.start(args.model)
+    print(f"Re-embedding into {args.model} (pass {state['pass']}, resuming after id {state['last_id']})")
+    svc = EmbeddingService(device=settings.device, batching=False, model_name=args.model)
+    summary = job.run(
+        svc,
+        batch_size=args.batch_size,
+        max_rows_per_second=args.max_rows_per_second,
+        max_active_queries=args.max_active_queries,
+        missing_image=args.missing_image,
+        progress=None if args.quiet else print_progress,
+    )
+    print(
+        f"Embedded {summary['embedded']} rows in {summary['seconds']:.0f}s; "
+        f"coverage {summary['covered']}/{summary['total']} ({summary['percent']:.1f}%)"
+    )
+    if summary["failed"]:
+        print(f"{len(summary['failed'])} rows failed; fix them (or use --missing-image text) and run again")
+    elif summary["covered"] == summary["total"]:
+        print("Every row is covered; switch over with: reembed.py cutover")
+
+
+def cmd_status(job, args):
+    state = job.state()
+    if state is None:
+        print("No re-embed has been started")
+        return
+    print(f"Target {state['target_model']}: {state['status']} (pass {state['pass']}, last id {state['last_id']})")
+    print(f"  {state['rows_embedded']} rows embedded, {state['rows_failed']} failures recorded")
+    print(f"  started {state['started_at']}, updated {state['updated_at']}")
+    if state["status"] == "running":
+        cov = job.coverage(state["target_model"])
+        print(f"  coverage {cov['covered']}/{cov['total']} ({cov['percent']:.1f}%)")
+    elif state["cutover_at"] is not None:
+        print(f"  cut over at {state['cutover_at']}")
+
+
+def cmd_cutover(job, args):
+    print("Building ANN indexes over the new columns (concurrently), then swapping...")
+    info = job.cutover(lock_timeout_ms=args.lock_timeout_ms)
+    print(f"Cut over {info['rows']} rows to {info['model']}; swapped indexes: {', '.join(info['indexes']) or '-'}")
+    print(f"Searches answer 503 until the API runs with EMBEDDING_MODEL={info['model']}; restart it now")
+    print("Drop the old columns later with: reembed.py cleanup")
+
+
+def cmd_abort(job, args):
+    job.abort()
+    print("Dropped the shadow columns and indexes; search is unchanged")
+
+
+def cmd_cleanup(job, args):
+    job.cleanup()
+    print("Dropped the columns and indexes replaced at the last cutover")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-embed medical_cases with a new CLIP model")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("run", help="start or resume re-embedding into the shadow columns")
+    p.add_argument("--model", required=True, help="CLIP model name, e.g. ViT-B/16")
+    p.add_argument("--batch-size", type=int, default=settings.reembed_batch_size)
+    p.add_argument("--max-rows-per-second", type=float, default=settings.reembed_max_rows_per_second,
+                   help="0 = unthrottled")
+    p.add_argument("--max-active-queries", type=int, default=settings.reembed_max_active_queries,
+                   help="pause while more queries than this are running (0 = never pause)")
+    p.add_argument("--missing-image", choices=MISSING_IMAGE_POLICIES, default="skip",
+                   help="rows whose image file is missing: skip them, or reuse the text vector")
+    p.add_argument("--image-root", action="append", default=[],
+                   help="directory relative image_path values resolve against (repeatable; "
+                        "default: DATA_DIR and UPLOAD_DIR)")
+    p.add_argument("--quiet", action="store_true", help="do not report progress per batch")
+
+    sub.add_parser("status", help="show target model, progress and coverage")
+
+    p = sub.add_parser("cutover", help="swap in the new vectors once coverage is 100%%")
+    p.add_argument("--lock-timeout-ms", type=int, default=5000)
+
+    sub.add_parser("abort", help="drop the shadow columns and forget the run")
+    sub.add_parser("cleanup", help="drop the columns replaced by the last cutover")
+
+    args = parser.parse_args(argv)
+    job = ReembedJob(image_roots=getattr(args, "image_root", None) or ())
+    commands = {
+        "run": cmd_run,
+        "status": cmd_status,
+        "cutover": cmd_cutover,
+        "abort": cmd_abort,
+        "cleanup": cmd_cleanup,
+    }
+    commands[args.command](job, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,133 @@
-﻿from app.routers.search import search_endpoint
-from app.schemas.case import SearchRequest
+﻿from app.routers.search import batch_search_endpoint, search_endpoint, stream_search_endpoint
+from app.schemas.case import BatchSearchRequest, SearchRequest
 from app.database import SessionLocal
+from app.services import search_service
+from app.services.search_service import SearchService
+from app.services.index_service import IndexManager, partial_index_name, quantized_index_name
+from app.config import settings
+from sqlalchemy import text
+import asyncio
+import json
 import traceback
 
+
+async def run_search(req):
+    return await search_endpoint(req)
+
+
+async def run_query_shapes():
+    """Every endpoint's SQL shape once, so a response field that is not a
+    medical_cases column (or any other projection mistake) fails here."""
+    first = await search_endpoint(SearchRequest(query="Pneumonia", limit=2))
+    cursor = json.loads(first.body)["next_cursor"]
+    shapes = {
+        "vector": json.loads(first.body),
+        "grid": json.loads((await search_endpoint(SearchRequest(query="Pneumonia", limit=2, view="grid"))).body),
+        "hybrid": json.loads((await search_endpoint(SearchRequest(query="Pneumonia", limit=2, mode="hybrid"))).body),
+        "batch": json.loads(
+            (
+                await batch_search_endpoint(
+                    BatchSearchRequest(
+                        queries=[
+                            SearchRequest(query="Pneumonia", limit=2, view="grid"),
+                            SearchRequest(query="Pleural effusion", limit=2),
+                        ]
+                    )
+                )
+            ).body
+        ),
+    }
+    if cursor:
+        shapes["cursor"] = json.loads((await search_endpoint(SearchRequest(query="Pneumonia", limit=2, cursor=cursor))).body)
+    stream = await stream_search_endpoint(SearchRequest(query="Pneumonia", limit=2))
+    shapes["stream"] = [
+        json.loads(line)
+        for chunk in [c async for c in stream.body_iterator]
+        for line in (chunk if isinstance(chunk, str) else chunk.decode()).splitlines()
+        if line
+    ]
+    return shapes
+
+
 try:
     db = SessionLocal()
     req = SearchRequest(query="Pneumonia", limit=5)
-    result = search_endpoint(req, db)
-    print("Success:", result)
+    result = asyncio.run(run_search(req))
+    print("Success:", result.headers.get("X-Cache"), result.body.decode())
+
+    shapes = asyncio.run(run_query_shapes())
+    assert all(r["fusion_score"] is not None for r in shapes["hybrid"]["results"]), shapes["hybrid"]
+    assert all(r["clinical_notes"] is None for r in shapes["batch"]["results"][0]["results"]), shapes["batch"]
+    print("Query shape check passed:", ", ".join(shapes))
+
+    # The ANN index must be usable by the search query. Disable seq scans so
+    # the planner picks the index even on a small table; if the query shape
+    # cannot use it (e.g. ORDER BY a computed alias) it still falls back.
+    db.execute(text("SET LOCAL enable_seqscan = off"))
+    explain = SearchService(db).explain_vector_search([0.0] * 511 + [1.0], limit=5)
+    print("Plan indexes:", explain["indexes"])
+    expected_index = quantized_index_name("image_embedding", settings.embedding_quantization)
+    assert expected_index in explain["indexes"], explain["plan"]
+    print("EXPLAIN check passed: vector search uses the ANN index")
+    db.rollback()
+
+    # Filtered searches must come back complete: min(limit, matching rows).
+    svc = SearchService(db)
+    counts = db.execute(text("SELECT modality, body_part, count(*) FROM medical_cases GROUP BY 1, 2")).all()
+    for modality, body_part, n in counts:
+        for limit in (5, 50):
+            res = svc.vector_search([0.0] * 511 + [1.0], limit=limit, modality=modality, body_part=body_part)
+            assert res["total"] == min(limit, n), (modality, body_part, limit, res["total"], n)
+            db.rollback()
+    print(f"Filtered search completeness passed for {len(counts)} filter combinations")
+
+    # Results carry only response fields; grid view also drops the large ones.
+    row = svc.vector_search([0.0] * 511 + [1.0], limit=1, include_details=False)["results"][0]
+    assert "image_embedding" not in row and "clinical_notes" not in row, list(row.keys())
+    # Local-index hydration selects the same projection by id.
+    hydrated = svc.hydrate_many([[(row["id"], 1.0)]], include_details=True)[0]
+    assert [r["id"] for r in hydrated] == [row["id"]], hydrated
+    db.rollback()
+    print("Projection check passed:", sorted(row.keys()))
+
+    # One-round-trip batch search agrees with individual searches.
+    probes = [{"query_embedding": [0.0] * i + [1.0] + [0.0] * (511 - i), "limit": 5} for i in (0, 7, 511)]
+    batch = svc.batch_vector_search(probes)
+    for probe, rows in zip(probes, batch):
+        single = svc.vector_search(probe["query_embedding"], limit=5)["results"]
+        assert [r["id"] for r in rows] == [r["id"] for r in single], (rows, single)
+    db.rollback()
+    print(f"Batch search check passed for {len(probes)} queries")
+
+    # Partial-index strategy: with exact search disabled, a modality that has a
+    # partial ANN index must be searched through it, and completely.
+    modality, n = db.execute(
+        text("SELECT modality, count(*) FROM medical_cases GROUP BY 1 ORDER BY 2 DESC LIMIT 1")
+    ).one()
+    db.rollback()
+    mgr = IndexManager()
+    name = partial_index_name(modality, "image_embedding", settings.embedding_quantization)
+    created = not mgr.is_valid(name)
+    if created:
+        mgr.build_partial(modality, quantization=settings.embedding_quantization)
+    exact_max = settings.exact_search_max_rows
+    settings.exact_search_max_rows = 0
+    search_service._filter_stats._loaded_at = float("-inf")
+    try:
+        db.execute(text("SET LOCAL enable_seqscan = off"))
+        explain = svc.explain_vector_search([0.0] * 511 + [1.0], limit=5, modality=modality)
+        assert explain["strategy"] == "ann_partial", explain["strategy"]
+        assert name in explain["indexes"], explain["plan"]
+        db.rollback()
+        res = svc.vector_search([0.0] * 511 + [1.0], limit=5, modality=modality)
+        assert res["total"] == min(5, n) and all(r["modality"] == modality for r in res["results"]), res
+        db.rollback()
+        print(f"Partial index check passed: {modality} searches use {name}")
+    finally:
+        settings.exact_search_max_rows = exact_max
+        search_service._filter_stats._loaded_at = float("-inf")
+        if created:
+            mgr.drop(name)
 except Exception as e:
     print("ERROR:")
     traceback.print_exc()
@@ -1,64 +1,253 @@
-"""Generate embeddings from CSV and insert into database."""
+"""Generate embeddings from CSV and insert into database.
+
+Streaming pipeline with three stages so no single one serialises the load:
+
+1. decode + CLIP preprocess, in a process pool, one chunk of rows per task
+2. batched CLIP inference on the main process
+3. bulk writes (COPY or execute_values) in large transactions, on a writer thread
+
+After every committed transaction the number of CSV rows fully handled is
+written to a checkpoint file, so an interrupted load resumes where it stopped
+(upserts on case_id make re-processing the last partial batch harmless).
+"""
 import argparse
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
 import pandas as pd
 from sqlalchemy import create_engine
-from sqlalchemy.orm import Session
-import numpy as np
 
 from backend.app.config import settings
-from backend.app.services.embedding_service import get_embedding_service
-from backend.app.models.medical_case import MedicalCase
-from backend.app.database import Base
+from backend.app.services.embedding_service import EmbeddingService, decode_corpus_image
+from backend.app.services.bulk_writer import BulkCaseWriter
+from backend.app.models.medical_case import Base
+
+
+_preprocess = None
+
+
+def _init_worker(preprocess):
+    global _preprocess
+    _preprocess = preprocess
+
+
+def _str_or_none(value):
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    return str(value)
+
+
+def _decode_chunk(rows):
+    """Stage 1 (worker process): read, hash, decode and preprocess a chunk of rows."""
+    start = time.perf_counter()
+    tensors, records, failed = [], [], []
+    for row in rows:
+        try:
+            with open(row["image_path"], "rb") as f:
+                raw = f.read()
+            tensors.append(_preprocess(decode_corpus_image(raw)).numpy())
+            records.append(
+                {
+                    "case_id": row["case_id"],
+                    "age": _str_or_none(row.get("age")),
+                    "gender": _str_or_none(row.get("gender")),
+                    "modality": _str_or_none(row.get("modality")) or "xray",
+                    "body_part": _str_or_none(row.get("body_part")) or "chest",
+                    "diagnosis": _str_or_none(row.get("diagnosis")) or "",
+                    "findings": _str_or_none(row.get("findings")) or "",
+                    "image_path": row["image_path"],
+                    "image_sha256": hashlib.sha256(raw).hexdigest(),
+                    "source": "custom",
+                }
+            )
+        except Exception as e:
+            failed.append((row.get("case_id"), str(e)))
+    batch = np.stack(tensors) if tensors else None
+    return batch, records, failed, time.perf_counter() - start
+
+
+class Checkpoint:
+    def __init__(self, path: Path):
+        self.path = path
 
+    def load(self) -> int:
+        if not self.path.exists():
+            return 0
+        return int(json.loads(self.path.read_text()).get("rows_done", 0))
 
-def main(input_csv: str):
-    print("Loading CLIP embedding service (CPU)...")
-    svc = get_embedding_service(device=settings.device)
+    def save(self, rows_done: int) -> None:
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        tmp.write_text(json.dumps({"rows_done": rows_done, "updated_at": time.time()}))
+        os.replace(tmp, self.path)  # atomic, so a crash never leaves a torn checkpoint
+
+
+class Stats:
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.images = 0
+        self.failed = 0
+        self.decode_s = 0.0  # summed across worker processes
+        self.decode_wait_s = 0.0  # main process blocked waiting on stage 1
+        self.infer_s = 0.0
+        self.write_s = 0.0
+        self.written = 0
+        self.started = time.perf_counter()
+
+    def report(self, prefix: str = "") -> str:
+        wall = time.perf_counter() - self.started
+
+        def rate(n, secs):
+            return f"{n / secs:8.1f}" if secs > 0 else "     n/a"
+
+        return (
+            f"{prefix}images={self.images} written={self.written} failed={self.failed} | img/s "
+            f"decode={rate(self.images, self.decode_s / self.workers)} "
+            f"infer={rate(self.images, self.infer_s)} "
+            f"write={rate(self.written, self.write_s)} "
+            f"overall={rate(self.images, wall)} | waiting on decode {self.decode_wait_s:.1f}s"
+        )
+
+
+def _writer_loop(writer, work: "queue.Queue", checkpoint: Checkpoint, stats: Stats, commit_every: int, errors: list):
+    """Stage 3 (thread): buffer rows, commit in large transactions, then checkpoint."""
+    pending, rows_done = 0, None
+    try:
+        while True:
+            item = work.get()
+            if item is None:
+                break
+            records, done = item
+            t0 = time.perf_counter()
+            stats.written += writer.write(records)
+            pending += len(records)
+            rows_done = done
+            if pending >= commit_every:
+                writer.commit()
+                checkpoint.save(rows_done)
+                pending = 0
+            stats.write_s += time.perf_counter() - t0
+        if rows_done is not None:
+            t0 = time.perf_counter()
+            writer.commit()
+            checkpoint.save(rows_done)
+            stats.write_s += time.perf_counter() - t0
+    except Exception as e:
+        errors.append(e)
+        writer.rollback()
+        # Drain so the producer never blocks on a dead writer.
+        while work.get() is not None:
+            pass
+
+
+def main(
+    input_csv: str,
+    batch_size: int = 64,
+    workers: int = None,
+    write_method: str = "copy",
+    commit_every: int = 5000,
+    checkpoint_path: str = None,
+    resume: bool = True,
+    report_every: float = 10.0,
+):
+    # Always an in-process model, even with EMBEDDING_WORKER_SOCKET set: the
+    # decode workers need its preprocess and batches go straight to
+    # encode_preprocessed, which the worker client does not offer.
+    svc = EmbeddingService(device=settings.device, batching=False)
 
     engine = create_engine(settings.database_url, future=True)
     Base.metadata.create_all(bind=engine)
 
-    df = pd.read_csv(input_csv)
-    success = 0
-    fail = 0
-
-    with Session(engine) as session:
-        for idx, row in df.iterrows():
-            try:
-                img_path = row["image_path"]
-                from PIL import Image
-
-                img = Image.open(img_path).convert("RGB")
-                emb = svc.encode_image(img)
-                if emb.ndim == 2:
-                    vec = emb[0].tolist()
-                else:
-                    vec = emb.tolist()
-
-                mc = MedicalCase(
-                    case_id=row["case_id"],
-                    age=str(row.get("age", "")),
-                    gender=str(row.get("gender", "")),
-                    modality=row.get("modality", "xray"),
-                    body_part=row.get("body_part", "chest"),
-                    diagnosis=row.get("diagnosis", ""),
-                    findings=row.get("findings", ""),
-                    image_path=row["image_path"],
-                    image_embedding=vec,
-                )
-                session.add(mc)
-                session.commit()
-                success += 1
-            except Exception as e:
-                print(f"Failed {row.get('case_id')}: {e}")
-                session.rollback()
-                fail += 1
-
-    print(f"Finished: success={success}, failed={fail}")
+    workers = workers or max(1, (os.cpu_count() or 2) - 1)
+    checkpoint = Checkpoint(Path(checkpoint_path or f"{input_csv}.checkpoint.json"))
+    start_row = checkpoint.load() if resume else 0
+    if start_row:
+        print(f"Resuming after {start_row} rows (checkpoint {checkpoint.path})")
+
+    stats = Stats(workers)
+    work: "queue.Queue" = queue.Queue(maxsize=4)  # bounds rows waiting on the writer
+    errors: list = []
+    # Bumps the corpus version with every commit, so a load that is
+    # interrupted (and resumed later) never leaves search caches stale.
+    writer = BulkCaseWriter(engine=engine, method=write_method, bump_corpus_version=True)
+    writer_thread = threading.Thread(
+        target=_writer_loop, args=(writer, work, checkpoint, stats, commit_every, errors), daemon=True
+    )
+    writer_thread.start()
+
+    chunks = pd.read_csv(input_csv, chunksize=batch_size, skiprows=range(1, start_row + 1))
+    inflight: deque = deque()
+    rows_seen = start_row
+    last_report = time.perf_counter()
+
+    def drain_one():
+        fut, done = inflight.popleft()
+        t0 = time.perf_counter()
+        batch, records, failed, decode_s = fut.result()
+        stats.decode_wait_s += time.perf_counter() - t0
+        stats.decode_s += decode_s
+        stats.failed += len(failed)
+        for case_id, err in failed:
+            print(f"Failed {case_id}: {err}")
+        if batch is not None:
+            t0 = time.perf_counter()
+            emb = svc.encode_preprocessed(batch)  # stage 2
+            stats.infer_s += time.perf_counter() - t0
+            stats.images += len(records)
+            for rec, vec in zip(records, emb):
+                rec["image_embedding"] = vec
+                rec["embedding_model"] = svc.model_name
+        work.put((records, done))
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(svc.preprocess,)) as pool:
+            for df in chunks:
+                rows_seen += len(df)
+                inflight.append((pool.submit(_decode_chunk, df.to_dict("records")), rows_seen))
+                # Keep every worker busy without queueing the whole CSV in memory.
+                while len(inflight) > workers * 2:
+                    drain_one()
+                if errors:
+                    break
+                if time.perf_counter() - last_report >= report_every:
+                    print(stats.report(), flush=True)
+                    last_report = time.perf_counter()
+            while inflight and not errors:
+                drain_one()
+    finally:
+        work.put(None)
+        writer_thread.join()
+        writer.close()
+
+    if errors:
+        raise errors[0]
+
+    print(stats.report("Finished: "))
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--input", dest="input", required=True)
+    parser.add_argument("--batch-size", type=int, default=64, help="images per CLIP forward pass")
+    parser.add_argument("--workers", type=int, default=None, help="decode/preprocess processes")
+    parser.add_argument("--write-method", choices=["copy", "executemany"], default="copy")
+    parser.add_argument("--commit-every", type=int, default=5000, help="rows per transaction")
+    parser.add_argument("--checkpoint", default=None, help="default: <input>.checkpoint.json")
+    parser.add_argument("--no-resume", action="store_true", help="ignore an existing checkpoint")
     args = parser.parse_args()
-    main(args.input)
+    main(
+        args.input,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        write_method=args.write_method,
+        commit_every=args.commit_every,
+        checkpoint_path=args.checkpoint,
+        resume=not args.no_resume,
+    )
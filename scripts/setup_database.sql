@@ -14,19 +14,73 @@ CREATE TABLE IF NOT EXISTS medical_cases (
     clinical_notes text,
     image_path text NOT NULL,
     image_url text,
+    image_sha256 varchar(64),
     image_embedding vector(512) NOT NULL,
     text_embedding vector(512),
+    embedding_model varchar(100),
     source varchar(100) DEFAULT 'custom',
     metadata jsonb,
     created_at timestamptz DEFAULT NOW(),
     updated_at timestamptz DEFAULT NOW()
 );
 
--- Create an HNSW index for fast approximate nearest neighbors
-CREATE INDEX IF NOT EXISTS idx_medical_cases_image_embedding ON medical_cases USING ivfflat (image_embedding vector_cosine_ops) WITH (lists = 100);
+-- Bumped by loaders after writing medical_cases; search result caches key on it
+CREATE TABLE IF NOT EXISTS corpus_version (
+    id integer PRIMARY KEY,
+    version bigint NOT NULL DEFAULT 0,
+    updated_at timestamptz DEFAULT NOW()
+);
+INSERT INTO corpus_version (id, version) VALUES (1, 0) ON CONFLICT (id) DO NOTHING;
+
+-- Columns added after the initial schema (safe to re-run on existing databases)
+ALTER TABLE medical_cases ADD COLUMN IF NOT EXISTS image_sha256 varchar(64);
+-- CLIP model behind image_embedding/text_embedding (NULL: loaded before it was recorded, ViT-B/32)
+ALTER TABLE medical_cases ADD COLUMN IF NOT EXISTS embedding_model varchar(100);
+
+-- Progress of backend/scripts/reembed.py, which re-encodes every row with a new
+-- model into shadow columns and then swaps them in; one row (id = 1)
+CREATE TABLE IF NOT EXISTS embedding_reindex (
+    id integer PRIMARY KEY,
+    target_model varchar(100) NOT NULL,
+    status varchar(20) NOT NULL,
+    pass integer NOT NULL DEFAULT 1,
+    last_id integer NOT NULL DEFAULT 0,
+    rows_embedded bigint NOT NULL DEFAULT 0,
+    rows_failed bigint NOT NULL DEFAULT 0,
+    started_at timestamptz DEFAULT NOW(),
+    updated_at timestamptz DEFAULT NOW(),
+    cutover_at timestamptz,
+    -- model behind image_embedding/text_embedding since the last cutover
+    live_model varchar(100)
+);
+
+-- Lookup of already indexed images by content hash (re-uploads skip CLIP)
+CREATE INDEX IF NOT EXISTS idx_medical_cases_image_sha256 ON medical_cases (image_sha256);
+
+-- B-tree on the filter columns: exact search over small modality/body_part
+-- subsets and the row-count snapshot SearchService uses to pick a strategy.
+-- Per-modality partial HNSW indexes are built with: manage_index.py partial
+CREATE INDEX IF NOT EXISTS idx_medical_cases_modality_body_part ON medical_cases (modality, body_part);
+
+-- HNSW index for fast approximate nearest neighbors. Unlike ivfflat it needs no
+-- training data, so it can be created on the empty table and stays accurate as
+-- rows are added. Tune or rebuild it after bulk loads with:
+--   python backend/scripts/manage_index.py rebuild --m 16 --ef-construction 64
+CREATE INDEX IF NOT EXISTS idx_medical_cases_image_embedding ON medical_cases USING hnsw (image_embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64);
+
+-- Hybrid search: ANN over text_embedding and full-text search over diagnosis/findings.
+-- The to_tsvector expression must match FTS_DOCUMENT in backend/app/services/search_service.py.
+CREATE INDEX IF NOT EXISTS idx_medical_cases_text_embedding ON medical_cases USING hnsw (text_embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64);
+CREATE INDEX IF NOT EXISTS idx_medical_cases_fts ON medical_cases USING gin (to_tsvector('english', coalesce(diagnosis, '') || ' ' || coalesce(findings, '')));
+
+-- Optional quantized ANN indexes (pgvector >= 0.7), searched when EMBEDDING_QUANTIZATION
+-- is halfvec/binary and reranked on the float32 columns. Build them on existing data with:
+--   python backend/scripts/manage_index.py quantize --quantization halfvec
+-- e.g. CREATE INDEX idx_medical_cases_image_embedding_halfvec ON medical_cases
+--        USING hnsw ((CAST(image_embedding AS halfvec(512))) halfvec_cosine_ops);
 
 -- Example helper function for similarity search (simple)
--- Note: adjust for performance tuning and HNSW parameters as needed
+-- Note: set hnsw.ef_search per session/transaction to trade recall for speed
 CREATE OR REPLACE FUNCTION search_similar_cases(query_embedding vector(512), limit_count int DEFAULT 10)
 RETURNS SETOF medical_cases AS $$
 BEGIN
@@ -37,4 +91,5 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
--- Comments: To create a true HNSW index with pgvector later, follow pgvector docs and tune lists/m parameters.
+-- Comments: HNSW requires pgvector >= 0.5.0. For an ivfflat index sized from the
+-- current row count instead, use: manage_index.py rebuild --method ivfflat